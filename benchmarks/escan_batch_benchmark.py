@@ -0,0 +1,116 @@
+# How much faster is importing a list of many AttoM PeakEScan .csv files
+# when they are parsed in several worker processes, rather than one after
+# another in iolite's process?
+#
+# Like importer_benchmark.py this runs outside iolite, e.g.
+#
+#   python benchmarks/escan_batch_benchmark.py --files 1000 --workers 1 2 4 --output escan_batch.json
+#
+# It writes --files synthetic .csv files (one after another in time) and a
+# .escanlist file list naming them, then imports the list with the stand-in
+# 'data', 'IoLog' and 'importer' objects for each number of workers. With
+# one worker the files are parsed in this process. The channels made are
+# compared with those of the one worker import.
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+from datetime import datetime, timedelta
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from importer_benchmark import load_importer, write_escan_csv, git_revision
+
+script = 'attom_escan_importer.py'
+
+
+def write_files(work_dir, files, rows):
+    """
+    Writes files PeakEScan files of rows rows each, a minute apart, and a file
+    list that names them with a glob pattern. Returns the list's name.
+    """
+    start = datetime(2021, 3, 12, 10, 15, 30)
+    for i in range(files):
+        write_escan_csv(os.path.join(work_dir, 'escan_%05i.csv' % i), rows, seed=i,
+                        start=start + timedelta(minutes=i))
+
+    listName = os.path.join(work_dir, 'escans.escanlist')
+    with open(listName, 'w') as f:
+        f.write('escan_*.csv\n')
+
+    return listName
+
+def import_list(listName, workers):
+    module = load_importer(script, listName)
+    module.max_workers = workers
+    start = time.perf_counter()
+    if not module.correct_format():
+        raise RuntimeError('%s rejected %s' % (script, listName))
+    module.import_data()
+    seconds = time.perf_counter() - start
+    if module.IoLog.errors:
+        raise RuntimeError('; '.join(module.IoLog.errors))
+
+    return seconds, {name: (c.time, c.values) for name, c in module.data.channels.items()}
+
+def same_channels(a, b):
+    return a.keys() == b.keys() and all(
+        np.array_equal(a[name][0], b[name][0]) and np.array_equal(a[name][1], b[name][1], equal_nan=True) for name in a)
+
+def main():
+    parser = argparse.ArgumentParser(description='Time importing a list of PeakEScan files with different numbers of worker processes.')
+    parser.add_argument('--files', type=int, default=1000, help='number of files in the list')
+    parser.add_argument('--rows', type=int, default=400, help='rows in each file (a quarter of them are data)')
+    parser.add_argument('--workers', type=int, nargs='+', default=sorted({1, os.cpu_count() or 1}),
+                        help='numbers of worker processes (one case per value, and always 1)')
+    parser.add_argument('--repeat', type=int, default=3, help='imports per case; the fastest is reported')
+    parser.add_argument('--work-dir', help='where to write the files (a temporary directory by default)')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.work_dir) as work_dir:
+        listName = write_files(work_dir, args.files, args.rows)
+
+        results = []
+        serial = None
+        print('%8s %12s %8s %6s' % ('workers', 'seconds', 'speedup', 'same'))
+        # the speedups are relative to parsing in this process
+        for workers in sorted(set(args.workers) | {1}):
+            times = []
+            for i in range(args.repeat):
+                seconds, channels = import_list(listName, workers)
+                times.append(seconds)
+            if serial is None:
+                serial = (min(times), channels)
+            same = same_channels(serial[1], channels)
+
+            results.append({
+                'workers': workers,
+                'seconds': times,
+                'best_seconds': min(times),
+                'speedup': serial[0]/min(times),
+                'same_channels': same,
+            })
+            print('%8i %12.3f %8.2f %6s' % (workers, min(times), serial[0]/min(times), 'yes' if same else 'NO'))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'date': datetime.now().isoformat(),
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'cpu_count': os.cpu_count(),
+                'files': args.files,
+                'rows': args.rows,
+                'results': results,
+            }, f, indent=2)
+
+if __name__ == '__main__':
+    main()
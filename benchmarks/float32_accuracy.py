@@ -0,0 +1,202 @@
+# How much does importing channel values as float32 (single_precision = True
+# in the importers) change downstream results?
+#
+# Like importer_benchmark.py this runs outside iolite, e.g.
+#
+#   python benchmarks/float32_accuracy.py --output float32_accuracy.json
+#
+# It writes a reference Nu Plasma .run file of laser ablation Sr isotope
+# data (alternating gas blanks and ablations, with natural Sr ratios, some
+# mass bias and small Rb and CaAr interferences), imports it with the .run
+# importer in float64 and float32 modes, and runs the calculations of
+# drs/Sr_isotopes.py on both. Baseline subtraction uses the mean of the gas
+# blank before each ablation in place of drs.baselineSubtract(). The
+# results are reduced to the mean and 2SE of each ablation, as iolite does
+# for selections.
+#
+# The DRS calculations are run twice on the float32 import: with the arrays
+# as they come (so numpy does the arithmetic in float32) and converted to
+# float64 first.
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from importer_benchmark import load_importer
+
+masses = [89.0, 88.0, 87.0, 86.5, 86.0, 85.5, 85.0, 84.5, 84.0, 83.0, 82.0, 81.0]
+
+# Integration time per row, and the gas blank and ablation lengths (in rows)
+dwell = 0.2
+blank_rows = 150
+ablation_rows = 300
+
+def write_reference_run(path, n_ablations=40, seed=5):
+    """
+    Writes a .run file in the Laser_Sr.nrf layout with n_ablations ablations,
+    each preceded by a gas blank. Returns the row ranges of the ablations.
+    """
+    rng = np.random.default_rng(seed)
+    rows = n_ablations*(blank_rows + ablation_rows) + blank_rows
+
+    # Natural Sr, Rb and CaAr abundances relative to 88Sr, with exponential
+    # law mass bias
+    beta = -1.9
+    def biased(ratio, mass, reference_mass=87.9056):
+        return ratio*(mass/reference_mass)**beta
+
+    Sr88 = np.zeros(rows)
+    ablations = []
+    for i in range(n_ablations):
+        start = blank_rows + i*(blank_rows + ablation_rows)
+        # a decaying ablation signal of a few volts
+        Sr88[start:start + ablation_rows] = rng.uniform(2, 8)*np.exp(-np.arange(ablation_rows)/400)
+        ablations.append((start + 10, start + ablation_rows - 10))
+
+    values = np.zeros((rows, len(masses)))
+    values[:, 1] = Sr88
+    values[:, 4] = Sr88*biased(1/8.37520938, 85.9093)
+    values[:, 2] = values[:, 4]*biased(0.70918, 86.9089, 85.9093) + Sr88*2e-5*biased(1, 86.90918)
+    values[:, 8] = values[:, 4]*biased(0.056584, 83.9134, 85.9093)
+    values[:, 6] = Sr88*2e-5*0.72165/0.27835*biased(1, 84.9118)
+    values[:, 10] = Sr88*1e-4
+    values[:, 9] = Sr88*1e-4/4.9
+    values[:, [3, 5, 7]] = Sr88[:, np.newaxis]*1e-5
+
+    # gas blank offsets, then Johnson and counting noise
+    values += rng.uniform(1e-5, 5e-4, len(masses))
+    values += rng.normal(0, 1e-5, values.shape) + rng.normal(0, 1, values.shape)*np.sqrt(np.abs(values)*1.6e-8/dwell)
+
+    extra = np.column_stack((np.arange(rows), np.arange(rows)*dwell, np.zeros(rows)))
+    with open(path, 'w') as f:
+        f.write('"Nu Plasma run file"\n"C:\\Nu Plasma\\Laser_Sr.nrf"\n"Reference"\n')
+        f.write('"12/03/2021","10:15:30 AM"\n')
+        for i in range(10):
+            f.write('"Header line %i"\n'%i)
+        f.write('"Spare text"\n')
+        np.savetxt(f, np.column_stack((values, extra)), delimiter=',', fmt=['%.9g']*len(masses) + ['%d', '%.3f', '%d'])
+
+    return ablations
+
+def import_channels(fileName, single_precision):
+    module = load_importer('nu_plasma_run_importer.py', fileName)
+    module.single_precision = single_precision
+    module.import_data()
+    return {c.properties['Mass']: c.values for c in module.data.channels.values()}
+
+def baseline_subtract(channels, ablations):
+    subtracted = {}
+    for mass, values in channels.items():
+        result = np.full_like(values, np.nan)
+        for start, end in ablations:
+            blank = values[start - blank_rows + 10:start - 20]
+            result[start:end] = values[start:end] - blank.mean()
+        subtracted[mass] = result
+
+    return subtracted
+
+def sr_isotopes(channels, RbBias=0.0, CaArBias=0.0):
+    """
+    The calculations of drs/Sr_isotopes.py, on baseline subtracted channels
+    """
+    SrCaAr88 = channels[88.0]
+    SrCaAr86 = channels[86.0]
+    SrRb87 = channels[87.0]
+    Rb85 = channels[85.0]
+    SrCaAr84 = channels[84.0]
+    CaAr83 = channels[83.0]
+    CaAr82 = channels[82.0]
+
+    PFract = (np.log(8.37520938 / (SrCaAr88/SrCaAr86))) / (np.log(87.9056/85.9093))
+    PSrCaAr86 = SrCaAr86 - (CaAr82 * .004 / .647) / np.power((85.9160721 / 81.9210049), PFract)
+    PSrCaAr88 = SrCaAr88 - (CaAr82 * .187 / .647) / np.power((87.9149151 / 81.9210049), PFract)
+    Fract = (np.log(8.37520938/(PSrCaAr88/PSrCaAr86))) / (np.log(87.9056/85.9093))
+    RbFract = Fract * RbBias
+    Rb87 = (Rb85 * 27.8346 / 72.1654) / (np.power((86.90918 / 84.9118), RbFract))
+    Sr87 = SrRb87 - Rb87
+    CaArFract = Fract * CaArBias
+    Ca84 = CaAr82 * 3.22411 / np.power((83.917989 / 81.921122), CaArFract)
+    Sr84 = SrCaAr84 - Ca84
+    Sr86 = SrCaAr86 - ((CaAr82 * .004 / .647) / np.power((85.9160721 / 81.9210049), Fract))
+
+    return {
+        'Sr8786_Uncorr': (SrRb87 / SrCaAr86) * np.power((86.9089 / 85.9093), Fract),
+        'Sr8786_Corr': (Sr87 / Sr86) * np.power((86.9089 / 85.9093), Fract),
+        'Rb87Sr86ratio': (Rb87 / Sr86) * np.power((86.9089 / 85.9093), Fract),
+        'Sr8486_Uncorr': (SrCaAr84 / SrCaAr86) * np.power((83.9134 / 85.9093), Fract),
+        'Sr8486_Corr': (Sr84 / Sr86) * np.power((83.9134 / 85.9093), Fract),
+        'Rb87asPPM': (Rb87 / SrRb87) * 1000000,
+        'inRun8283_Ratio': CaAr82 / CaAr83,
+    }
+
+def integrate(outputs, ablations):
+    """
+    Mean and 2SE of each output over each ablation
+    """
+    results = {}
+    for name, values in outputs.items():
+        means = []
+        two_se = []
+        for start, end in ablations:
+            v = np.asarray(values[start:end], dtype=np.float64)
+            v = v[np.isfinite(v)]
+            means.append(v.mean())
+            two_se.append(2*v.std(ddof=1)/np.sqrt(len(v)))
+        results[name] = (np.array(means), np.array(two_se))
+
+    return results
+
+def compare(reference, other):
+    comparison = {}
+    for name, (means, two_se) in reference.items():
+        difference = np.abs(other[name][0] - means)
+        comparison[name] = {
+            'max_difference_ppm': float(np.max(difference/np.abs(means))*1e6),
+            'max_difference_over_2se': float(np.max(difference/two_se)),
+            'median_2se_ppm': float(np.median(two_se/np.abs(means))*1e6),
+        }
+
+    return comparison
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare Sr isotope DRS results after float64 and float32 imports.')
+    parser.add_argument('--ablations', type=int, default=40)
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        fileName = os.path.join(work_dir, 'reference.run')
+        ablations = write_reference_run(fileName, args.ablations)
+        double = import_channels(fileName, False)
+        single = import_channels(fileName, True)
+
+    channel_errors = {}
+    for mass, values in double.items():
+        signal = values != 0
+        channel_errors[str(mass)] = float(np.max(np.abs(single[mass][signal] - values[signal])/np.abs(values[signal])))
+
+    reference = integrate(sr_isotopes(baseline_subtract(double, ablations)), ablations)
+    results = {
+        'float32 arithmetic': compare(reference, integrate(sr_isotopes(baseline_subtract(single, ablations)), ablations)),
+        'float64 arithmetic': compare(reference, integrate(sr_isotopes(baseline_subtract(
+            {mass: values.astype(np.float64) for mass, values in single.items()}, ablations)), ablations)),
+    }
+
+    print('Largest relative change of a channel value: %.2g'%max(channel_errors.values()))
+    for mode, comparison in results.items():
+        print('\nDRS results from the float32 import, %s:'%mode)
+        print('%-16s %16s %16s %16s'%('output', 'max diff (ppm)', 'max diff / 2SE', 'median 2SE (ppm)'))
+        for name, c in comparison.items():
+            print('%-16s %16.3g %16.3g %16.3g'%(name, c['max_difference_ppm'], c['max_difference_over_2se'], c['median_2se_ppm']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'ablations': args.ablations, 'channel_max_relative_error': channel_errors, 'drs': results}, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,555 @@
+# A throughput benchmark for the importers in ../importer
+#
+# This isn't an iolite plugin: it is run with a normal python interpreter
+# (with numpy and pandas installed), e.g.
+#
+#   python benchmarks/importer_benchmark.py --rows 100000 --output results.json
+#   python benchmarks/importer_benchmark.py --formats nu_run --megabytes 10 100 1000
+#   python benchmarks/importer_benchmark.py --rows 400000 --compression gz xz zst
+#
+# For each format it writes a synthetic file, loads the importer with
+# stand-in 'data', 'IoLog' and 'importer' objects in place of the ones iolite
+# provides, and times correct_format() and import_data(). Each case runs in
+# its own process so that the peak memory use of one importer doesn't hide
+# that of the next.
+#
+# The results are printed as a table and, with --output, written as JSON so
+# that runs can be compared over time. To compare with an older version of
+# the importers, check it out somewhere else (e.g. with git worktree) and pass
+# its importer directory with --importer-dir.
+#
+# With --compression each generated file is also compressed, and importing
+# the compressed file directly is compared with decompressing it to disk
+# first and importing that, by wall time and by the bytes read and written
+# (from /proc/self/io, so only on Linux).
+
+import os
+import sys
+import json
+import time
+import types
+import gzip
+import lzma
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import importlib.util
+from datetime import datetime
+
+import numpy as np
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+importer_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'importer')
+
+
+"""
+Synthetic file generators
+
+Each generator writes a file laid out like the real thing, filled with random
+numbers from a seeded generator so that the same arguments always give the
+same file. They return the number of data rows written.
+"""
+
+def write_nu_run(path, rows, columns=12, seed=0):
+    """
+    A Nu Plasma .run file using the Laser_Sr.nrf layout. The importer reads
+    a fixed set of 12 masses, so columns is ignored.
+    """
+    rng = np.random.default_rng(seed)
+    values = rng.random((rows, 12))*10
+    extra = np.column_stack((np.arange(rows), np.arange(rows)*0.2, np.zeros(rows)))
+    with open(path, 'w') as f:
+        f.write('"Nu Plasma run file"\n"C:\\Nu Plasma\\Laser_Sr.nrf"\n"Sample A"\n')
+        f.write('"12/03/2021","10:15:30 AM"\n')
+        for i in range(10):
+            f.write('"Header line %i"\n'%i)
+        f.write('"Spare text"\n')
+        np.savetxt(f, np.column_stack((values, extra)), delimiter=',', fmt=['%.6f']*12 + ['%d', '%.3f', '%d'])
+
+    return rows
+
+def write_nu_sr_run(path, rows, columns=12, seed=1):
+    """
+    A Nu Plasma .run file for the Sr laser method, with footer lines after
+    the data. As for write_nu_run, columns is ignored.
+    """
+    rng = np.random.default_rng(seed)
+    values = rng.random((rows, 12))*10
+    extra = np.column_stack((np.arange(rows), np.arange(rows)*0.2, np.zeros(rows)))
+    with open(path, 'w') as f:
+        f.write('"Nu Plasma run file Sr laser.nrf"\n"C:\\Nu Plasma\\Sr laser.nrf"\n"Sample B"\n')
+        f.write('"12/03/2021","10:15:30 AM"\n')
+        for i in range(5):
+            f.write('"Header line %i"\n'%i)
+        f.write('"Spare text"\n')
+        np.savetxt(f, np.column_stack((values, extra)), delimiter=',', fmt=['%.6f']*12 + ['%d', '%.3f', '%d'])
+        f.write('"Footer line 1"\n"Footer line 2",1\n')
+
+    return rows
+
+# The ion counters' counts per second for 1 V equivalent (CPS/Volts in
+# nu_plasma_UTh_importer.py)
+uth_cps_per_volt = 62500000.0
+
+def write_uth_txt(path, rows, columns=15, seed=2):
+    """
+    A Nu Plasma U-Th .txt file. Each row is one measurement of the 15
+    collectors in 4 groups (2 baselines and 2 cycles), so columns is ignored.
+    The Faradays read up to 10 V, and the two ion counters up to 5e5 counts
+    per second (as volts equivalent), where their dead time correction is a
+    percent or so.
+    """
+    rng = np.random.default_rng(seed)
+    header = [
+        '"Started analysis at 10:15 on Tuesday, March 12, 2021"',
+        '"Sample Name is  Coral-7"',
+        '"Run File = C:\\Nu Plasma\\UThAge_II.nrf"',
+        '"Gains : ",' + ''.join('%.4f,'%g for g in 1 + rng.normal(0, 2e-4, 13)),
+        '"Bucket efficiencys : ",' + ''.join('%.3f,'%e for e in rng.uniform(0.9, 1.0, 13)),
+        '"Ion counting deadtimes : ",19.9,20.0,',
+        '"High Voltage Settings"', '1000,2000,3000,',
+        '"Deflector Settings"', '1.5,2.5,',
+        '"Plasma Settings"', '1300,0.8,13',
+        '"X motor pos = 1.2","Y motor pos = 3.4"',
+        '"Pir 1 = 1e-3","Pir 2 = 2e-3"',
+        '"Ion Counting Settings"', '"IC0 ",1,2', '"IC1 ",3,4', '"Disc ",5', '"Gain ",6',
+    ]
+    header += ['""']*(20 - len(header))
+    values = rng.random((rows, 4, 15))*10
+    # IC0 and IC1 are the 10th and 14th collectors of each group
+    values[:, :, [9, 13]] = rng.random((rows, 4, 2))*5e5/uth_cps_per_volt
+    values = values.reshape(rows, 60)
+    with open(path, 'w', newline='') as f:
+        # U-Th header lines end with a doubled carriage return
+        f.write(''.join(line + '\r\r\n' for line in header))
+        f.write('"Data follows"\n')
+        np.savetxt(f, np.column_stack((values, np.arange(1, rows + 1))), delimiter=',', fmt=['%.6g']*60 + ['%d'])
+        f.write('"End 1"\n"End 2"\n"End 3"\n')
+
+    return rows
+
+def write_escan_csv(path, rows, columns=10, seed=3, start=datetime(2021, 3, 12, 10, 15, 30)):
+    """
+    An AttoM PeakEScan .csv file with columns Sr isotope channels, started at
+    start. Only rows with Step 3 are imported, so a quarter of the rows
+    written count as data.
+    """
+    rng = np.random.default_rng(seed)
+    names = ['Step', 'Timestamp', 'Mode(1)', 'Mass Step(1)'] + ['Sr(%i)'%(77 + i) for i in range(columns)]
+    values = rng.random((rows, columns))*10
+    steps = np.arange(rows) % 4
+    with open(path, 'w') as f:
+        f.write('Analysis Type: "PeakEScan"\nRun:   "Sample C"\nDate: "%s"\n' % start.strftime('%H:%M:%S %d/%m/%Y'))
+        f.write('========\n\n' + ','.join(names) + '\nUnits\n')
+        np.savetxt(f, np.column_stack((steps, np.arange(rows)*0.05, np.ones(rows), np.full(rows, 2), values)),
+                   delimiter=',', fmt=['%d', '%.3f', '%d', '%d'] + ['%.4f']*columns)
+
+    return int(np.count_nonzero(steps == 3))
+
+def write_isotopx_timsdp(path, rows, columns=3, seed=4):
+    """
+    An IsotopX .TIMSDP file with columns mass channels.
+    """
+    rng = np.random.default_rng(seed)
+    names = ['Cycle', 'Time'] + [str(88 - i) for i in range(columns)]
+    values = rng.random((rows, columns))*10
+    with open(path, 'w') as f:
+        f.write('AnalysisStart,12/03/2021 10:15:30\nSampleID, Sample D\nMethod,Sr\n')
+        f.write('#USERTABLES\nTable,1\n#CYCLES\n' + ','.join(names) + '\n')
+        np.savetxt(f, np.column_stack((np.arange(rows), np.arange(rows)*1.1, values)),
+                   delimiter=',', fmt=['%d', '%.2f'] + ['%.5f']*columns)
+        f.write('#BLOCKS\nBlock,1\nBlock,2\n')
+
+    return rows
+
+formats = {
+    'nu_run': ('nu_plasma_run_importer.py', '.run', write_nu_run),
+    'nu_sr_run': ('nu_plasma_Sr_importer.py', '.run', write_nu_sr_run),
+    'nu_uth_txt': ('nu_plasma_UTh_importer.py', '.txt', write_uth_txt),
+    'attom_escan_csv': ('attom_escan_importer.py', '.csv', write_escan_csv),
+    'isotopx_timsdp': ('isotopX_importer.py', '.TIMSDP', write_isotopx_timsdp),
+}
+
+
+"""
+Stand-ins for the objects iolite adds to an importer module
+"""
+
+class StandInLog:
+    def __init__(self):
+        self.errors = []
+        self.warnings = []
+
+    def debug(self, message):
+        pass
+
+    def warning(self, message):
+        self.warnings.append(message)
+
+    def error(self, message):
+        self.errors.append(message)
+
+class StandInMetadata:
+    def __init__(self):
+        self.properties = {}
+
+    def setProperty(self, name, value):
+        self.properties[name] = value
+
+class StandInTimeSeries(StandInMetadata):
+    def __init__(self, name, time, values):
+        super().__init__()
+        self.name = name
+        self.time = np.asarray(time)
+        self.values = np.asarray(values)
+
+class StandInData:
+    Input, Intermediate, Output = range(3)
+
+    def __init__(self):
+        self.channels = {}
+
+    def createTimeSeries(self, name, type, time, values, *args):
+        self.channels[name] = StandInTimeSeries(name, time, values)
+        return self.channels[name]
+
+    def addDataToInput(self, name, time, values, metadata):
+        if name in self.channels:
+            channel = self.channels[name]
+            channel.time = np.concatenate((channel.time, time))
+            channel.values = np.concatenate((channel.values, values))
+        else:
+            self.createTimeSeries(name, self.Input, time, values).properties.update(metadata)
+
+    def timeSeries(self, name):
+        return self.channels[name]
+
+    def timeSeriesNames(self, type=None):
+        return list(self.channels)
+
+    def calculateTotalBeam(self):
+        pass
+
+    def createFileSampleMetadata(self, *args):
+        pass
+
+    def createImportedFileMetadata(self, *args):
+        return StandInMetadata()
+
+class StandInImporter:
+    def __init__(self, fileName):
+        self.fileName = fileName
+
+    def message(self, message):
+        pass
+
+    def progress(self, value):
+        pass
+
+    def finished(self):
+        pass
+
+    def addImportedMassSpecFile(self, *args):
+        pass
+
+def install_stand_in_qt():
+    """
+    Importers get Qt through the 'iolite' module, which only exists inside
+    iolite. The importers only need QTimer (for live imports, which aren't
+    benchmarked), so a minimal one will do.
+    """
+    if 'iolite.QtCore' in sys.modules:
+        return
+
+    class Signal:
+        def connect(self, slot):
+            pass
+
+    class QTimer:
+        def __init__(self, *args):
+            self.timeout = Signal()
+
+        def setSingleShot(self, single_shot):
+            pass
+
+        def start(self, ms=None):
+            pass
+
+        def stop(self):
+            pass
+
+    qtcore = types.ModuleType('iolite.QtCore')
+    qtcore.QTimer = QTimer
+    # the DRS stand-ins (sr_mask_benchmark.py) may have made 'iolite' already
+    iolite = sys.modules.setdefault('iolite', types.ModuleType('iolite'))
+    iolite.QtCore = qtcore
+    sys.modules['iolite.QtCore'] = qtcore
+
+def load_importer(script, fileName):
+    install_stand_in_qt()
+    spec = importlib.util.spec_from_file_location(os.path.splitext(script)[0], os.path.join(importer_dir, script))
+    module = importlib.util.module_from_spec(spec)
+    module.data = StandInData()
+    module.IoLog = StandInLog()
+    module.importer = StandInImporter(fileName)
+    spec.loader.exec_module(module)
+    # benchmark parsing rather than the on-disk cache (older importers
+    # don't have one, which is fine too)
+    module.use_cache = False
+    return module
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kilobytes on Linux but bytes on macOS
+    return peak/1024**2 if sys.platform == 'darwin' else peak/1024
+
+
+def io_bytes():
+    """
+    The bytes this process has read and written so far, or None where
+    /proc/self/io isn't available.
+    """
+    try:
+        with open('/proc/self/io') as f:
+            counters = dict(line.split(':') for line in f)
+    except OSError:
+        return None
+
+    return int(counters['rchar']), int(counters['wchar'])
+
+def open_compressed(fileName, compression, mode):
+    if compression == 'gz':
+        return gzip.open(fileName, mode)
+    if compression == 'xz':
+        return lzma.open(fileName, mode)
+    if compression == 'zst':
+        if zstandard is None:
+            raise RuntimeError('zstandard is not installed')
+        if mode == 'wb':
+            return zstandard.ZstdCompressor().stream_writer(open(fileName, mode), closefd=True)
+        return zstandard.ZstdDecompressor().stream_reader(open(fileName, mode), closefd=True)
+    raise ValueError('Unknown compression: %s'%(compression))
+
+def compress_file(fileName, compression):
+    with open(fileName, 'rb') as f, open_compressed(fileName + '.' + compression, compression, 'wb') as out:
+        shutil.copyfileobj(f, out, 1 << 20)
+    os.remove(fileName)
+    return fileName + '.' + compression
+
+def decompress_file(fileName, compression):
+    target = fileName[:-len(compression) - 1]
+    with open_compressed(fileName, compression, 'rb') as f, open(target, 'wb') as out:
+        shutil.copyfileobj(f, out, 1 << 20)
+    return target
+
+
+"""
+Running the benchmarks
+"""
+
+def time_import(script, fileName, single_precision, compression=None):
+    """
+    Imports fileName once, returning the importer module, the seconds taken
+    and the bytes read and written. With compression, the file is first
+    decompressed to disk, and that counts towards the time and bytes too.
+    """
+    io_before = io_bytes()
+    start = time.perf_counter()
+    plain = decompress_file(fileName, compression) if compression else fileName
+    module = load_importer(script, plain)
+    module.single_precision = single_precision
+    # time reading the header too, rather than the importers' shared cache of
+    # it from the last repeat
+    sys.modules.pop(getattr(module, 'header_cache_module', None), None)
+    if not module.correct_format():
+        raise RuntimeError('%s rejected %s'%(script, plain))
+    module.import_data()
+    seconds = time.perf_counter() - start
+    io_after = io_bytes()
+
+    if compression:
+        os.remove(plain)
+    if module.IoLog.errors:
+        raise RuntimeError('%s: %s'%(script, '; '.join(module.IoLog.errors)))
+
+    io = None if io_before is None else [after - before for before, after in zip(io_before, io_after)]
+    return module, seconds, io
+
+def run_case(format_name, rows, columns, repeat, work_dir, single_precision=False, compression=None):
+    """
+    Generates one file and imports it repeat times, returning a dictionary of
+    results. Meant to be run in a fresh process (see run_in_subprocess).
+    """
+    script, extension, generator = formats[format_name]
+    fileName = os.path.join(work_dir, format_name + extension)
+    data_rows = generator(fileName, rows, columns)
+    size = os.path.getsize(fileName)
+    if compression:
+        fileName = compress_file(fileName, compression)
+    rss_before = peak_rss_mb()
+
+    times = []
+    io = None
+    decompress_times = []
+    decompress_io = None
+    for i in range(repeat):
+        module, seconds, io = time_import(script, fileName, single_precision)
+        times.append(seconds)
+        if compression:
+            seconds, decompress_io = time_import(script, fileName, single_precision, compression)[1:]
+            decompress_times.append(seconds)
+
+    best = min(times)
+    rss_after = peak_rss_mb()
+    result = {
+        'format': format_name,
+        'importer': script,
+        'rows': data_rows,
+        'columns': columns,
+        'bytes': size,
+        'repeat': repeat,
+        'single_precision': single_precision,
+        'seconds': times,
+        'best_seconds': best,
+        'mb_per_s': size/1e6/best,
+        'rows_per_s': data_rows/best,
+        'peak_rss_mb': rss_after,
+        'import_rss_mb': None if rss_after is None else rss_after - rss_before,
+        'channels': len(module.data.channels),
+        'io_read_mb': None if io is None else io[0]/1e6,
+        'io_written_mb': None if io is None else io[1]/1e6,
+    }
+    if compression:
+        result.update({
+            'compression': compression,
+            'compressed_bytes': os.path.getsize(fileName),
+            'decompress_first_seconds': decompress_times,
+            'decompress_first_best_seconds': min(decompress_times),
+            'decompress_first_io_read_mb': None if decompress_io is None else decompress_io[0]/1e6,
+            'decompress_first_io_written_mb': None if decompress_io is None else decompress_io[1]/1e6,
+        })
+    return result
+
+def run_in_subprocess(format_name, rows, columns, repeat, work_dir, single_precision=False, compression=None):
+    command = [sys.executable, os.path.abspath(__file__), '--worker', format_name,
+               '--rows', str(rows), '--columns', str(columns), '--repeat', str(repeat),
+               '--work-dir', work_dir, '--importer-dir', importer_dir] + (['--single-precision'] if single_precision else [])
+    if compression:
+        command += ['--compression', compression]
+    result = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        return {'format': format_name, 'rows': rows, 'columns': columns, 'error': result.stderr.strip().splitlines()[-1]}
+
+    return json.loads(result.stdout)
+
+def rows_for_size(format_name, megabytes, columns, work_dir):
+    """
+    The number of rows that makes a file of about megabytes MB, from the size
+    of a small sample file.
+    """
+    script, extension, generator = formats[format_name]
+    fileName = os.path.join(work_dir, format_name + '_sample' + extension)
+    sample_rows = 10000
+    generator(fileName, sample_rows, columns)
+    bytes_per_row = os.path.getsize(fileName)/sample_rows
+    os.remove(fileName)
+    return max(1, int(megabytes*1e6/bytes_per_row))
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=importer_dir,
+                                       stderr=subprocess.DEVNULL, universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the throughput of the importers on synthetic files.')
+    parser.add_argument('--formats', nargs='+', choices=sorted(formats), default=sorted(formats))
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000],
+                        help='number of data rows to generate (one case per value)')
+    parser.add_argument('--megabytes', type=float, nargs='+',
+                        help='generate files of about these sizes in MB instead of --rows (one case per value)')
+    parser.add_argument('--columns', type=int, default=None,
+                        help='number of channels for formats that allow it (default: the usual number for each format)')
+    parser.add_argument('--repeat', type=int, default=3, help='imports per case; the fastest is reported')
+    parser.add_argument('--single-precision', action='store_true', help='import channel values as float32')
+    parser.add_argument('--compression', nargs='+', choices=['gz', 'xz', 'zst'],
+                        help='also import compressed copies of the files (one case per value)')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--work-dir', help='directory for the generated files (default: a temporary directory)')
+    parser.add_argument('--importer-dir', help='directory of the importers to benchmark (default: ../importer)')
+    parser.add_argument('--worker', choices=sorted(formats), help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.importer_dir:
+        global importer_dir
+        importer_dir = os.path.abspath(args.importer_dir)
+
+    if args.worker:
+        columns = args.columns or formats[args.worker][2].__defaults__[0]
+        compression = args.compression[0] if args.compression else None
+        print(json.dumps(run_case(args.worker, args.rows[0], columns, args.repeat, args.work_dir, args.single_precision, compression)))
+        return
+
+    def number(value):
+        return float('nan') if value is None else value
+
+    if args.work_dir:
+        os.makedirs(args.work_dir, exist_ok=True)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = args.work_dir or temp_dir
+        results = []
+        for format_name in args.formats:
+            columns = args.columns or formats[format_name][2].__defaults__[0]
+            if args.megabytes:
+                rows_list = [rows_for_size(format_name, mb, columns, work_dir) for mb in args.megabytes]
+            else:
+                rows_list = args.rows
+            for rows in rows_list:
+                for compression in args.compression or [None]:
+                    result = run_in_subprocess(format_name, rows, columns, args.repeat, work_dir, args.single_precision, compression)
+                    results.append(result)
+                    if 'error' in result:
+                        print('%-16s %10i rows  failed: %s'%(format_name, rows, result['error']))
+                    elif compression:
+                        print('%-16s %10i rows %8.1f MB %4s %8.1f MB: direct %8.3f s %8.1f MB read %8.1f MB written, '
+                              'decompress first %8.3f s %8.1f MB read %8.1f MB written'%(
+                            format_name, result['rows'], result['bytes']/1e6, compression, result['compressed_bytes']/1e6,
+                            result['best_seconds'], number(result['io_read_mb']), number(result['io_written_mb']),
+                            result['decompress_first_best_seconds'], number(result['decompress_first_io_read_mb']),
+                            number(result['decompress_first_io_written_mb'])))
+                    else:
+                        print('%-16s %10i rows %8.1f MB %8.3f s %8.1f MB/s %12.0f rows/s %8.1f MB peak RSS'%(
+                            format_name, result['rows'], result['bytes']/1e6, result['best_seconds'],
+                            result['mb_per_s'], result['rows_per_s'], result['peak_rss_mb'] or float('nan')))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'date': datetime.now().isoformat(),
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'processor': platform.processor(),
+                'cpu_count': os.cpu_count(),
+                'results': results,
+            }, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+# Does an incremental run of the Sr isotopes DRS (the "Only recalculate new
+# data" setting, Incremental) make the same channels as a full run, and how
+# much faster is it?
+#
+# Like sr_mask_benchmark.py this runs outside iolite, e.g.
+#
+#   python benchmarks/sr_incremental_check.py --points 2000000 --steps 5 --output sr_incremental.json
+#
+# A synthetic session (from sr_mask_benchmark.py) is reduced, then data is
+# added to it in steps, as it would be while a session is still being
+# imported, and the DRS is run again incrementally after each step. Its
+# channels are compared with those of a full run on the same data. The last
+# points of each step differ a little from the same points in the next step,
+# like the end of a session does after baseline subtraction and mask trimming,
+# so the incremental run has to redo some of the points it already calculated.
+# The stand-in RM spline is a mean over fixed segments of the session, so it
+# only changes in the last segments when data is added.
+#
+# tests/test_sr_drs_equivalence.py makes the same comparison on a small
+# session with pytest.
+
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import platform
+import contextlib
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from importer_benchmark import git_revision
+from sr_mask_benchmark import StandInTimeSeries, StandInData, load_drs, make_session, settings
+
+script = 'Sr_isotopes.py'
+
+# Points at the end of each step that change in the next one
+settle = 50
+
+# Points per segment of the stand-in RM spline
+segment = 20000
+
+
+class SegmentedSplineData(StandInData):
+    def spline(self, rmName, name):
+        values = self.channels[name].data()
+        spline = np.empty(len(values))
+        for i in range(0, len(values), segment):
+            spline[i:i + segment] = np.nanmean(values[i:i + segment])
+
+        return StandInTimeSeries('spline', self.Intermediate, None, spline)
+
+
+def session_step(channels, mask, points, last):
+    """
+    The first points of the session's channels and mask. Unless this is the
+    last step, the final points are scaled and masked out as they might be
+    before the rest of the session arrives.
+    """
+    step = [StandInTimeSeries(c.name, c.type, c.time()[:points], c.data()[:points].copy(), c.properties()) for c in channels]
+    step_mask = mask[:points].copy()
+    if not last:
+        for c in step:
+            c.data()[-settle:] *= 1 + 1e-6
+        step_mask[-settle:] = np.nan
+
+    return step, step_mask
+
+def run(module, channels, mask):
+    module.data.channels.update({c.name: c for c in channels})
+    module.data.dataChanged.emit()
+    module.drs._mask = mask
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        module.runDRS()
+
+    return time.perf_counter() - start
+
+def made(module):
+    return {name: c.data() for name, c in module.data.channels.items() if c.type != StandInData.Input}
+
+def load(incremental):
+    s = {
+        'IndexChannel': 'TotalBeam', 'ReferenceMaterial': 'RM', 'Mask': True, 'MaskChannel': 'TotalBeam',
+        'MaskCutoff': 0.05, 'MaskTrim': 0.0, 'PropagateError': False, 'CompactMask': True, 'Incremental': incremental,
+    }
+    s.update(settings[script])
+    return load_drs(script, [], s, None, SegmentedSplineData)
+
+def main():
+    parser = argparse.ArgumentParser(description='Check that incremental runs of the Sr isotopes DRS match full runs, and time them.')
+    parser.add_argument('--points', type=int, default=1000000, help='points in the session once all of it has arrived')
+    parser.add_argument('--steps', type=int, default=5, help='steps the last half of the session arrives in')
+    parser.add_argument('--duty-cycle', type=float, default=0.5, help='fraction of the points that the mask lets through')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    channels, mask = make_session(args.points, args.duty_cycle)
+    sizes = [args.points//2 + (args.points - args.points//2)*i//args.steps for i in range(args.steps + 1)]
+
+    incremental = load(True)
+    results = []
+    print('%10s %14s %16s %8s %6s' % ('points', 'full (s)', 'incremental (s)', 'speedup', 'same'))
+    for i, points in enumerate(sizes):
+        step, step_mask = session_step(channels, mask, points, i == len(sizes) - 1)
+        incremental_seconds = run(incremental, step, step_mask)
+
+        full = load(False)
+        full_seconds = run(full, step, step_mask)
+        a, b = made(full), made(incremental)
+        same = a.keys() == b.keys() and all(np.array_equal(a[name], b[name], equal_nan=True) for name in a)
+        # the DRS module and the stand-in data refer to each other, so collect
+        # them before the next step
+        del full, a, b
+        gc.collect()
+
+        results.append({
+            'points': points,
+            'first_run': i == 0,
+            'full_seconds': full_seconds,
+            'incremental_seconds': incremental_seconds,
+            'speedup': full_seconds/incremental_seconds,
+            'same_channels': same,
+        })
+        print('%10i %14.3f %16.3f %8.2f %6s' % (points, full_seconds, incremental_seconds,
+            full_seconds/incremental_seconds, 'yes' if same else 'NO'))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'date': datetime.now().isoformat(),
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'drs': script,
+                'duty_cycle': args.duty_cycle,
+                'results': results,
+            }, f, indent=2)
+
+if __name__ == '__main__':
+    main()
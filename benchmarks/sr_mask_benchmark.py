@@ -0,0 +1,320 @@
+# How much faster are the Sr isotope DRSs when they only calculate the masked
+# in data (the "Only calculate masked data" setting, CompactMask), for
+# different fractions of masked in data?
+#
+# Like importer_benchmark.py this runs outside iolite, e.g.
+#
+#   python benchmarks/sr_mask_benchmark.py --points 2000000 --output sr_mask.json
+#
+# For each DRS and duty cycle it makes a synthetic session of ablations
+# separated by gas blanks, with the mask letting through the duty cycle
+# fraction of the points, and times runDRS() with CompactMask off and on.
+# The DRS is loaded with stand-in 'data', 'drs' and 'IoLog' objects in place
+# of the ones iolite provides. The stand-in baseline subtraction does
+# nothing, as it is the same in both modes. The channels made in both modes
+# are also compared.
+
+import os
+import sys
+import gc
+import json
+import time
+import types
+import argparse
+import platform
+import contextlib
+import importlib.util
+from datetime import datetime
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from importer_benchmark import StandInLog, git_revision
+
+drs_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'drs')
+
+settings = {
+    'Sr_isotopes.py': {
+        'RbBias': 1., 'CaArBias': 1.,
+    },
+    'Sr_isotopes_m83.py': {
+        'RbBias': 1., 'CaArBias': 1.,
+    },
+    'Sr_isotopes_CaAr_REE.py': {
+        'Age': 0., 'Dy_Er': 1.8, 'Lu_Yb': 7.0, 'RbBias': 0., 'CaArBias': 0.,
+        'Sr88_86_reference': 8.37520938, 'Rb87_85_reference': 0.385710,
+    },
+}
+
+# Signal on each mass relative to 88 during an ablation
+masses = {
+    88.0: 1.0, 87.5: 1e-5, 87.0: 0.0847, 86.5: 2e-5, 86.0: 0.1194, 85.0: 2.5e-5,
+    84.5: 1e-5, 84.0: 0.00676, 83.5: 1e-5, 83.0: 2e-5, 82.0: 1e-4,
+}
+
+# Points per ablation and gas blank cycle
+cycle = 1000
+
+
+"""
+Stand-ins for the objects iolite adds to a DRS module
+"""
+
+class StandInTimeSeries:
+    def __init__(self, name, type, time, values, properties=None):
+        self.name = name
+        self.type = type
+        self._properties = dict(properties or {})
+        self._time = time
+        self._values = values
+
+    def data(self):
+        return self._values
+
+    def time(self):
+        return self._time
+
+    def setProperty(self, name, value):
+        self._properties[name] = value
+
+    def property(self, name):
+        return self._properties.get(name)
+
+    def properties(self):
+        return dict(self._properties)
+
+class StandInValue:
+    def __init__(self, value):
+        self._value = value
+
+    def value(self):
+        return self._value
+
+class StandInSignal:
+    def __init__(self):
+        self.slots = []
+
+    def connect(self, slot):
+        self.slots.append(slot)
+
+    def disconnect(self, slot):
+        self.slots.remove(slot)
+
+    def emit(self, *args):
+        # slots can disconnect themselves
+        for slot in list(self.slots):
+            slot(*args)
+
+def property_value(value):
+    """
+    Property values compare as numbers when they are numbers (or strings of
+    them), as iolite's QVariants do, so a Mass of 88.0 matches 88 and '88'.
+    """
+    if isinstance(value, bool):
+        return str(value)
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return str(value)
+
+class StandInData:
+    Input, Intermediate, Output, Baseline, ReferenceMaterial, Sample = range(6)
+
+    def __init__(self, channels):
+        self.channels = {c.name: c for c in channels}
+        self.dataChanged = StandInSignal()
+
+    def timeSeries(self, name):
+        return self.channels[name]
+
+    def timeSeriesList(self, type=None, properties=None):
+        # Baseline subtraction is left out, so the input channels stand in
+        # for the baseline subtracted ones
+        types = (type, self.Input) if type == self.Intermediate else (type,)
+        return [c for c in self.channels.values() if (type is None or c.type in types)
+                and all(property_value(c.property(k)) == property_value(v) for k, v in (properties or {}).items())]
+
+    def timeSeriesNames(self, type=None, properties=None):
+        return [c.name for c in self.timeSeriesList(type, properties)]
+
+    def timeSeriesByMass(self, type, mass, tolerance):
+        for c in self.timeSeriesList(type):
+            if c.property('Mass') is not None and abs(float(c.property('Mass')) - mass) < tolerance:
+                return c
+
+        raise IndexError('No channel with mass %s' % mass)
+
+    def createTimeSeries(self, name, type, time, values, properties=None):
+        # iolite keeps its own copy of the values
+        self.channels[name] = StandInTimeSeries(name, type, time, np.array(values, dtype=np.float64), properties)
+        self.dataChanged.emit()
+        return self.channels[name]
+
+    def selectionGroupList(self, type=None):
+        return ['Baseline'] if type == self.Baseline else []
+
+    def updateResults(self):
+        pass
+
+    def spline(self, rmName, name):
+        values = self.channels[name].data()
+        return StandInTimeSeries('spline', self.Intermediate, None, np.full(len(values), np.nanmean(values)))
+
+    def referenceMaterialData(self, rmName):
+        return {'87Sr_86Sr': StandInValue(0.70918)}
+
+class StandInDrs:
+    def __init__(self, settings, mask):
+        self._settings = settings
+        self._mask = mask
+
+    def message(self, message):
+        pass
+
+    def progress(self, value):
+        pass
+
+    def finished(self):
+        pass
+
+    def settings(self):
+        return self._settings
+
+    def setIndexChannel(self, channel):
+        pass
+
+    def createMaskFromCutoff(self, channel, cutoff, trim):
+        return self._mask
+
+    def baselineSubtract(self, group, channels, mask, progressStart, progressEnd):
+        pass
+
+def install_stand_in_qt():
+    """
+    The DRSs import QtGui (and Qt from 'iolite.Qt') from the 'iolite' module,
+    which only exists inside iolite. Only settingsWidget() uses them, and that
+    isn't benchmarked.
+    """
+    iolite = sys.modules.setdefault('iolite', types.ModuleType('iolite'))
+    if not hasattr(iolite, 'QtGui'):
+        iolite.QtGui = None
+    if 'iolite.Qt' not in sys.modules:
+        sys.modules['iolite.Qt'] = types.ModuleType('iolite.Qt')
+        sys.modules['iolite.Qt'].Qt = None
+
+def load_drs(script, channels, settings, mask, data_class=StandInData):
+    install_stand_in_qt()
+    spec = importlib.util.spec_from_file_location(os.path.splitext(script)[0], os.path.join(drs_dir, script))
+    module = importlib.util.module_from_spec(spec)
+    module.data = data_class(channels)
+    module.drs = StandInDrs(settings, mask)
+    module.IoLog = StandInLog()
+    spec.loader.exec_module(module)
+    return module
+
+
+"""
+Running the benchmarks
+"""
+
+def make_session(points, duty_cycle, seed=0, float_masses=False):
+    """
+    Input channels for a session of ablations separated by gas blanks, and a
+    mask (1 during the ablations, NaN elsewhere) that lets duty_cycle of the
+    points through. The channels' Mass properties are strings (e.g. '88'), or
+    floats (88.0) like the .run importer sets them if float_masses is True.
+    """
+    rng = np.random.default_rng(seed)
+    time = np.arange(points)*0.1
+    ablating = (np.arange(points) % cycle) < round(duty_cycle*cycle)
+    mask = np.where(ablating, 1.0, np.nan)
+
+    Sr88 = np.where(ablating, rng.uniform(2, 8, points), 0) + 1e-4
+    channels = [StandInTimeSeries('TotalBeam', StandInData.Input, time, Sr88*1.2)]
+    for mass, abundance in masses.items():
+        values = Sr88*abundance*(1 + rng.normal(0, 1e-3, points))
+        channels.append(StandInTimeSeries('m%g' % mass, StandInData.Input, time, values, {'Mass': mass if float_masses else '%g' % mass}))
+
+    return channels, mask
+
+def run_drs(script, channels, mask, compact, limit=None):
+    s = {
+        'IndexChannel': 'TotalBeam', 'ReferenceMaterial': 'RM', 'Mask': True, 'MaskChannel': 'TotalBeam',
+        'MaskCutoff': 0.05, 'MaskTrim': 0.0, 'PropagateError': False, 'CompactMask': compact,
+    }
+    s.update(settings[script])
+    module = load_drs(script, channels, s, mask)
+    if limit is not None:
+        module.compactMaskLimit = limit
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(open(os.devnull, 'w')):
+        module.runDRS()
+
+    return time.perf_counter() - start, module.data
+
+def run_case(script, points, duty_cycle, repeat, limit=None, float_masses=False):
+    channels, mask = make_session(points, duty_cycle, float_masses=float_masses)
+    timings = {}
+    made = {}
+    for compact in (False, True):
+        times = []
+        for i in range(repeat):
+            seconds, data = run_drs(script, channels, mask, compact, limit)
+            times.append(seconds)
+            made[compact] = {name: c.data() for name, c in data.channels.items() if c.type != StandInData.Input}
+            # the DRS module and the stand-in data refer to each other, so
+            # collect them before the next run
+            del data
+            gc.collect()
+        timings[compact] = min(times)
+
+    same = made[False].keys() == made[True].keys() and all(
+        np.array_equal(made[False][name], made[True][name], equal_nan=True) for name in made[False])
+
+    return {
+        'drs': script,
+        'points': points,
+        'duty_cycle': duty_cycle,
+        'full_seconds': timings[False],
+        'compact_seconds': timings[True],
+        'speedup': timings[False]/timings[True],
+        'same_channels': same,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the Sr isotope DRSs with and without CompactMask for different duty cycles.')
+    parser.add_argument('--drs', nargs='+', choices=sorted(settings), default=sorted(settings))
+    parser.add_argument('--points', type=int, default=1000000)
+    parser.add_argument('--duty-cycles', type=float, nargs='+', default=[0.1, 0.25, 0.5, 0.75, 0.9, 1.0],
+                        help='fractions of the points that the mask lets through (one case per value)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case and mode; the fastest is reported')
+    parser.add_argument('--compact-limit', type=float,
+                        help="use this in place of each DRS's compactMaskLimit, e.g. 1 to time CompactMask at every duty cycle")
+    parser.add_argument('--float-masses', action='store_true', help='give the channels float Mass properties, as the .run importer does')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    args = parser.parse_args()
+
+    results = []
+    print('%-26s %10s %10s %12s %12s %8s %6s' % ('DRS', 'points', 'duty cycle', 'full (s)', 'compact (s)', 'speedup', 'same'))
+    for script in args.drs:
+        for duty_cycle in args.duty_cycles:
+            result = run_case(script, args.points, duty_cycle, args.repeat, args.compact_limit, args.float_masses)
+            results.append(result)
+            print('%-26s %10i %10.2f %12.3f %12.3f %8.2f %6s' % (script, args.points, duty_cycle, result['full_seconds'],
+                result['compact_seconds'], result['speedup'], 'yes' if result['same_channels'] else 'NO'))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({
+                'date': datetime.now().isoformat(),
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'platform': platform.platform(),
+                'compact_limit': args.compact_limit,
+                'float_masses': args.float_masses,
+                'results': results,
+            }, f, indent=2)
+
+if __name__ == '__main__':
+    main()
@@ -118,6 +118,101 @@ def makeBeamSeconds():
     data.timeSeries('BeamSeconds').setProperty('BeamSecondsValue', value)
 
 
+class ChannelCatalog(object):
+    """
+    Finds channels by name, type and property values (e.g. Mass, Element or
+    DRSType) from hash indexes, rather than scanning every channel and its
+    properties on each lookup the way data.timeSeriesList() does. The indexes
+    for a type of channel are built the first time it is looked up and dropped
+    when the data changes. The catalog only listens for data changes while it
+    has indexes, so it doesn't stay connected once it is no longer used.
+    """
+
+    # Width of the buckets that channels are indexed in by mass
+    massBucket = 1.0
+
+    def __init__(self):
+        self.indexes = {}
+        self.connected = False
+
+    @staticmethod
+    def key(value):
+        """
+        Property values as they are indexed and looked up. Numbers, and strings
+        of them, are compared as numbers, so a Mass of 88.0 is found with 88 or
+        '88'. Anything else is compared as a string.
+        """
+        if isinstance(value, bool):
+            return str(value)
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            return str(value)
+
+        return str(value) if np.isnan(number) else number
+
+    def invalidate(self, *args):
+        self.indexes = {}
+        if self.connected:
+            data.dataChanged.disconnect(self.invalidate)
+            self.connected = False
+
+    def index(self, type):
+        if type not in self.indexes:
+            if not self.connected:
+                data.dataChanged.connect(self.invalidate)
+                self.connected = True
+            index = {'channels': data.timeSeriesList(type), 'name': {}, 'property': {}, 'mass': {}}
+            for c in index['channels']:
+                index['name'][c.name] = c
+                for name, value in c.properties().items():
+                    index['property'].setdefault((name, self.key(value)), []).append(c)
+                try:
+                    mass = float(c.property('Mass'))
+                except (TypeError, ValueError):
+                    continue
+                index['mass'].setdefault(int(mass // self.massBucket), []).append((mass, c))
+            self.indexes[type] = index
+
+        return self.indexes[type]
+
+    def timeSeries(self, name, type):
+        return self.index(type)['name'][name]
+
+    def timeSeriesList(self, type, properties=None):
+        """
+        The channels of type with all of the property values in properties, in
+        the same order as data.timeSeriesList().
+        """
+        index = self.index(type)
+        if not properties:
+            return list(index['channels'])
+
+        matches = [index['property'].get((name, self.key(value)), []) for name, value in properties.items()]
+        fewest = min(matches, key=len)
+        others = [set(map(id, m)) for m in matches if m is not fewest]
+        return [c for c in fewest if all(id(c) in o for o in others)]
+
+    def timeSeriesNames(self, type, properties=None):
+        return [c.name for c in self.timeSeriesList(type, properties)]
+
+    def timeSeriesByMass(self, type, mass, tolerance):
+        """
+        The channel of type with the Mass property closest to mass, within
+        tolerance. Raises IndexError if there isn't one.
+        """
+        buckets = self.index(type)['mass']
+        first, last = int((mass - tolerance) // self.massBucket), int((mass + tolerance) // self.massBucket)
+        near = [(abs(m - mass), c) for b in range(first, last + 1) for m, c in buckets.get(b, []) if abs(m - mass) < tolerance]
+        if not near:
+            raise IndexError('No channel with mass %g' % mass)
+
+        return min(near, key=lambda n: n[0])[1]
+
+
+catalog = ChannelCatalog()
+
+
 class Block(object):
 
     def __init__(self, selections, label='Unlabeled'):
@@ -129,7 +224,7 @@ class Block(object):
 
     def hash(self):
         shash = np.sum([s.midTimeInSec for s in self.selections])
-        thash = np.sum([c.hash() for c in data.timeSeriesList(data.Intermediate, {'DRSType': 'BaselineSubtracted'}) if 'TotalBeam' not in c.name])
+        thash = np.sum([c.hash() for c in catalog.timeSeriesList(data.Intermediate, {'DRSType': 'BaselineSubtracted'}) if 'TotalBeam' not in c.name])
         drshash = drs.setting('NormalizeExternals') + np.sum([ord(a) for a in drs.setting('MasterExternal')])
         return shash+thash+drshash
 
@@ -150,49 +245,71 @@ class Block(object):
 
     def dataFrameForChannel(self, name):
         df = self.dataFrame()
-        cols = [col for col in self.df.columns if col.startswith(name)]
-        cols += ['sel_mid_time', 'sel_duration', 'group']
-        df = df[cols]
+        df = df[[name, f'{name}_Uncert', f'{name}_RMppm', f'{name}_RMppm_Uncert', 'sel_mid_time', 'sel_duration', 'group']]
         df = df[df['group'].isin(data.timeSeries(name).property('External standard').split(','))]
         return df
 
     def updateDataFrame(self):
-        self.df = pd.DataFrame()
         ryields, abdf = calculateRelativeYields()
 
         channelNames = [n for n in data.timeSeriesNames(data.Input) if 'TotalBeam' not in n]
         cpsChannels = [data.timeSeries(f'{c}_CPS') for c in channelNames]
+        elements = [c.property('Element') for c in cpsChannels]
+
+        # The values are collected in (selections, channels) arrays and the
+        # frame is made from them in one go
+        shape = (len(self.selections), len(channelNames))
+        values, uncerts, rmValues, rmUncerts = [np.full(shape, np.nan) for i in range(4)]
+        uuids, midTimes, durations, groups = [], [], [], []
 
-        for sel in self.selections:
-            uuid = sel.property('UUID')
-            rmdata = data.referenceMaterialData(sel.group().name)
+        # The RM ppm and uncertainty of each channel, for each group
+        groupRMs = {}
+
+        for i, sel in enumerate(self.selections):
+            groupName = sel.group().name
+            uuids.append(sel.property('UUID'))
+            midTimes.append(float(sel.midTimeInSec))
+            durations.append(float(sel.duration))
+            groups.append(groupName)
 
             # Original approach was to use the nanmedian of ablation factors:
-            norm = ryields[sel.group().name] if drs.setting('NormalizeExternals') else 1
+            norm = ryields[groupName] if drs.setting('NormalizeExternals') else 1
             # There can be noticable Tc dependent variation of af, so going to try fitting that...
             #abdf = abdf.dropna()
             #smx = sm.add_constant(abdf['Tc'], prepend=False)
             #smy = abdf[sel.group().name]
             #res = sm.RLM(smy, smx).fit()
 
-            self.df.loc[uuid, 'sel_mid_time'] = float(sel.midTimeInSec)
-            self.df.loc[uuid, 'sel_duration'] = float(sel.duration)
-            self.df.loc[uuid, 'group'] = sel.group().name
+            if groupName not in groupRMs:
+                rmdata = data.referenceMaterialData(groupName)
+                groupRMs[groupName] = np.full((2, len(elements)), np.nan)
+                for j, element in enumerate(elements):
+                    try:
+                        rmValue = rmdata[element].valueInPPM()
+                        rmUncert = rmdata[element].uncertainty()
+                        groupRMs[groupName][:, j] = rmValue, rmUncert if rmUncert else rmValue*0.02
+                    except:
+                        continue
 
-            for name, channel in zip(channelNames, cpsChannels):
+            for j, channel in enumerate(cpsChannels):
                 try:
                     #norm = linear(res.params, data.elements[channel.property('Element')]['Tcond_Lodders'])
-                    self.df.loc[uuid, name] = data.result(sel, channel).value()/norm
-                    self.df.loc[uuid, f'{name}_Uncert'] = data.result(sel, channel).uncertaintyAs2SE()/(norm)
-                    rmValue = rmdata[channel.property('Element')].valueInPPM()
-                    rmUncert = rmdata[channel.property('Element')].uncertainty()
-                    self.df.loc[uuid, f'{name}_RMppm'] = rmValue
-                    self.df.loc[uuid, f'{name}_RMppm_Uncert'] = rmUncert if rmUncert else rmValue*0.02
+                    result = data.result(sel, channel)
+                    values[i, j] = result.value()/norm
+                    uncerts[i, j] = result.uncertaintyAs2SE()/norm
                 except:
-                    self.df.loc[uuid, f'{name}_RMppm'] = np.nan
-                    self.df.loc[uuid, f'{name}_RMppm_Uncert'] = np.nan
                     continue
 
+                rmValues[i, j], rmUncerts[i, j] = groupRMs[groupName][:, j]
+
+        columns = {'sel_mid_time': midTimes, 'sel_duration': durations, 'group': groups}
+        for j, name in enumerate(channelNames):
+            columns[name] = values[:, j]
+            columns[f'{name}_Uncert'] = uncerts[:, j]
+            columns[f'{name}_RMppm'] = rmValues[:, j]
+            columns[f'{name}_RMppm_Uncert'] = rmUncerts[:, j]
+
+        self.df = pd.DataFrame(columns, index=uuids)
         self.df = self.df.sort_values(by=['sel_mid_time'])
         self.lastDFHash = self.hash()
 
@@ -282,8 +399,7 @@ def calculateRelativeYields():
         masterGroupName = groupNames[0]
     masterGroup = data.selectionGroup(masterGroupName)
 
-    cpsChannelNames = [n for n in data.timeSeriesNames(data.Intermediate, {'DRSType': 'BaselineSubtracted'}) if 'TotalBeam' not in n]
-    cpsChannels = [data.timeSeries(c) for c in cpsChannelNames]
+    cpsChannels = [c for c in catalog.timeSeriesList(data.Intermediate, {'DRSType': 'BaselineSubtracted'}) if 'TotalBeam' not in c.name]
 
     M = np.empty( (len(cpsChannels), len(groupNames)) )
     M.fill(np.nan)
@@ -814,6 +930,7 @@ def runDRS():
 
     # Baseline Subtraction
     drs.baselineSubtract(blGrp, data.timeSeriesList(data.Input), mask, 10, 20)
+    catalog.invalidate()
 
     # Find blocks
     drs.message.emit('Finding blocks')
@@ -1010,6 +1127,7 @@ def runDRS():
 
 
     data.updateResults()
+    catalog.invalidate()
 
     # This bit of code uses the residual of its nearest RM to apply an additional correction
     # Todo: make it configurable
@@ -1019,7 +1137,7 @@ def runDRS():
         extFactors = {}
         for ext in externalsInUse:
             extFactors[ext] = {}
-            for ppmc in data.timeSeriesList(data.Output, {'Units': 'µg.g-1'}):
+            for ppmc in catalog.timeSeriesList(data.Output, {'Units': 'µg.g-1'}):
                 try:
                     rm = data.referenceMaterialData(ext)[ppmc.property('Element')].valueInPPM()
                     meas = data.groupResult(data.selectionGroup(ext), ppmc).value()
@@ -1036,7 +1154,7 @@ def runDRS():
         for sel in sels:
             if sel.group().name in externalsInUse:
                 continue
-            for ppmc in data.timeSeriesList(data.Output, {'Units': 'µg.g-1'}):
+            for ppmc in catalog.timeSeriesList(data.Output, {'Units': 'µg.g-1'}):
                 d = ppmc.data()
                 try:
                     f = extFactors[sel.property('External affinity')][ppmc.name]
@@ -1054,11 +1172,11 @@ def runDRS():
     badSels = []
     for sel in sels:
         badChannels = []
-        for cps in data.timeSeriesList(data.Intermediate):
+        for cps in catalog.timeSeriesList(data.Intermediate):
             if 'CPS' not in cps.name or 'TotalBeam' in cps.name:
                 continue
             try:
-                ppm = data.timeSeries(cps.name.replace('CPS', 'ppm'))
+                ppm = catalog.timeSeries(cps.name.replace('CPS', 'ppm'), data.Output)
                 s = data.result(sel, cps).value()/data.result(sel, ppm).value()
                 sel.setProperty('Sensitivity %s'%(cps.name.replace('_CPS', '')), s)
             except:
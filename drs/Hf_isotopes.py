@@ -7,8 +7,63 @@
 #/ Contact: support@iolite-software.com
 
 from iolite import QtGui
+from iolite.Qt import Qt
 import numpy as np
 
+# The input channels used, by the name used for them below
+inputChannels = {
+	'HfLuYb176': "Hf176_CPS",
+	'Hf177': "Hf177_CPS",
+	'Hf178': "Hf178_CPS",
+	'Hf179': "Hf179_CPS",
+	'Yb171': "Yb171_CPS",
+	'Yb173': "Yb173_CPS",
+	'Lu175': "Lu175_CPS",
+}
+
+# Everything this DRS can calculate, by name. Each definition gets the
+# values it depends on through v(name), so calculating an output only
+# calculates (once) the inputs and intermediate values it needs. The mass
+# bias terms are shared by the outputs that use them.
+definitions = {
+	'HfFract': lambda v, s: (np.log(s["HfTrue"] / (v('Hf179')/v('Hf177')))) / (np.log(178.946 / 176.943))*v('mask'),
+	'YbFract': lambda v, s: (np.log(s["Yb31"] /(v('Yb173')/v('Yb171')))) / (np.log(172.938222 / 170.936338))*v('mask'),
+	'MeanFract': lambda v, s: 0.5*(v('HfFract') + v('YbFract')),
+	'HfBias176': lambda v, s: np.power((175.941 / 176.943) , v('HfFract')),
+	'Yb176': lambda v, s: v('Yb173') * (s["Yb63"] / (np.power((175.942576 / 172.938222) , v('YbFract')))),
+	'Lu176': lambda v, s: v('Lu175') * (0.02656 / (np.power((175.942694 / 174.9408) , v('YbFract')))),
+	'Hf176c': lambda v, s: v('HfLuYb176') - v('Yb176') - v('Lu176'),
+	'LuHf176': lambda v, s: v('HfLuYb176') - v('Yb176'),
+	'YbHf176': lambda v, s: v('HfLuYb176') - v('Lu176'),
+	'Yb_PPM_on_176': lambda v, s: (v('Yb176') / v('HfLuYb176')) * 1000000*v('mask'),
+	'Lu_PPM_on_176': lambda v, s: (v('Lu176') / v('HfLuYb176')) * 1000000*v('mask'),
+	'Hf176_177_Raw': lambda v, s: (v('HfLuYb176') / v('Hf177')) * v('HfBias176')*v('mask'),
+	'Hf176_177_Corr': lambda v, s: (v('Hf176c')/ v('Hf177')) * v('HfBias176')*v('mask'),
+	'Hf176_177_LuCorr': lambda v, s: (v('YbHf176') / v('Hf177')) * v('HfBias176')*v('mask'),
+	'Hf176_177_YbCorr': lambda v, s: (v('LuHf176') / v('Hf177')) * v('HfBias176')*v('mask'),
+	'Hf178_177': lambda v, s: (v('Hf178') / v('Hf177')) * np.power((177.944 / 176.943) , v('HfFract'))*v('mask'),
+	'Lu176_Hf177_Raw': lambda v, s: (v('Lu176') / v('Hf177'))*v('mask'),
+	'Lu176_Hf177_Corr': lambda v, s: (v('Lu176') / v('Hf177')) * np.power((175.942694 / 176.943), v('MeanFract'))*v('mask'),
+	'Yb176_Hf177_Raw': lambda v, s: (v('Yb176') / v('Hf177'))*v('mask'),
+	'Yb176_Hf177_Corr': lambda v, s: (v('Yb176') / v('Hf177')) * np.power((175.942576 / 176.943), v('MeanFract'))*v('mask'),
+	'TotalHfBeam': lambda v, s: v('Hf178') / 0.27297,
+}
+
+# The definitions that can be chosen as outputs. The rest are steps along
+# the way (mass bias and interference corrections). They can be added as
+# intermediate channels, to check them, by choosing them as diagnostic
+# channels in the settings.
+outputChannels = [
+	'Hf176_177_Corr', 'Hf176_177_Raw', 'Hf176_177_LuCorr', 'Hf176_177_YbCorr', 'Hf178_177',
+	'Lu176_Hf177_Raw', 'Lu176_Hf177_Corr', 'Yb176_Hf177_Raw', 'Yb176_Hf177_Corr',
+	'Yb_PPM_on_176', 'Lu_PPM_on_176', 'TotalHfBeam',
+]
+diagnosticChannels = [name for name in definitions if name not in outputChannels]
+
+# Hf176_177_Corr is always output, as the reference material correction
+# needs it
+defaultOutputs = ["Hf176_177_Corr", "Hf178_177", "Lu176_Hf177_Corr"]
+
 def runDRS():
 
 	drs.message("Starting Hf isotopes DRS...")
@@ -23,9 +78,6 @@ def runDRS():
 	rmName = settings["ReferenceMaterial"]
 	cutoff = settings["MaskCutoff"]
 	trim = settings["MaskTrim"]
-	HfTrue = settings["HfTrue"]
-	Yb31 = settings["Yb31"]
-	Yb63 = settings["Yb63"]
 	age = settings["Age"]
 	propErrors = settings["PropagateError"]
 
@@ -51,48 +103,34 @@ def runDRS():
 
 	allInputChannels = data.timeSeriesList(data.Input)
 
-	for counter, channel in enumerate(allInputChannels):
-		drs.message("Baseline subtracting %s" % channel.name)
-		drs.progress(25 + 50*counter/len(allInputChannels))
-
-		drs.baselineSubtract(data.selectionGroup("Baseline_1"), [allInputChannels[counter]], mask, 25, 75)
-
-
-	HfLuYb176 = data.timeSeries("Hf176_CPS").data()
-	Hf177 = data.timeSeries("Hf177_CPS").data()
-	Hf178 = data.timeSeries("Hf178_CPS").data()
-	Hf179 = data.timeSeries("Hf179_CPS").data()
-	Yb171 = data.timeSeries("Yb171_CPS").data()
-	Yb173 = data.timeSeries("Yb173_CPS").data()
-	Lu175 = data.timeSeries("Lu175_CPS").data()
-
-
-	HfFract = (np.log(HfTrue / (Hf179/Hf177))) / (np.log(178.946 / 176.943))*mask
-	YbFract = (np.log(Yb31 /(Yb173/Yb171))) / (np.log(172.938222 / 170.936338))*mask
-	Yb176 = Yb173 * (Yb63 / (np.power((175.942576 / 172.938222) , YbFract)))
-	Lu176 = Lu175 * (0.02656 / (np.power((175.942694 / 174.9408) , YbFract)))
-	Hf176c = HfLuYb176 - Yb176 - Lu176
-	LuHf176 = HfLuYb176 - Yb176
-	YbHf176 = HfLuYb176 - Lu176
-	Yb_PPM_on_176 = (Yb176 / HfLuYb176) * 1000000*mask
-	Lu_PPM_on_176 = (Lu176 / HfLuYb176) * 1000000*mask
-	Hf176_177_Raw = (HfLuYb176 / Hf177) * np.power((175.941 / 176.943) , HfFract)*mask
-	Hf176_177_Corr = (Hf176c/ Hf177) * np.power((175.941 / 176.943) , HfFract)*mask
-	Hf176_177_LuCorr = (YbHf176 / Hf177) * np.power((175.941 / 176.943) , HfFract)*mask
-	Hf176_177_YbCorr = (LuHf176 / Hf177) * np.power((175.941 / 176.943) , HfFract)*mask
-	Hf178_177 = (Hf178 / Hf177) * np.power((177.944 / 176.943) , HfFract)*mask
-	Lu176_Hf177_Raw = (Lu176 / Hf177)*mask
-	Lu176_Hf177_Corr = (Lu176 / Hf177) * np.power((175.942694 / 176.943), (0.5*(HfFract + YbFract)))*mask
-	Yb176_Hf177_Raw = (Yb176 / Hf177)*mask
-	Yb176_Hf177_Corr = (Yb176 / Hf177) * np.power((175.942576 / 176.943), (0.5*(HfFract + YbFract)))*mask
-	TotalHfBeam =  Hf178 / 0.27297
-
-	data.createTimeSeries("Hf176_177_Corr", data.Output, indexChannel.time(), Hf176_177_Corr)
-	data.createTimeSeries("Hf178_177", data.Output, indexChannel.time(), Hf178_177)
-
-        #Adding Lu176/177 ratio here
-	data.createTimeSeries("Lu176_Hf177_Corr", data.Output, indexChannel.time(), Lu176_Hf177_Corr)
-	
+	drs.message("Baseline subtracting %i channels..." % len(allInputChannels))
+	drs.baselineSubtract(data.selectionGroup("Baseline_1"), allInputChannels, mask, 25, 75)
+
+
+	# Only calculate what the chosen outputs need (see definitions above)
+	values = {'mask': mask}
+	def value(name):
+		if name not in values:
+			if name in inputChannels:
+				values[name] = data.timeSeries(inputChannels[name]).data()
+			else:
+				values[name] = definitions[name](value, settings)
+		return values[name]
+
+	drs.message("Calculating outputs...")
+	drs.progress(80)
+
+	outputNames = ["Hf176_177_Corr"] + [name for name in settings.get("Outputs", defaultOutputs) if name in outputChannels and name != "Hf176_177_Corr"]
+	for name in outputNames:
+		data.createTimeSeries(name, data.Output, indexChannel.time(), value(name))
+
+	diagnosticNames = [name for name in settings.get("DiagnosticChannels", []) if name in diagnosticChannels]
+	for name in diagnosticNames:
+		data.createTimeSeries(name, data.Intermediate, indexChannel.time(), value(name))
+
+	Hf176_177_Corr = value("Hf176_177_Corr")
+	IoLog.debug("Calculated %i arrays for %i outputs" % (len(values) - 1, len(outputNames)))
+
 	StdSpline_Hf176_177 = data.spline(rmName, "Hf176_177_Corr").data()
 	StdValue_Hf176_177 = data.referenceMaterialData(rmName)["176Hf/177Hf"].value()
 
@@ -146,6 +184,8 @@ def settingsWidget():
 	drs.setSetting("Yb63", 0.796218)
 	drs.setSetting("Age", 0)
 	drs.setSetting("PropagateError", False)
+	drs.setSetting("Outputs", defaultOutputs)
+	drs.setSetting("DiagnosticChannels", [])
 
 	settings = drs.settings()
 
@@ -202,4 +242,24 @@ def settingsWidget():
 	propCheckBox.toggled.connect(lambda t: drs.setSetting("PropagateError", bool(t)))
 	formLayout.addRow("PropagateError", propCheckBox)	
 
+	outputsList = QtGui.QListWidget(widget)
+	outputsList.addItems(outputChannels)
+	outputsList.setSelectionMode(QtGui.QAbstractItemView.ExtendedSelection)
+	for name in settings["Outputs"]:
+		matches = outputsList.findItems(name, Qt.MatchFixedString)
+		if matches:
+			matches[0].setSelected(True)
+	outputsList.itemSelectionChanged.connect(lambda: drs.setSetting("Outputs", [wi.text() for wi in outputsList.selectedItems()]))
+	formLayout.addRow("Outputs", outputsList)
+
+	diagnosticsList = QtGui.QListWidget(widget)
+	diagnosticsList.addItems(diagnosticChannels)
+	diagnosticsList.setSelectionMode(QtGui.QAbstractItemView.ExtendedSelection)
+	for name in settings["DiagnosticChannels"]:
+		matches = diagnosticsList.findItems(name, Qt.MatchFixedString)
+		if matches:
+			matches[0].setSelected(True)
+	diagnosticsList.itemSelectionChanged.connect(lambda: drs.setSetting("DiagnosticChannels", [wi.text() for wi in diagnosticsList.selectedItems()]))
+	formLayout.addRow("Diagnostic channels", diagnosticsList)
+
 	drs.setSettingsWidget(widget)
@@ -10,6 +10,100 @@ from iolite import QtGui
 import numpy as np
 
 
+class ChannelCatalog(object):
+    """
+    Finds channels by name, type and property values (e.g. Mass, Element or
+    DRSType) from hash indexes, rather than scanning every channel and its
+    properties on each lookup the way data.timeSeriesList() does. The indexes
+    for a type of channel are built the first time it is looked up and dropped
+    when the data changes. The catalog only listens for data changes while it
+    has indexes, so it doesn't stay connected once it is no longer used.
+    """
+
+    # Width of the buckets that channels are indexed in by mass
+    massBucket = 1.0
+
+    def __init__(self):
+        self.indexes = {}
+        self.connected = False
+
+    @staticmethod
+    def key(value):
+        """
+        Property values as they are indexed and looked up. Numbers, and strings
+        of them, are compared as numbers, so a Mass of 88.0 is found with 88 or
+        '88'. Anything else is compared as a string.
+        """
+        if isinstance(value, bool):
+            return str(value)
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            return str(value)
+
+        return str(value) if np.isnan(number) else number
+
+    def invalidate(self, *args):
+        self.indexes = {}
+        if self.connected:
+            data.dataChanged.disconnect(self.invalidate)
+            self.connected = False
+
+    def index(self, type):
+        if type not in self.indexes:
+            if not self.connected:
+                data.dataChanged.connect(self.invalidate)
+                self.connected = True
+            index = {'channels': data.timeSeriesList(type), 'name': {}, 'property': {}, 'mass': {}}
+            for c in index['channels']:
+                index['name'][c.name] = c
+                for name, value in c.properties().items():
+                    index['property'].setdefault((name, self.key(value)), []).append(c)
+                try:
+                    mass = float(c.property('Mass'))
+                except (TypeError, ValueError):
+                    continue
+                index['mass'].setdefault(int(mass // self.massBucket), []).append((mass, c))
+            self.indexes[type] = index
+
+        return self.indexes[type]
+
+    def timeSeries(self, name, type):
+        return self.index(type)['name'][name]
+
+    def timeSeriesList(self, type, properties=None):
+        """
+        The channels of type with all of the property values in properties, in
+        the same order as data.timeSeriesList().
+        """
+        index = self.index(type)
+        if not properties:
+            return list(index['channels'])
+
+        matches = [index['property'].get((name, self.key(value)), []) for name, value in properties.items()]
+        fewest = min(matches, key=len)
+        others = [set(map(id, m)) for m in matches if m is not fewest]
+        return [c for c in fewest if all(id(c) in o for o in others)]
+
+    def timeSeriesNames(self, type, properties=None):
+        return [c.name for c in self.timeSeriesList(type, properties)]
+
+    def timeSeriesByMass(self, type, mass, tolerance):
+        """
+        The channel of type with the Mass property closest to mass, within
+        tolerance. Raises IndexError if there isn't one.
+        """
+        buckets = self.index(type)['mass']
+        first, last = int((mass - tolerance) // self.massBucket), int((mass + tolerance) // self.massBucket)
+        near = [(abs(m - mass), c) for b in range(first, last + 1) for m, c in buckets.get(b, []) if abs(m - mass) < tolerance]
+        if not near:
+            raise IndexError('No channel with mass %g' % mass)
+
+        return min(near, key=lambda n: n[0])[1]
+
+catalog = ChannelCatalog()
+
+
 def runDRS():
 
     drs.message("Starting Rb-Sr isotopes DRS...")
@@ -80,11 +174,10 @@ def runDRS():
         drs.finished()
         return
 
-    for counter, channel in enumerate(allInputChannels):
-        drs.message("Baseline subtracting %s" % channel.name)
-        drs.progress(25 + 50*counter/len(allInputChannels))
+    drs.message("Baseline subtracting %i channels..." % len(allInputChannels))
+    drs.baselineSubtract(blGrp, allInputChannels, mask, 25, 75)
 
-        drs.baselineSubtract(blGrp, [allInputChannels[counter]], mask, 25, 75)
+    for channel in allInputChannels:
         cps_ch = data.timeSeries(channel.name + '_CPS')
         input_ch = data.timeSeries(channel.name)
         cps_ch.setProperty(
@@ -95,15 +188,19 @@ def runDRS():
     drs.message("Calculating raw ratios...")
     drs.progress(50)
 
-    # Declare the channels used in the calculations:
-    Rb85_CPS = data.timeSeriesList(
+    # Declare the channels used in the calculations, looked up from fresh
+    # indexes now that the _CPS channels have their shifted masses:
+    catalog.invalidate()
+    Rb85_CPS = catalog.timeSeriesList(
         data.Intermediate, {'Post-shift mass': '85'})[0].data()
-    Sr86_102_CPS = data.timeSeriesList(
+    Sr86_102_CPS = catalog.timeSeriesList(
         data.Intermediate, {'Post-shift mass': '102'})[0].data()
-    Sr87_103_CPS = data.timeSeriesList(
+    Sr87_103_CPS = catalog.timeSeriesList(
         data.Intermediate, {'Post-shift mass': '103'})[0].data()
-    Sr88_104_CPS = data.timeSeriesList(
+    Sr88_104_CPS = catalog.timeSeriesList(
         data.Intermediate, {'Post-shift mass': '104'})[0].data()
+    # the channels made below change the data, so the indexes aren't kept
+    catalog.invalidate()
 
     Rb87_CPS = Rb85_CPS * 0.38562
     Rb85_Sr86s_Raw = Rb85_CPS/Sr86_102_CPS
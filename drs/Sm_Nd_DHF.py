@@ -64,11 +64,8 @@ def runDRS():
 
 	allInputChannels = data.timeSeriesList(data.Input)
 	
-	for counter, channel in enumerate(allInputChannels):
-		drs.message("Baseline subtracting %s" % channel.name)
-		drs.progress(25 + 50*counter/len(allInputChannels))
-
-		drs.baselineSubtract(data.selectionGroup("Baseline"), [allInputChannels[counter]], mask, 25, 75)
+	drs.message("Baseline subtracting %i channels..." % len(allInputChannels))
+	drs.baselineSubtract(data.selectionGroup("Baseline"), allInputChannels, mask, 25, 75)
 
 
 
@@ -80,40 +77,88 @@ def runDRS():
 	Nd145 = data.timeSeries("Nd145_CPS").data()
 	Nd146 = data.timeSeries("Nd146_CPS").data()
 	Sm147 = data.timeSeries("Sm147_CPS").data()
-	NdSm148 = data.timeSeries("Nd148_CPS").data()
 	Sm149 = data.timeSeries("Sm149_CPS").data()
-	NdSm150 = data.timeSeries("Nd150_CPS").data()
-	
-	SmFract = (np.log(Sm147_149/ (Sm147 / Sm149))) / (np.log(146.9149 / 148.9172 ))	*mask
-	Sm144 = Sm149 * Sm144_149 *(( 148.9172 / 143.912) ** SmFract) 	*mask
-	Sm148 = Sm149 * Sm148_149 *(( 148.9172 / 147.9148 ) ** SmFract) *mask
-	Sm150 = Sm149 * Sm150_149 *(( 148.9172 / 149.91727 ) ** SmFract)*mask
-	Nd144c = (NdSm144 - Sm144)*mask
-	Nd148c = (NdSm148 - Sm148)*mask
-	Nd150c = (NdSm150 - Sm150)
-	NdFract = (np.log(NdTrue / (Nd146 / Nd144c))) / (np.log(145.9131 / 143.9098))*mask
-	NdFractJNdi= (np.log(NdTrue / (Nd146 / NdSm144))) / (np.log(145.9131 / 143.9098))*mask	
-	Nd143_144_Raw = (Nd143 / Nd144c) *mask
-	Nd143_144_Corr = (Nd143 / Nd144c) * (142.9098 / 143.9098) ** NdFract *mask
+
+	# The ratios are calculated in a small pool of preallocated arrays with
+	# in-place ufuncs, rather than making a new full-length temporary for
+	# every operation. Each step keeps the order of operations (including
+	# multiplying by the mask) of the original expression, noted above it, so
+	# the results are bit-for-bit the same.
+	n = len(Nd143)
+	pool = [np.empty(n) for i in range(4)]
+	SmFract, Nd144c, NdFract, NdFractJNdi = pool
+	tmp = np.empty(n)
+
+	# SmFract = (np.log(Sm147_149/ (Sm147 / Sm149))) / (np.log(146.9149 / 148.9172 )) *mask
+	np.divide(Sm147, Sm149, out=SmFract)
+	np.divide(Sm147_149, SmFract, out=SmFract)
+	np.log(SmFract, out=SmFract)
+	SmFract /= np.log(146.9149 / 148.9172 )
+	SmFract *= mask
+
+	# Sm144 = Sm149 * Sm144_149 *(( 148.9172 / 143.912) ** SmFract) *mask
+	# Nd144c = (NdSm144 - Sm144)*mask
+	np.power(( 148.9172 / 143.912), SmFract, out=tmp)
+	np.multiply(Sm149, Sm144_149, out=Nd144c)
+	Nd144c *= tmp
+	Nd144c *= mask
+	np.subtract(NdSm144, Nd144c, out=Nd144c)
+	Nd144c *= mask
+
+	# NdFract = (np.log(NdTrue / (Nd146 / Nd144c))) / (np.log(145.9131 / 143.9098))*mask
+	# NdFractJNdi= (np.log(NdTrue / (Nd146 / NdSm144))) / (np.log(145.9131 / 143.9098))*mask
+	for fract, Nd144 in [(NdFract, Nd144c), (NdFractJNdi, NdSm144)]:
+		np.divide(Nd146, Nd144, out=fract)
+		np.divide(NdTrue, fract, out=fract)
+		np.log(fract, out=fract)
+		fract /= np.log(145.9131 / 143.9098)
+		fract *= mask
+
+	def correctedRatio(numerator, denominator, massRatio, fract):
+		"""
+		(numerator / denominator) * massRatio ** fract *mask, in a new array
+		"""
+		ratio = np.divide(numerator, denominator)
+		np.power(massRatio, fract, out=tmp)
+		ratio *= tmp
+		ratio *= mask
+		return ratio
+
+	Nd143_144_Corr = correctedRatio(Nd143, Nd144c, (142.9098 / 143.9098), NdFract)
+	Nd143_144_Corr_JNdi = correctedRatio(Nd143, NdSm144, (142.9098 / 143.9098), NdFractJNdi)
+	Nd145_144_Corr = correctedRatio(Nd145, Nd144c, (144.9126 / 143.9098), NdFract)
+
+	# Sm147_Nd144_Corr = (Sm147 / Nd144c) *mask
+	Sm147_Nd144_Corr = np.divide(Sm147, Nd144c)
+	Sm147_Nd144_Corr *= mask
+
+	del pool, SmFract, Nd144c, NdFract, NdFractJNdi, tmp
+
+	# Other ratios that can be calculated from these channels, but that
+	# aren't output:
+	#NdSm148 = data.timeSeries("Nd148_CPS").data()
+	#NdSm150 = data.timeSeries("Nd150_CPS").data()
+	#Sm148 = Sm149 * Sm148_149 *(( 148.9172 / 147.9148 ) ** SmFract) *mask
+	#Sm150 = Sm149 * Sm150_149 *(( 148.9172 / 149.91727 ) ** SmFract)*mask
+	#Nd148c = (NdSm148 - Sm148)*mask
+	#Nd150c = (NdSm150 - Sm150)
+	#Nd143_144_Raw = (Nd143 / Nd144c) *mask
 	#Nd143_144_AgeCorr=Nd143_144_Corr-Sm147_Nd144_Raw*(exp(1000000*lambdaSm *age)-1)
-	Nd143_144_Corr_JNdi = (Nd143 / NdSm144) * (142.9098 / 143.9098) ** NdFractJNdi *mask
-	Nd145_144_Raw = (Nd145 / Nd144c) *mask
-	Nd145_144_Corr = (Nd145 / Nd144c) * (144.9126 / 143.9098) ** NdFract *mask
-	Nd145_144_Corr_JNdi = (Nd145 / NdSm144) * (144.9126 / 143.9098) ** NdFractJNdi *mask
-	Nd148_144_Raw = (Nd148c / Nd144c) *mask
-	Nd148_144_Corr = (Nd148c / Nd144c) * ( 147.916889 / 143.9098) ** NdFract *mask
-	Nd148_144_Corr_JNdi = (NdSm148 / NdSm144) * (147.916889 / 143.9098) ** NdFractJNdi *mask
-	Nd150_144_Raw = (Nd150c / Nd144c) *mask
-	Nd150_144_Corr = (Nd150c / Nd144c) * ( 149.920887 / 143.9098) ** NdFract *mask
-	Nd150_144_Corr_JNdi = (NdSm150 / NdSm144) * (149.920887 / 143.9098) ** NdFractJNdi *mask
-	Sm147_Nd144_Corr = (Sm147 / Nd144c) *mask
-	Nd146_144_Raw = (Nd146 / Nd144c)*mask
-	Nd146_144_Raw_JNdi = (Nd146 / NdSm144) *mask
+	#Nd145_144_Raw = (Nd145 / Nd144c) *mask
+	#Nd145_144_Corr_JNdi = (Nd145 / NdSm144) * (144.9126 / 143.9098) ** NdFractJNdi *mask
+	#Nd148_144_Raw = (Nd148c / Nd144c) *mask
+	#Nd148_144_Corr = (Nd148c / Nd144c) * ( 147.916889 / 143.9098) ** NdFract *mask
+	#Nd148_144_Corr_JNdi = (NdSm148 / NdSm144) * (147.916889 / 143.9098) ** NdFractJNdi *mask
+	#Nd150_144_Raw = (Nd150c / Nd144c) *mask
+	#Nd150_144_Corr = (Nd150c / Nd144c) * ( 149.920887 / 143.9098) ** NdFract *mask
+	#Nd150_144_Corr_JNdi = (NdSm150 / NdSm144) * (149.920887 / 143.9098) ** NdFractJNdi *mask
+	#Nd146_144_Raw = (Nd146 / Nd144c)*mask
+	#Nd146_144_Raw_JNdi = (Nd146 / NdSm144) *mask
 	#Nd142 = Nd146Beam * (0.272 / 0.172)	*  (145.9131 / 141.907719) ** NdFract *mask
 	#Ce142 = (NdCe142Beam - Nd142) *mask
 	#Ce_AbN = Ce142 * (1 / .1108) *mask
-	NdFract_SmFract =  NdFract/ SmFract *mask
-	TotalNd = Nd146/0.172 *mask
+	#NdFract_SmFract =  NdFract/ SmFract *mask
+	#TotalNd = Nd146/0.172 *mask
 
 #DF correction
 
@@ -9,7 +9,144 @@
 from iolite import QtGui
 import numpy as np
 
+# CompactMask is only used when the mask lets at most this fraction of the
+# points through. Above it, gathering the masked in data and putting the
+# results back costs more than it saves (see benchmarks/sr_mask_benchmark.py)
+compactMaskLimit = 0.6
+
+def expand(values, inMask):
+	"""
+	Puts values that were only calculated where inMask is True back into a
+	full length array, with NaN everywhere else. If inMask is None the values
+	are already full length.
+	"""
+	if inMask is None:
+		return values
+
+	full = np.full(len(inMask), np.nan)
+	full[inMask] = values
+	return full
+
+# What the last run was given, so that an incremental run (the "Only recalculate
+# new data" setting, Incremental) can tell which points have changed since
+previousRun = None
+
+def firstChange(old, new):
+	"""
+	The index of the first point that differs between the arrays old and new,
+	counting NaN as equal to NaN. If one array starts with the other this is
+	the length of the shorter one.
+	"""
+	n = min(len(old), len(new))
+	with np.errstate(invalid='ignore'):
+		changed = (old[:n] != new[:n]) & ~(np.isnan(old[:n]) & np.isnan(new[:n]))
+
+	return int(np.argmax(changed)) if changed.any() else n
+
+def append(name, values, start):
+	"""
+	The values of the existing channel name up to start, followed by values.
+	"""
+	if start == 0:
+		return values
+
+	return np.concatenate((data.timeSeries(name).data()[:start], values))
+
+class ChannelCatalog(object):
+	"""
+	Finds channels by name, type and property values (e.g. Mass, Element or
+	DRSType) from hash indexes, rather than scanning every channel and its
+	properties on each lookup the way data.timeSeriesList() does. The indexes
+	for a type of channel are built the first time it is looked up and dropped
+	when the data changes. The catalog only listens for data changes while it
+	has indexes, so it doesn't stay connected once it is no longer used.
+	"""
+
+	# Width of the buckets that channels are indexed in by mass
+	massBucket = 1.0
+
+	def __init__(self):
+		self.indexes = {}
+		self.connected = False
+
+	@staticmethod
+	def key(value):
+		"""
+		Property values as they are indexed and looked up. Numbers, and strings
+		of them, are compared as numbers, so a Mass of 88.0 is found with 88 or
+		'88'. Anything else is compared as a string.
+		"""
+		if isinstance(value, bool):
+			return str(value)
+		try:
+			number = float(value)
+		except (TypeError, ValueError):
+			return str(value)
+
+		return str(value) if np.isnan(number) else number
+
+	def invalidate(self, *args):
+		self.indexes = {}
+		if self.connected:
+			data.dataChanged.disconnect(self.invalidate)
+			self.connected = False
+
+	def index(self, type):
+		if type not in self.indexes:
+			if not self.connected:
+				data.dataChanged.connect(self.invalidate)
+				self.connected = True
+			index = {'channels': data.timeSeriesList(type), 'name': {}, 'property': {}, 'mass': {}}
+			for c in index['channels']:
+				index['name'][c.name] = c
+				for name, value in c.properties().items():
+					index['property'].setdefault((name, self.key(value)), []).append(c)
+				try:
+					mass = float(c.property('Mass'))
+				except (TypeError, ValueError):
+					continue
+				index['mass'].setdefault(int(mass // self.massBucket), []).append((mass, c))
+			self.indexes[type] = index
+
+		return self.indexes[type]
+
+	def timeSeries(self, name, type):
+		return self.index(type)['name'][name]
+
+	def timeSeriesList(self, type, properties=None):
+		"""
+		The channels of type with all of the property values in properties, in
+		the same order as data.timeSeriesList().
+		"""
+		index = self.index(type)
+		if not properties:
+			return list(index['channels'])
+
+		matches = [index['property'].get((name, self.key(value)), []) for name, value in properties.items()]
+		fewest = min(matches, key=len)
+		others = [set(map(id, m)) for m in matches if m is not fewest]
+		return [c for c in fewest if all(id(c) in o for o in others)]
+
+	def timeSeriesNames(self, type, properties=None):
+		return [c.name for c in self.timeSeriesList(type, properties)]
+
+	def timeSeriesByMass(self, type, mass, tolerance):
+		"""
+		The channel of type with the Mass property closest to mass, within
+		tolerance. Raises IndexError if there isn't one.
+		"""
+		buckets = self.index(type)['mass']
+		first, last = int((mass - tolerance) // self.massBucket), int((mass + tolerance) // self.massBucket)
+		near = [(abs(m - mass), c) for b in range(first, last + 1) for m, c in buckets.get(b, []) if abs(m - mass) < tolerance]
+		if not near:
+			raise IndexError('No channel with mass %g' % mass)
+
+		return min(near, key=lambda n: n[0])[1]
+
+catalog = ChannelCatalog()
+
 def runDRS():
+	global previousRun
 
 	drs.message("Starting Sr isotopes DRS...")
 	drs.progress(0)
@@ -29,6 +166,8 @@ def runDRS():
 	RbBias = settings["RbBias"]
 	CaArBias = settings["CaArBias"]
 	propErrors = settings["PropagateError"]
+	compactMask = settings.get("CompactMask", True)
+	incremental = settings.get("Incremental", False)
 
 	# Create debug messages for the settings being used
 	IoLog.debug("indexChannelName = %s" % indexChannel.name)
@@ -41,6 +180,8 @@ def runDRS():
 	IoLog.debug("RbBias = %f" % RbBias)
 	IoLog.debug("CaArBias = %f" % CaArBias)
 	IoLog.debug("PropagateErrors = True" if propErrors else "PropagateErrors = False")
+	IoLog.debug("CompactMask = True" if compactMask else "CompactMask = False")
+	IoLog.debug("Incremental = True" if incremental else "Incremental = False")
 
 	# Setup index time
 	drs.message("Setting up index time...")
@@ -74,27 +215,56 @@ def runDRS():
 	else:
 		blGrp = data.selectionGroupList(data.Baseline)[0]
 
-	for counter, channel in enumerate(allInputChannels):
-		drs.message("Baseline subtracting %s" % channel.name)
-		drs.progress(25 + 50*counter/len(allInputChannels))
-
-		drs.baselineSubtract(blGrp, [allInputChannels[counter]], mask, 25, 75)
+	drs.message("Baseline subtracting %i channels..." % len(allInputChannels))
+	drs.baselineSubtract(blGrp, allInputChannels, mask, 25, 75)
 
 	drs.message("Subtracting interferences...")
 	drs.progress(40)
 
-	SrCaAr88 = data.timeSeriesList(data.Intermediate, {'Mass': '88'})[0].data()
-	SrCaAr86 = data.timeSeriesList(data.Intermediate, {'Mass': '86'})[0].data()
-
-	SrCaAr86 = data.timeSeriesList(data.Input, {'Mass': '86'})[0].data()
-
-	Sr86channel = data.timeSeriesList(data.Input, {'Mass': '86'})[0]
-
-	SrRb87 = data.timeSeriesList(data.Intermediate, {'Mass': '87'})[0].data()
-	Rb85 = data.timeSeriesList(data.Intermediate, {'Mass': '85'})[0].data()
-	SrCaAr84 = data.timeSeriesList(data.Intermediate, {'Mass': '84'})[0].data()
-	CaAr83 = data.timeSeriesList(data.Intermediate, {'Mass': '83'})[0].data()
-	CaAr82 = data.timeSeriesList(data.Intermediate, {'Mass': '82'})[0].data()
+	# Look the channels up from fresh indexes, with the ones baseline subtraction
+	# has just made
+	catalog.invalidate()
+	SrCaAr88 = catalog.timeSeriesList(data.Intermediate, {'Mass': '88'})[0].data()
+	SrCaAr86 = catalog.timeSeriesList(data.Intermediate, {'Mass': '86'})[0].data()
+
+	SrCaAr86 = catalog.timeSeriesList(data.Input, {'Mass': '86'})[0].data()
+
+	Sr86channel = catalog.timeSeriesList(data.Input, {'Mass': '86'})[0]
+
+	SrRb87 = catalog.timeSeriesList(data.Intermediate, {'Mass': '87'})[0].data()
+	Rb85 = catalog.timeSeriesList(data.Intermediate, {'Mass': '85'})[0].data()
+	SrCaAr84 = catalog.timeSeriesList(data.Intermediate, {'Mass': '84'})[0].data()
+	CaAr83 = catalog.timeSeriesList(data.Intermediate, {'Mass': '83'})[0].data()
+	CaAr82 = catalog.timeSeriesList(data.Intermediate, {'Mass': '82'})[0].data()
+
+	# The corrections are pointwise, so when only new data has arrived since the
+	# last run (e.g. during a session that is still being imported) they only
+	# need calculating from the first point with changed inputs. Baseline
+	# subtraction and trimming the mask can change the last points of the
+	# previous run too, so the inputs are compared rather than just their lengths
+	inputs = [SrCaAr88, SrCaAr86, SrRb87, Rb85, SrCaAr84, CaAr83, CaAr82, mask]
+	existingNames = catalog.timeSeriesNames(data.Intermediate) + catalog.timeSeriesNames(data.Output)
+	# the channels made below change the data, so the indexes aren't kept
+	catalog.invalidate()
+	start = 0
+	if (incremental and previousRun is not None and previousRun['settings'] == (RbBias, CaArBias)
+			and all(name in existingNames for name in previousRun['channels'])):
+		start = min(firstChange(old, new) for old, new in zip(previousRun['inputs'], inputs))
+		IoLog.debug("Calculating from point %i of %i" % (start, len(mask)))
+
+	SrCaAr88, SrCaAr86, SrRb87, Rb85, SrCaAr84, CaAr83, CaAr82, mask = [c[start:] for c in inputs]
+
+	# Only calculate the corrections where the mask lets data through, which
+	# leaves out the gas blanks and gaps. The results are put back into full
+	# length channels (NaN where masked out) as they are added
+	inMask = None
+	if compactMask:
+		inMask = np.isfinite(mask) & (mask != 0)
+		if inMask.sum() > compactMaskLimit*len(inMask):
+			inMask = None
+		else:
+			IoLog.debug("Calculating %i of %i points" % (inMask.sum(), len(inMask)))
+			SrCaAr88, SrCaAr86, SrRb87, Rb85, SrCaAr84, CaAr83, CaAr82, mask = [c[inMask] for c in (SrCaAr88, SrCaAr86, SrRb87, Rb85, SrCaAr84, CaAr83, CaAr82, mask)]
 
 	PFract = (np.log(8.37520938 / (SrCaAr88/SrCaAr86))) / (np.log(87.9056/85.9093))*mask
 	PSrCaAr86 = SrCaAr86 - (CaAr82 * .004 / .647) / np.power((85.9160721 / 81.9210049), PFract)
@@ -126,24 +296,48 @@ def runDRS():
 	int_channel_names = ['PFract', 'PSrCaAr86', 'PSrCaAr88', 'Fract', 'RbFract', 'Rb87', 'Sr87', 'CaArFract', 'Ca84', 'Sr84', 'Sr88', 'Sr86', 'Rb87asPPM', 'CaAr84asPPM', 'inRun8283_Ratio']
 	int_channels = [PFract, PSrCaAr86, PSrCaAr88, Fract, RbFract, Rb87, Sr87, CaArFract, Ca84, Sr84, Sr88, Sr86, Rb87asPPM, CaAr84asPPM, inRun8283_Ratio]
 	for name, channel in zip(int_channel_names, int_channels):
-		data.createTimeSeries(name, data.Intermediate, indexChannel.time(), channel)
+		data.createTimeSeries(name, data.Intermediate, indexChannel.time(), append(name, expand(channel, inMask), start))
 
 	output_channels_names = ['TotalSrBeam', 'Sr8786_Uncorr', 'Sr8786_Corr', 'Rb87Sr86ratio', 'Sr8486_Uncorr', 'Sr8486_Corr']
 	output_channels = [TotalSrBeam, Sr8786_Uncorr, Sr8786_Corr, Rb87Sr86ratio, Sr8486_Uncorr, Sr8486_Corr]
 	for name, channel in zip(output_channels_names, output_channels):
-		data.createTimeSeries(name, data.Output, indexChannel.time(), channel)
+		data.createTimeSeries(name, data.Output, indexChannel.time(), append(name, expand(channel, inMask), start))
+
+	if not incremental:
+		previousRun = None
+	else:
+		# The spline from the last run is kept when it can still be used
+		if start == 0:
+			previousRun = {}
+		previousRun.update({
+			'settings': (RbBias, CaArBias),
+			'inputs': [np.copy(c) for c in inputs],
+			'channels': int_channel_names + output_channels_names,
+		})
 
 	drs.message("Correcting ratios...")
 	drs.progress(80)
 
+	Sr8786_Corr = data.timeSeries("Sr8786_Corr").data()
 	StdSpline_Sr87_86 = data.spline(rmName, "Sr8786_Corr").data()
 	StdValue_Sr87_86 = data.referenceMaterialData(rmName)["87Sr_86Sr"].value()
 
 	print("StdSpline_Sr87_86 mean = %f"%StdSpline_Sr87_86.mean())
 	print("StdValue_Sr87_86 = %f"%StdValue_Sr87_86)
 
-	StdCorr_Sr87_86 = (Sr8786_Corr) * StdValue_Sr87_86 / StdSpline_Sr87_86
-	data.createTimeSeries('StdCorr_Sr87_86', data.Output, indexChannel.time(), StdCorr_Sr87_86)
+	# The spline only changes where there are new or changed RM selections, so
+	# the correction only needs redoing from the first point where it changed
+	stdStart = 0
+	if incremental and 'spline' in previousRun and previousRun['rmValue'] == StdValue_Sr87_86 and 'StdCorr_Sr87_86' in existingNames:
+		stdStart = min(start, firstChange(previousRun['spline'], StdSpline_Sr87_86))
+		IoLog.debug("Correcting ratios from point %i of %i" % (stdStart, len(StdSpline_Sr87_86)))
+
+	StdCorr_Sr87_86 = (Sr8786_Corr[stdStart:]) * StdValue_Sr87_86 / StdSpline_Sr87_86[stdStart:]
+	data.createTimeSeries('StdCorr_Sr87_86', data.Output, indexChannel.time(), append('StdCorr_Sr87_86', StdCorr_Sr87_86, stdStart))
+
+	if incremental:
+		previousRun['spline'] = np.copy(StdSpline_Sr87_86)
+		previousRun['rmValue'] = StdValue_Sr87_86
 
 
 	if propErrors:
@@ -184,6 +378,8 @@ def settingsWidget():
 	drs.setSetting("MaskChannel", defaultChannelName)
 	drs.setSetting("MaskCutoff", 0.1)
 	drs.setSetting("MaskTrim", 0.0)
+	drs.setSetting("CompactMask", True)
+	drs.setSetting("Incremental", False)
 	#drs.setSetting("Lambda87", 1.42e-11)
 	#drs.setSetting("Age", 0.)
 	drs.setSetting("RbBias", 1.)
@@ -232,6 +428,16 @@ def settingsWidget():
 	maskTrimLineEdit.textChanged.connect(lambda t: drs.setSetting("MaskTrim", float(t)))
 	formLayout.addRow("Mask trim", maskTrimLineEdit)
 
+	compactCheckBox = QtGui.QCheckBox(widget)
+	compactCheckBox.setChecked(settings["CompactMask"])
+	compactCheckBox.toggled.connect(lambda t: drs.setSetting("CompactMask", bool(t)))
+	formLayout.addRow("Only calculate masked data", compactCheckBox)
+
+	incrementalCheckBox = QtGui.QCheckBox(widget)
+	incrementalCheckBox.setChecked(settings["Incremental"])
+	incrementalCheckBox.toggled.connect(lambda t: drs.setSetting("Incremental", bool(t)))
+	formLayout.addRow("Only recalculate new data", incrementalCheckBox)
+
 	verticalSpacer2 = QtGui.QSpacerItem(20, 40, QtGui.QSizePolicy.Minimum, QtGui.QSizePolicy.Minimum)
 	formLayout.addItem(verticalSpacer2)
 
@@ -7,7 +7,451 @@
 #/ Contact: support@iolite-software.com
 
 from iolite import QtGui
+from iolite.Qt import Qt
 import numpy as np
+import time
+
+# The interference correction chain, in the order it is calculated. Each step
+# is (name, operation, arguments) and uses the baseline subtracted input
+# channels, the mask and the steps above it:
+#
+#   beta:         log(Sr88_86_reference / (a/b)) / log(87.9056/85.9093)
+#   interference: monitor * factor / (mass/monitorMass)**beta
+#   scale:        a * factor
+#   offset:       a + factor
+#   add:          a + b + ...
+#   subtract:     a - b - ...
+#   ratio:        a/b * (massA/massB)**beta * mask
+#   fraction:     a/b * factor * mask
+#   mask:         a * mask
+#
+# Factors are numbers, setting names or tuples of both to multiply together.
+chain = [
+    # Preliminary fractionation factor from the uncorrected 88/86
+    ('PFractRaw', 'beta', ('SrCaArYbLu88', 'SrCaArYb86')),
+    ('PFract', 'mask', ('PFractRaw',)),
+
+    # CaAr on 82, corrected for REE2+ using the Er83_5 signal and canonical Dy/Er
+    # (because we don't measure Dy on a half mass). The default value of Dy_Er is 1.8
+    ('Er82', 'interference', ('Er83_5', 1.601/22.869, 81.96460, 83.46619, 'PFract')),
+    ('Dy82', 'scale', ('Er82', ('Dy_Er', 28.260))),
+    ('CaAr82', 'subtract', ('CaArErDy82', 'Er82', 'Dy82')),
+
+    # Preliminary 86, corrected for CaAr using CaAr82 and for 172Yb2+ using 173Yb2+ (measured on mass 86.5)
+    ('PCaAr86', 'interference', ('CaAr82', .004/.647, 85.9160721, 81.9210049, 'PFract')),
+    ('PYb86', 'interference', ('Yb86_5', 21.68/16.103, 85.968195, 86.46911, 'PFract')),
+    ('PSr86', 'subtract', ('SrCaArYb86', 'PCaAr86', 'PYb86')),
+
+    # Preliminary 88, corrected for CaAr using CaAr82, for 176Yb2+ using 173Yb2+ (measured on mass 86.5)
+    # and for 176Lu2+ using 173Yb2+ and Lu_Yb
+    ('PCaAr88', 'interference', ('CaAr82', .187/.647, 87.9149151, 81.9210049, 'PFract')),
+    ('PYb88', 'interference', ('Yb86_5', 12.996/16.103, 87.97129, 86.46911, 'PFract')),
+    ('PLu88', 'scale', ('PYb88', ('Lu_Yb', 2.59))),
+    ('PSr88', 'subtract', ('SrCaArYbLu88', 'PCaAr88', 'PYb88', 'PLu88')),
+
+    # Use these CaAr and REE stripped Sr 86 and Sr 88 values to calculate a refined fractionation factor.
+    # The Rb and CaAr fractionation factors can be adjusted relative to it
+    ('BetaSr', 'beta', ('PSr88', 'PSr86')),
+    ('BetaRb', 'offset', ('BetaSr', 'RbBias')),
+    ('BetaCaAr', 'offset', ('BetaSr', 'CaArBias')),
+
+    # Correct mass 85 for 170Yb2+ using 173Yb2+ (measured on mass 86.5) and 170Er2+ using 167Er2+
+    # (measured on mass 83.5), and calculate Rb on mass 87 from it
+    ('Yb85', 'interference', ('Yb86_5', 2.982/16.103, 84.967385, 86.46911, 'BetaSr')),
+    ('Er85', 'interference', ('Er83_5', 14.910/22.869, 84.96774, 83.46619, 'BetaSr')),
+    ('Rb85', 'subtract', ('RbYbEr85', 'Yb85', 'Er85')),
+    ('Rb87', 'interference', ('Rb85', 'Rb87_85_reference', 86.90918, 84.9118, 'BetaRb')),
+
+    # Subtract this Rb87 amount from the 87 beam, along with 174Yb2+ (calculated from
+    # 173Yb2++, on mass 86.5), to get Sr87
+    ('Yb87', 'interference', ('Yb86_5', 32.026/16.103, 86.96943, 86.46911, 'BetaSr')),
+    ('Sr87', 'subtract', ('SrRbYb87', 'Rb87', 'Yb87')),
+
+    # Then determine Sr84 by removing CaAr84, Yb84 (168Yb2+) (from Yb86.5), and Er84 (168Er2+) (from Er83.5)
+    ('Yb84', 'interference', ('Yb86_5', 0.123/16.103, 83.96694, 86.46911, 'BetaSr')),
+    ('Er84', 'interference', ('Er83_5', 26.978/22.869, 83.96619, 83.46619, 'BetaSr')),
+    ('CaAr84', 'interference', ('CaAr82', 2.086/0.647, 83.917989, 81.921122, 'BetaCaAr')),
+    ('Sr84', 'subtract', ('SrCaArErYb84', 'CaAr84', 'Er84', 'Yb84')),
+
+    # Then determine final Sr88 by removing CaAr88, Yb88 (176Yb2+) (from Yb86.5), and Lu88 (176Lu2+) (from Yb86.5)
+    ('CaAr88', 'interference', ('CaAr82', .187/.647, 87.9149151, 81.9210049, 'BetaSr')),
+    ('Yb88', 'interference', ('Yb86_5', 12.996/16.103, 87.97129, 86.46911, 'BetaSr')),
+    ('Lu88', 'scale', ('Yb88', ('Lu_Yb', 2.59))),
+    ('Sr88', 'subtract', ('SrCaArYbLu88', 'CaAr88', 'Yb88', 'Lu88')),
+
+    # Calculate a final CaAr and REE corrected 86 beam
+    ('CaAr86', 'interference', ('CaAr82', .004/.647, 85.9160721, 81.9210049, 'BetaSr')),
+    ('Yb86', 'interference', ('Yb86_5', 21.68/16.103, 85.968195, 86.46911, 'BetaSr')),
+    ('Sr86', 'subtract', ('SrCaArYb86', 'CaAr86', 'Yb86')),
+
+    ('Sr8786_Uncorr', 'ratio', ('SrRbYb87', 'SrCaArYb86', 86.9089, 85.9093, 'BetaSr')),
+    ('Sr8786_Corr', 'ratio', ('Sr87', 'Sr86', 86.9089, 85.9093, 'BetaSr')),
+    ('Rb87Sr86_Corr', 'ratio', ('Rb87', 'Sr86', 86.9089, 85.9093, 'BetaSr')),
+    ('Sr8486_Uncorr', 'ratio', ('SrCaArErYb84', 'SrCaArYb86', 83.9134, 85.9093, 'BetaSr')),
+    ('Sr8486_Corr', 'ratio', ('Sr84', 'Sr86', 83.9134, 85.9093, 'BetaSr')),
+    ('Sr8488_Uncorr', 'ratio', ('SrCaArErYb84', 'SrCaArYbLu88', 83.9134, 87.9056, 'BetaSr')),
+    ('Sr8488_Corr', 'ratio', ('Sr84', 'Sr88', 83.9134, 87.9056, 'BetaSr')),
+    ('Rb87asPPM', 'fraction', ('Rb87', 'SrRbYb87', 1000000)),
+    ('CaArErYb84', 'add', ('CaAr84', 'Er84', 'Yb84')),
+    ('CaArErYb84asPPM', 'fraction', ('CaArErYb84', 'SrCaArErYb84', 100000)),
+    # Only Sr87 is masked in the total beam
+    ('Sr87Masked', 'mask', ('Sr87',)),
+    ('TotalSrBeam', 'add', ('Sr88', 'Sr84', 'Sr86', 'Sr87Masked')),
+
+    # The same corrections using CaAr on 83, itself corrected for REE2+ using the Er83_5 signal.
+    # Use the preliminary fract in stripping CaAr and REE from Sr 86 and Sr 88
+    ('Er83', 'interference', ('Er83_5', 33.503/22.869, 82.96514975, 83.46619, 'PFract')),
+    ('CaAr83', 'subtract', ('CaArEr83', 'Er83')),
+    ('PCaAr86_b', 'interference', ('CaAr83', .004/.135, 85.9160721, 82.921150, 'PFract')),
+    ('PSr86_b', 'subtract', ('SrCaArYb86', 'PCaAr86_b', 'PYb86')),
+    ('PCaAr88_b', 'interference', ('CaAr83', .187/.135, 87.9149151, 82.921150, 'PFract')),
+    # Lu is estimated with Dy_Er here
+    ('PLu88_b', 'scale', ('PYb88', ('Dy_Er', 2.59))),
+    ('PSr88_b', 'subtract', ('SrCaArYbLu88', 'PCaAr88_b', 'PYb88', 'PLu88_b')),
+
+    ('BetaSr_b', 'beta', ('PSr88_b', 'PSr86_b')),
+    ('BetaRb_b', 'offset', ('BetaSr_b', 'RbBias')),
+    ('BetaCaAr_b', 'offset', ('BetaSr_b', 'CaArBias')),
+
+    ('Yb85_b', 'interference', ('Yb86_5', 2.982/16.103, 84.967385, 86.46911, 'BetaSr_b')),
+    ('Er85_b', 'interference', ('Er83_5', 14.910/22.869, 84.96774, 83.46619, 'BetaSr_b')),
+    ('Rb85_b', 'subtract', ('RbYbEr85', 'Yb85_b', 'Er85_b')),
+    ('Rb87_b', 'interference', ('Rb85_b', 'Rb87_85_reference', 86.90918, 84.9118, 'BetaRb_b')),
+    ('Yb87_b', 'interference', ('Yb86_5', 32.026/16.103, 86.96943, 86.46911, 'BetaSr_b')),
+    ('Sr87_b', 'subtract', ('SrRbYb87', 'Rb87_b', 'Yb87_b')),
+
+    ('CaAr84_b', 'interference', ('CaAr83', 2.086/0.135, 83.917989, 82.921150, 'BetaCaAr_b')),
+    ('Er84_b', 'interference', ('Er83_5', 26.978/22.869, 83.96619, 83.46619, 'BetaSr_b')),
+    ('Yb84_b', 'interference', ('Yb86_5', 0.123/16.103, 83.96694, 86.46911, 'BetaSr_b')),
+    ('CaArErYb84_b', 'add', ('CaAr84_b', 'Er84_b', 'Yb84_b')),
+    ('Sr84_b', 'subtract', ('SrCaArErYb84', 'CaArErYb84_b')),
+
+    ('CaAr88_b', 'interference', ('CaAr83', .187/.135, 87.9149151, 82.921150, 'BetaSr_b')),
+    ('Yb88_b', 'interference', ('Yb86_5', 12.996/16.103, 87.97129, 86.46911, 'BetaSr_b')),
+    ('Lu88_b', 'scale', ('Yb88_b', ('Dy_Er', 2.59))),
+    ('Sr88_b', 'subtract', ('SrCaArYbLu88', 'CaAr88_b', 'Yb88_b', 'Lu88_b')),
+
+    ('CaAr86_b', 'interference', ('CaAr83', .004/.135, 85.9160721, 82.921150, 'BetaSr_b')),
+    ('Yb86_b', 'interference', ('Yb86_5', 21.68/16.103, 85.968195, 86.46911, 'BetaSr_b')),
+    ('Sr86_b', 'subtract', ('SrCaArYb86', 'CaAr86_b', 'Yb86_b')),
+
+    ('Sr8786_Uncorr_b', 'ratio', ('SrRbYb87', 'SrCaArYb86', 86.9089, 85.9093, 'BetaSr_b')),
+    ('Sr8786_Corr_b', 'ratio', ('Sr87_b', 'Sr86_b', 86.9089, 85.9093, 'BetaSr_b')),
+    ('Rb87Sr86_Corr_b', 'ratio', ('Rb87_b', 'Sr86_b', 86.9089, 85.9093, 'BetaSr_b')),
+    ('Sr8486_Uncorr_b', 'ratio', ('SrCaArErYb84', 'SrCaArYb86', 83.9134, 85.9093, 'BetaSr_b')),
+    ('Sr8486_Corr_b', 'ratio', ('Sr84_b', 'Sr86_b', 83.9134, 85.9093, 'BetaSr_b')),
+    ('Sr8488_Uncorr_b', 'ratio', ('SrCaArErYb84', 'SrCaArYbLu88', 83.9134, 87.9056, 'BetaSr_b')),
+    ('Sr8488_Corr_b', 'ratio', ('Sr84_b', 'Sr88_b', 83.9134, 87.9056, 'BetaSr_b')),
+    ('Rb87asPPM_b', 'fraction', ('Rb87_b', 'SrRbYb87', 1000000)),
+    ('CaArErYb84asPPM_b', 'fraction', ('CaArErYb84_b', 'SrCaArErYb84', 100000)),
+    ('Sr87Masked_b', 'mask', ('Sr87_b',)),
+    ('TotalSrBeam_b', 'add', ('Sr88_b', 'Sr84_b', 'Sr86_b', 'Sr87Masked_b')),
+]
+
+# The chain is calculated this many points at a time, so that the values in
+# between steps stay in the CPU cache rather than taking up memory for the
+# whole session
+blockSize = 32768
+
+# The operations the chain is compiled to. Each one writes its result into out.
+def fractionationFactor(out, a, b, reference, logMassRatio):
+    np.divide(a, b, out=out)
+    np.divide(reference, out, out=out)
+    np.log(out, out=out)
+    np.divide(out, logMassRatio, out=out)
+
+def massBias(out, beta, logMassRatio):
+    np.multiply(beta, logMassRatio, out=out)
+    np.exp(out, out=out)
+
+def interference(out, monitor, bias, factor):
+    np.multiply(monitor, factor, out=out)
+    np.multiply(out, bias, out=out)
+
+def scaled(out, a, factor):
+    np.multiply(a, factor, out=out)
+
+def offset(out, a, factor):
+    np.add(a, factor, out=out)
+
+def total(out, a, b, *others):
+    np.add(a, b, out=out)
+    for c in others:
+        np.add(out, c, out=out)
+
+def difference(out, a, b, *others):
+    np.subtract(a, b, out=out)
+    for c in others:
+        np.subtract(out, c, out=out)
+
+def maskedRatio(out, a, b, mask, factor):
+    np.divide(a, b, out=out)
+    np.multiply(out, factor, out=out)
+    np.multiply(out, mask, out=out)
+
+def masked(out, a, mask):
+    np.multiply(a, mask, out=out)
+
+def compileChain(outputs, settings):
+    """
+    Turns the steps of the chain needed for outputs into a list of
+    (result, function, arguments, constants) operations.
+
+    The (mass ratio)**beta terms are calculated as exp(beta*log(mass ratio))
+    with the logs worked out here, and any operation that is the same as an
+    earlier one (e.g. the PFract corrected Yb on 86 and 88 that both pathways
+    use) is only calculated once. Steps that none of the outputs depend on are
+    left out.
+
+    Returns the operations and the result of each of the outputs.
+    """
+
+    def factor(f):
+        value = 1.0
+        for v in (f if isinstance(f, tuple) else (f,)):
+            value *= settings[v] if isinstance(v, str) else v
+        return value
+
+    # Input channels are their own results. The result of an operation is the
+    # operation itself, so equal operations have equal results
+    results = {}
+    operations = {}
+
+    def operation(function, arguments, constants=()):
+        arguments = tuple(results.get(a, a) for a in arguments)
+        key = (function.__name__, arguments, tuple(constants))
+        operations.setdefault(key, (function, arguments, tuple(constants)))
+        return key
+
+    for name, op, args in chain:
+        if op == 'beta':
+            results[name] = operation(fractionationFactor, args, (settings['Sr88_86_reference'], np.log(87.9056/85.9093)))
+        elif op == 'interference':
+            monitor, f, mass, monitorMass, beta = args
+            bias = operation(massBias, [beta], [-np.log(mass/monitorMass)])
+            results[name] = operation(interference, [monitor, bias], [factor(f)])
+        elif op == 'scale':
+            results[name] = operation(scaled, args[:1], [factor(args[1])])
+        elif op == 'offset':
+            results[name] = operation(offset, args[:1], [factor(args[1])])
+        elif op == 'add':
+            results[name] = operation(total, args)
+        elif op == 'subtract':
+            results[name] = operation(difference, args)
+        elif op == 'ratio':
+            a, b, massA, massB, beta = args
+            bias = operation(massBias, [beta], [np.log(massA/massB)])
+            results[name] = operation(maskedRatio, [a, b, 'mask', bias])
+        elif op == 'fraction':
+            results[name] = operation(maskedRatio, args[:2] + ('mask',), [factor(args[2])])
+        elif op == 'mask':
+            results[name] = operation(masked, args + ('mask',))
+        else:
+            raise ValueError("Unknown operation %s in step %s" % (op, name))
+
+    # Keep only the operations the outputs need, in chain order
+    needed = set(results[name] for name in outputs)
+    for key in reversed(list(operations)):
+        if key in needed:
+            needed.update(a for a in operations[key][1] if a in operations)
+
+    compiled = [(key,) + operations[key] for key in operations if key in needed]
+    return compiled, {name: results[name] for name in outputs}
+
+def evaluateChain(operations, outputs, inputs, index=None):
+    """
+    Calculates compiled operations blockSize points at a time. Only the
+    outputs (a dict of name: result, as from compileChain) are kept for the
+    whole session, and everything else is calculated in a few reused block
+    sized buffers.
+
+    If index is given only those points of the inputs are calculated, and the
+    outputs are NaN everywhere else.
+
+    Returns a dict of name: array for the outputs.
+    """
+
+    size = len(inputs['mask'])
+    if index is None:
+        n = size
+        results = {result: np.empty(size) for result in set(outputs.values())}
+    else:
+        n = len(index)
+        results = {result: np.full(size, np.nan) for result in set(outputs.values())}
+
+    # Give every other result (or every result, if they have to be put back
+    # at index) a buffer, reusing the buffers of results that have been used
+    # for the last time
+    lastUse = {}
+    for i, (result, function, arguments, constants) in enumerate(operations):
+        for a in arguments:
+            lastUse[a] = i
+
+    slots = {}
+    free = []
+    nSlots = 0
+    for i, (result, function, arguments, constants) in enumerate(operations):
+        if result not in results or index is not None:
+            if free:
+                slots[result] = free.pop()
+            else:
+                slots[result] = nSlots
+                nSlots += 1
+        for a in set(arguments):
+            if a in slots and lastUse[a] == i:
+                free.append(slots[a])
+
+    buffers = [np.empty(blockSize) for i in range(nSlots)]
+
+    for start in range(0, n, blockSize):
+        stop = min(start + blockSize, n)
+        if index is None:
+            values = {name: array[start:stop] for name, array in inputs.items()}
+        else:
+            values = {name: array[index[start:stop]] for name, array in inputs.items()}
+        for result, function, arguments, constants in operations:
+            if index is None and result in results:
+                out = results[result][start:stop]
+            else:
+                out = buffers[slots[result]][:stop - start]
+            function(out, *[values[a] for a in arguments], *constants)
+            values[result] = out
+            if index is not None and result in results:
+                results[result][index[start:stop]] = out
+
+    return {name: results[result] for name, result in outputs.items()}
+
+# The baseline subtracted channels the chain uses, and their masses
+inputMasses = {
+    'SrCaArYbLu88': 88,
+    'SrRbYb87': 87,
+    'Yb86_5': 86.5,
+    'SrCaArYb86': 86,
+    'RbYbEr85': 85,
+    'SrCaArErYb84': 84,
+    'Er83_5': 83.5,
+    'CaArEr83': 83,
+    'CaArErDy82': 82,
+}
+
+# CaAr can be corrected for using the signal on mass 82, on mass 83 (the '_b'
+# channels) or both ways. For each, the channels that are always added, and the
+# diagnostic channels that are only calculated and added if they are chosen in
+# the settings
+resultChannels = {
+    '82': ['Sr88', 'Sr86', 'Sr84', 'Rb87asPPM', 'Sr8786_Uncorr', 'Sr8786_Corr', 'Rb87Sr86_Corr',
+           'Sr8486_Uncorr', 'Sr8486_Corr', 'Sr8488_Uncorr', 'Sr8488_Corr', 'CaArErYb84asPPM', 'TotalSrBeam'],
+    '83': ['Sr88_b', 'Sr86_b', 'Sr84_b', 'Rb87asPPM_b', 'Sr8786_Uncorr_b', 'Sr8786_Corr_b', 'Rb87Sr86_Corr_b',
+           'Sr8486_Uncorr_b', 'Sr8486_Corr_b', 'Sr8488_Uncorr_b', 'Sr8488_Corr_b', 'CaArErYb84asPPM_b', 'TotalSrBeam_b'],
+}
+
+diagnosticChannels = {
+    '82': ['PFract', 'CaAr82', 'PSr86', 'PSr88', 'BetaSr', 'BetaRb', 'Sr87', 'BetaCaAr',
+           'Yb84', 'Yb85', 'Yb86', 'Yb87', 'Yb88', 'Er84', 'Er85', 'CaAr84', 'CaAr86', 'CaAr88', 'Lu88', 'Rb85', 'Rb87'],
+    '83': ['PFract', 'CaAr83', 'PSr86_b', 'PSr88_b', 'BetaSr_b', 'BetaRb_b', 'Sr87_b', 'BetaCaAr_b',
+           'Yb84_b', 'Yb85_b', 'Yb86_b', 'Yb87_b', 'Yb88_b', 'Er84_b', 'Er85_b', 'CaAr84_b', 'CaAr86_b', 'CaAr88_b', 'Lu88_b', 'Rb85_b', 'Rb87_b'],
+}
+
+suffixes = {'82': '', '83': '_b'}
+
+# CompactMask is only used when the mask lets at most this fraction of the
+# points through. Above it, gathering the masked in data and putting the
+# results back into the channels costs more than it saves (see
+# benchmarks/sr_mask_benchmark.py, run with the default settings)
+compactMaskLimit = 0.6
+
+class ChannelCatalog(object):
+    """
+    Finds channels by name, type and property values (e.g. Mass, Element or
+    DRSType) from hash indexes, rather than scanning every channel and its
+    properties on each lookup the way data.timeSeriesList() does. The indexes
+    for a type of channel are built the first time it is looked up and dropped
+    when the data changes. The catalog only listens for data changes while it
+    has indexes, so it doesn't stay connected once it is no longer used.
+    """
+
+    # Width of the buckets that channels are indexed in by mass
+    massBucket = 1.0
+
+    def __init__(self):
+        self.indexes = {}
+        self.connected = False
+
+    @staticmethod
+    def key(value):
+        """
+        Property values as they are indexed and looked up. Numbers, and strings
+        of them, are compared as numbers, so a Mass of 88.0 is found with 88 or
+        '88'. Anything else is compared as a string.
+        """
+        if isinstance(value, bool):
+            return str(value)
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            return str(value)
+
+        return str(value) if np.isnan(number) else number
+
+    def invalidate(self, *args):
+        self.indexes = {}
+        if self.connected:
+            data.dataChanged.disconnect(self.invalidate)
+            self.connected = False
+
+    def index(self, type):
+        if type not in self.indexes:
+            if not self.connected:
+                data.dataChanged.connect(self.invalidate)
+                self.connected = True
+            index = {'channels': data.timeSeriesList(type), 'name': {}, 'property': {}, 'mass': {}}
+            for c in index['channels']:
+                index['name'][c.name] = c
+                for name, value in c.properties().items():
+                    index['property'].setdefault((name, self.key(value)), []).append(c)
+                try:
+                    mass = float(c.property('Mass'))
+                except (TypeError, ValueError):
+                    continue
+                index['mass'].setdefault(int(mass // self.massBucket), []).append((mass, c))
+            self.indexes[type] = index
+
+        return self.indexes[type]
+
+    def timeSeries(self, name, type):
+        return self.index(type)['name'][name]
+
+    def timeSeriesList(self, type, properties=None):
+        """
+        The channels of type with all of the property values in properties, in
+        the same order as data.timeSeriesList().
+        """
+        index = self.index(type)
+        if not properties:
+            return list(index['channels'])
+
+        matches = [index['property'].get((name, self.key(value)), []) for name, value in properties.items()]
+        fewest = min(matches, key=len)
+        others = [set(map(id, m)) for m in matches if m is not fewest]
+        return [c for c in fewest if all(id(c) in o for o in others)]
+
+    def timeSeriesNames(self, type, properties=None):
+        return [c.name for c in self.timeSeriesList(type, properties)]
+
+    def timeSeriesByMass(self, type, mass, tolerance):
+        """
+        The channel of type with the Mass property closest to mass, within
+        tolerance. Raises IndexError if there isn't one.
+        """
+        buckets = self.index(type)['mass']
+        first, last = int((mass - tolerance) // self.massBucket), int((mass + tolerance) // self.massBucket)
+        near = [(abs(m - mass), c) for b in range(first, last + 1) for m, c in buckets.get(b, []) if abs(m - mass) < tolerance]
+        if not near:
+            raise IndexError('No channel with mass %g' % mass)
+
+        return min(near, key=lambda n: n[0])[1]
+
+catalog = ChannelCatalog()
 
 def runDRS():
 
@@ -28,6 +472,9 @@ def runDRS():
     RbBias = settings["RbBias"]
     CaArBias = settings["CaArBias"]
     propErrors = settings["PropagateError"]
+    compactMask = settings.get("CompactMask", True)
+    caArMass = settings.get("CaArMass", "Both")
+    diagnostics = settings.get("DiagnosticChannels", [])
 
     # Create debug messages for the settings being used
     IoLog.debug("indexChannelName = %s" % indexChannel.name)
@@ -39,6 +486,9 @@ def runDRS():
     IoLog.debug("RbBias = %f" % RbBias)
     IoLog.debug("CaArBias = %f" % CaArBias)
     IoLog.debug("PropagateErrors = True" if propErrors else "PropagateErrors = False")
+    IoLog.debug("CompactMask = True" if compactMask else "CompactMask = False")
+    IoLog.debug("CaArMass = %s" % caArMass)
+    IoLog.debug("DiagnosticChannels = %s" % ", ".join(diagnostics))
 
     # Setup index time
     drs.message("Setting up index time...")
@@ -72,196 +522,64 @@ def runDRS():
     else:
         blGrp = data.selectionGroupList(data.Baseline)[0]
 
-    for counter, channel in enumerate(allInputChannels):
-        drs.message("Baseline subtracting %s" % channel.name)
-        drs.progress(25 + 50*counter/len(allInputChannels))
+    drs.message("Baseline subtracting %i channels..." % len(allInputChannels))
+    drs.baselineSubtract(blGrp, allInputChannels, mask, 25, 75)
 
-        drs.baselineSubtract(blGrp, [allInputChannels[counter]], mask, 25, 75)
+    # Only the steps of the chain that the chosen CaAr correction(s) and diagnostic
+    # channels need are calculated, and only the input channels those steps use are read
+    pathways = ['82', '83'] if caArMass == 'Both' else [caArMass]
+    resultNames = [name for m in pathways for name in resultChannels[m]]
+    diagnosticNames = []
+    for m in pathways:
+        diagnosticNames += [name for name in diagnosticChannels[m] if name in diagnostics and name not in diagnosticNames]
 
-    drs.message("Checking for half masses...")
-    drs.progress(35)
+    operations, outputs = compileChain(diagnosticNames + resultNames, settings)
+    inputNames = [name for name in inputMasses if any(name in arguments for result, function, arguments, constants in operations)]
 
-    try:
-        Yb86_5 = data.timeSeriesByMass(data.Intermediate, 86.5, 0.1).data()
-    except IndexError:
-        IoLog.error("Could not find half masses. Combined Sr DRS could not proceed...")
-        drs.message("DRS did not finish. Please check Messages")
-        drs.progress(100)
-        drs.finished()
-        return
+    drs.message("Checking for masses...")
+    drs.progress(35)
 
-    #Y89 = data.timeSeriesList(data.Intermediate, {'Mass': '89'})[0].data()
-    SrCaArYbLu88 = data.timeSeriesByMass(data.Intermediate, 88, 0.1).data()
-    #Lu87_5 = data.timeSeriesList(data.Intermediate, {'Mass': '87.5'})[0].data()
-    SrRbYb87 = data.timeSeriesByMass(data.Intermediate, 87, 0.1).data()
-    Yb86_5 = data.timeSeriesByMass(data.Intermediate, 86.5, 0.1).data()
-    SrCaArYb86 = data.timeSeriesByMass(data.Intermediate, 86, 0.1).data()
-    RbYbEr85 = data.timeSeriesByMass(data.Intermediate, 85, 0.1).data()
-    #Tm84_5 = data.timeSeriesByMass(data.Intermediate, 84.5, 0.1).data()
-    SrCaArErYb84 = data.timeSeriesByMass(data.Intermediate, 84, 0.1).data()
-    Er83_5 = data.timeSeriesByMass(data.Intermediate, 83.5, 0.1).data()
-    CaArEr83 = data.timeSeriesByMass(data.Intermediate, 83, 0.1).data()
-    CaArErDy82 = data.timeSeriesByMass(data.Intermediate, 82, 0.1).data()
-
-    '''
-    Note that the following is not baseline subtracted as it is intended to be used as a
-    reference of the raw counts
-    '''
-    Raw83 = data.timeSeriesByMass(data.Input, 83, 0.1).data()
+    # Look the channels up from fresh indexes, with the ones baseline subtraction
+    # has just made. The channels made below change the data, so the indexes
+    # aren't kept afterwards
+    catalog.invalidate()
+    inputs = {'mask': mask}
+    for name in inputNames:
+        try:
+            inputs[name] = catalog.timeSeriesByMass(data.Intermediate, inputMasses[name], 0.1).data()
+        except IndexError:
+            catalog.invalidate()
+            IoLog.error("Could not find mass %g. Combined Sr DRS could not proceed..." % inputMasses[name])
+            drs.message("DRS did not finish. Please check Messages")
+            drs.progress(100)
+            drs.finished()
+            return
+    catalog.invalidate()
 
     drs.message("Subtracting interferences...")
     drs.progress(40)
 
-    Sr88_86_reference = settings['Sr88_86_reference']
-    Dy_Er = settings['Dy_Er']
-    Lu_Yb = settings['Lu_Yb']
-
-    PFract = (np.log(Sr88_86_reference / (SrCaArYbLu88/SrCaArYb86))) / (np.log(87.9056/85.9093))*mask
-
-    # The following equations subtract CaAr using the signal on 82, itself corrected for REE2+ using the
-    # Er83_5 signal and canonical Dy/Er (because we don't measure Dy on a half mass).
-    # The default value of Dy_Er is 1.8
-    Er82 = (Er83_5 * 1.601 / 22.869) / np.power((81.96460 / 83.46619), PFract)
-    Dy82 = Er82 * Dy_Er * 28.260
-    CaAr82 = CaArErDy82 - Er82 - Dy82
-
-    # Now correct mass 86 for CaAr using CaAr82, and correct for 172Yb2+ using 173Yb2+ (measured on mass 86.5)
-    CaAr86 = (CaAr82 * .004 / .647) / np.power((85.9160721 / 81.9210049), PFract)
-    Yb86 = (Yb86_5 * 21.68 / 16.103) / np.power((85.968195 / 86.46911), PFract)
-    PSr86 = SrCaArYb86 - CaAr86 - Yb86
+    # Only calculate the corrections where the mask lets data through, which
+    # leaves out the gas blanks and gaps. The channels are NaN where masked out
+    index = None
+    if compactMask:
+        inMask = np.isfinite(mask) & (mask != 0)
+        if inMask.sum() <= compactMaskLimit*len(inMask):
+            index = np.flatnonzero(inMask)
+            IoLog.debug("Calculating %i of %i points" % (len(index), len(mask)))
 
-    # Now correct mass 88 for CaAr using CaAr82, and correct for 176Yb2+ using 173Yb2+ (measured on mass 86.5)
-    # and 176Lu2+ using 173Yb2+ and applying the same Dy_Er ratio
-    CaAr88 = (CaAr82 * .187 / .647) / np.power((87.9149151 / 81.9210049), PFract)
-    Yb88 = (Yb86_5 * 12.996 / 16.103) / np.power((87.97129 / 86.46911), PFract)
-    Lu88 = Yb88 * Lu_Yb * 2.59
-    PSr88 = SrCaArYbLu88 - CaAr88 - Yb88 - Lu88
+    chainStart = time.perf_counter()
+    results = evaluateChain(operations, outputs, inputs, index)
+    IoLog.debug("Calculated %i operations on %i points in %.3f s" % (len(operations), len(mask) if index is None else len(index), time.perf_counter() - chainStart))
 
-    # Use these CaAr and REE stripped Sr 86 and Sr 88 values to calculate a refined fractionation factor
-    BetaSr = (np.log(Sr88_86_reference / (PSr88 / PSr86))) / (np.log(87.9056/85.9093))
-
-    # You might notice that a lot of the following equations look the same as those above,
-    # but just using `BetaSr` fractionation factor instead of `PFract` fractionation factor
-
-    # Calculate Rb fractionation factor, with optional adjustment
-    BetaRb = BetaSr + settings['RbBias']
-
-    # Correct mass 85 for 170Yb2+ using 173Yb2+ (measured on mass 86.5) and 170Er2+ using 167Er2+ (measured on mass 83.5)
-    Yb85 =  Yb86_5 * 2.982 / 16.103 / np.power((84.967385 / 86.46911), BetaSr)
-    Er85 = Er83_5 * 14.910 / 22.869 / np.power((84.96774 / 83.46619), BetaSr)
-    Rb85 = RbYbEr85 - Yb85 - Er85
-    # Calculate Rb on mass 87
-    Rb87_85_reference = settings['Rb87_85_reference']
-    Rb87 = Rb85 * Rb87_85_reference / np.power((86.90918 / 84.9118), BetaRb)
-
-    # Subtract this Rb87 amount from the 87 beam, along with 174Yb2+ (calculated from
-    # 173Yb2++, on mass 86.5), to get Sr87
-    Yb87 = Yb86_5 * 32.026 / 16.103 / np.power((86.96943 / 86.46911), BetaSr)
-    Sr87 = SrRbYb87 - Rb87 - Yb87
-
-    # Calculate unique CaAr fractionation factor relative to Sr fract.
-    BetaCaAr = BetaSr + settings['CaArBias']
-
-    # Then determine Sr84 by removing CaAr84, Yb84 (168Yb2+) (from Yb86.5), and Er84 (168Er2+) (from Er83.5)
-    Yb84 = Yb86_5 * 0.123 / 16.103 / np.power((83.96694 / 86.46911), BetaSr)
-    Er84 = Er83_5 * 26.978 / 22.869 / np.power((83.96619 / 83.46619), BetaSr)
-    CaAr84 = CaAr82 * 2.086/0.647 / np.power((83.917989 / 81.921122), BetaCaAr)
-    Sr84 = SrCaArErYb84 - CaAr84 - Er84 - Yb84
-
-    # Then determine final Sr88 by removing CaAr88, Yb88 (176Yb2+) (from Yb86.5), and Lu88 (176Lu2+) (from Yb86.5)
-    # and applying the Dy_Er factor * 2.59
-    CaAr88 = CaAr82 * .187 / .647 / np.power((87.9149151 / 81.9210049), BetaSr)
-    Yb88 = Yb86_5 * 12.996 / 16.103 / np.power((87.97129 / 86.46911), BetaSr)
-    Lu88 = Yb88 * Lu_Yb * 2.59
-    Sr88 = SrCaArYbLu88 - CaAr88 - Yb88 - Lu88
-
-    # Calculate a final CaAr and REE corrected 86 beam
-    CaAr86 = CaAr82 * .004 / .647 / np.power((85.9160721 / 81.9210049), BetaSr)
-    Yb86 = Yb86_5 * 21.68 / 16.103 / np.power((85.968195 / 86.46911), BetaSr)
-    Sr86 = SrCaArYb86 - CaAr86 - Yb86
-
-    # Gather up intermediate channels and add them as time series:
-    int_channel_names = ['PFract', 'CaAr82', 'PSr86', 'PSr88', 'BetaSr', 'BetaRb', 'Sr87', 'BetaCaAr',
-                         'Sr84', 'Sr86', 'Sr88', 'Yb84', 'Yb85', 'Yb86', 'Yb87', 'Yb88',
-                         'Er84', 'Er85', 'CaAr84', 'CaAr86', 'CaAr88', 'Lu88', 'Rb85', 'Rb87']
-
-    int_channels = [PFract, CaAr82, PSr86, PSr88, BetaSr, BetaRb, Sr87, BetaCaAr,
-                         Sr84, Sr86, Sr88, Yb84, Yb85, Yb86, Yb87, Yb88,
-                         Er84, Er85, CaAr84, CaAr86, CaAr88, Lu88, Rb85, Rb87]
-
-    for name, channel in zip(int_channel_names, int_channels):
-        data.createTimeSeries(name, data.Intermediate, indexChannel.time(), channel)
+    for name in diagnosticNames:
+        data.createTimeSeries(name, data.Intermediate, indexChannel.time(), results[name])
 
     drs.message("Calculating further interference corrections...")
     drs.progress(60)
 
-    Sr8786_Uncorr = (SrRbYb87 / SrCaArYb86) * np.power((86.9089 / 85.9093), BetaSr) * mask
-    Sr8786_Corr = (Sr87 / Sr86) * np.power((86.9089 / 85.9093), BetaSr) * mask
-    Rb87Sr86_Corr = (Rb87 / Sr86) * np.power((86.9089 / 85.9093), BetaSr) * mask
-    Sr8486_Uncorr = (SrCaArErYb84 / SrCaArYb86) * np.power((83.9134 / 85.9093), BetaSr) * mask
-    Sr8486_Corr = (Sr84 / Sr86) * np.power((83.9134 / 85.9093), BetaSr) * mask
-    Sr8488_Uncorr = (SrCaArErYb84 / SrCaArYbLu88) * np.power((83.9134 / 87.9056), BetaSr) * mask
-    Sr8488_Corr = (Sr84 / Sr88) * np.power((83.9134 / 87.9056), BetaSr) * mask
-    Rb87asPPM = (Rb87 / SrRbYb87) * 1000000 * mask
-    CaArErYb84asPPM = (CaAr84 + Er84 + Yb84) / SrCaArErYb84 * 100000 * mask
-    TotalSrBeam = Sr88 + Sr84 + Sr86 + Sr87 * mask
-
-    # The following equations subtract CaAr using the signal on 83, itself corrected for REE2+ using the Er83_5 signal.
-    CaAr83 = CaArEr83 - (Er83_5 * 33.503 /22.869) / np.power((82.96514975 / 83.46619), PFract)
-    # Use this preliminary fract in stripping CaAr and REE from Sr 86
-    PSrCaArYb86_b = (SrCaArYb86 - ((CaAr83 * .004 / .135) / np.power((85.9160721 / 82.921150), PFract)) - (Yb86_5 * 21.68 / 16.103) / np.power((85.968195 / 86.46911), PFract))   
-    # and Sr 88
-    PSrCaArYbLu88_b = (SrCaArYbLu88 - ((CaAr83 * .187 / .135) / np.power((87.9149151 / 82.921150), PFract)) - (Yb86_5 * 12.996 / 16.103) / np.power((87.97129 / 86.46911), PFract) - ((Yb86_5 * 12.996 / 16.103) / np.power((87.97129 / 86.46911), PFract) * Dy_Er * 2.59))
-
-    # Use these CaAr and REE stripped Sr 86 and Sr 88 values to calculate a refined fractionation factor
-    BetaSr_b = (np.log(Sr88_86_reference/(PSrCaArYbLu88_b / PSrCaArYb86_b))) / (np.log(87.9056/85.9093))
-    BetaRb_b = BetaSr_b + RbBias
-
-    # Use the Rb fract to calculate the amount of Rb on mass 87
-    Rb87_b = ((RbYbEr85 - (Yb86_5 * 2.982 / 16.103) / np.power((84.967385 / 86.46911), BetaSr_b) - (Er83_5 * 14.910 /22.869) / np.power((84.96774 / 83.46619), BetaSr_b)) * Rb87_85_reference) / np.power((86.90918 / 84.9118), BetaRb_b)
-    # Subtract this amount of Rb 87 from the 87 beam
-    Sr87_b = (SrRbYb87 - Rb87_b - (Yb86_5 * 32.026 /16.103) / np.power((86.96943 / 86.46911), BetaSr_b))
-    # Allows for a modification of the CaAr fractionation factor relative to the Sr fract. We have never used anything but 1 (i.e. no modification)
-    BetaCaAr_b = BetaSr_b + CaArBias
-    # Calculate the amount of CaAr and REE on mass 84
-    CaArErYb84_b = (CaAr83 * ((2.086/0.135) / np.power((83.917989 / 82.921150), BetaCaAr_b))) + (Er83_5 * 26.978 / 22.869) / np.power((83.96619 / 83.46619), BetaSr_b) + (Yb86_5 * 0.123 /16.103) / np.power((83.96694 / 86.46911), BetaSr_b)
-    # Subtract this amount from the 84 beam
-    Sr84_b = (SrCaArErYb84 - CaArErYb84_b)
-    # Calculate a final CaAr and REE corrected 88 beam
-    Sr88_b = (SrCaArYbLu88 - ((CaAr83 * .187 / .135) / np.power((87.9149151 / 82.921150), BetaSr_b)) - (Yb86_5 * 12.996 / 16.103) / np.power((87.97129 / 86.46911), BetaSr_b) - ((Yb86_5 * 12.996 / 16.103) / np.power((87.97129 / 86.46911), BetaSr_b) * Dy_Er * 2.59))
-    # Calculate a final CaAr and REE corrected 86 beam
-    Sr86_b = (SrCaArYb86 - ((CaAr83 * .004 / .135) / np.power((85.9160721 / 82.921150), BetaSr_b)) - (Yb86_5 * 21.68 / 16.103) / np.power((85.968195 / 86.46911), BetaSr_b))
-
-    Sr8786_Uncorr_b = (SrRbYb87 / SrCaArYb86) * np.power((86.9089 / 85.9093), BetaSr_b) * mask
-    Sr8786_Corr_b = (Sr87_b / Sr86_b) * np.power((86.9089 / 85.9093), BetaSr_b) * mask
-    Rb87Sr86_Corr_b = (Rb87_b / Sr86_b) * np.power((86.9089 / 85.9093), BetaSr_b) * mask
-    Sr8486_Uncorr_b = (SrCaArErYb84 / SrCaArYb86) * np.power((83.9134 / 85.9093), BetaSr_b) * mask
-    Sr8486_Corr_b = (Sr84_b / Sr86_b) * np.power((83.9134 / 85.9093), BetaSr_b) * mask
-    Sr8488_Uncorr_b = (SrCaArErYb84 / SrCaArYbLu88) * np.power((83.9134 / 87.9056), BetaSr_b) * mask
-    Sr8488_Corr_b = (Sr84_b / Sr88_b) * np.power((83.9134 / 87.9056), BetaSr_b) * mask
-    Rb87asPPM_b = (Rb87_b / SrRbYb87) * 1000000 * mask
-    CaArErYb84asPPM_b = (CaArErYb84_b / SrCaArErYb84) * 100000 * mask
-    TotalSrBeam_b = Sr88_b + Sr84_b + Sr86_b + Sr87_b * mask
-
-    # Gather up intermediate channels and add them as time series:
-    int_channel_names = ['Sr88', 'Sr86', 'Sr84', 'Rb87asPPM']
-    int_channel_names += ['Sr88_b', 'Sr86_b', 'Sr84_b', 'Rb87asPPM_b']
-    int_channel_names += ['Sr8786_Uncorr', 'Sr8786_Corr', 'Rb87Sr86_Corr', 'Sr8486_Uncorr']
-    int_channel_names += ['Sr8486_Corr', 'Sr8488_Uncorr', 'Sr8488_Corr', 'Rb87asPPM']
-    int_channel_names += ['CaArErYb84asPPM', 'TotalSrBeam', 'Sr8786_Uncorr_b', 'Sr8786_Corr_b']
-    int_channel_names += ['Rb87Sr86_Corr_b', 'Sr8486_Uncorr_b', 'Sr8486_Corr_b', 'Sr8488_Uncorr_b']
-    int_channel_names += ['Sr8488_Corr_b', 'Rb87asPPM_b', 'CaArErYb84asPPM_b', 'TotalSrBeam_b']
-
-    int_channels = [Sr88, Sr86, Sr84, Rb87asPPM]
-    int_channels += [Sr88_b, Sr86_b, Sr84_b, Rb87asPPM_b]
-    int_channels += [Sr8786_Uncorr, Sr8786_Corr, Rb87Sr86_Corr, Sr8486_Uncorr]
-    int_channels += [Sr8486_Corr, Sr8488_Uncorr, Sr8488_Corr, Rb87asPPM]
-    int_channels += [CaArErYb84asPPM, TotalSrBeam, Sr8786_Uncorr_b, Sr8786_Corr_b]
-    int_channels += [Rb87Sr86_Corr_b, Sr8486_Uncorr_b, Sr8486_Corr_b, Sr8488_Uncorr_b]
-    int_channels += [Sr8488_Corr_b, Rb87asPPM_b, CaArErYb84asPPM_b, TotalSrBeam_b]
-
-    for name, channel in zip(int_channel_names, int_channels):
-        data.createTimeSeries(name, data.Intermediate, indexChannel.time(), channel)
+    for name in resultNames:
+        data.createTimeSeries(name, data.Intermediate, indexChannel.time(), results[name])
 
     drs.message("Calculating reference material corrected results...")
     drs.progress(70)
@@ -269,14 +587,16 @@ def runDRS():
     data.updateResults()
     
     # Now check if there are selections for the reference standard, and if so, generate standard-normalised ratios
-    try:
-        StdSpline_Sr87_86 = data.spline(rmName, "Sr8786_Corr").data()
-    except:
-        IoLog.error("The Combined Sr DRS requires Ref Material selections to proceed.")
-        drs.message("DRS did not finish. Please check Messages")
-        drs.progress(100)
-        drs.finished()
-        return
+    splines = {}
+    for m in pathways:
+        try:
+            splines[m] = data.spline(rmName, "Sr8786_Corr" + suffixes[m]).data()
+        except:
+            IoLog.error("The Combined Sr DRS requires Ref Material selections to proceed.")
+            drs.message("DRS did not finish. Please check Messages")
+            drs.progress(100)
+            drs.finished()
+            return
     # And check that we can get the RM 87/86 value    
     try:
         StdValue_Sr87_86 = data.referenceMaterialData(rmName)["87Sr_86Sr"].value()
@@ -287,29 +607,22 @@ def runDRS():
         drs.finished()
         return
 
-    StdCorr_Sr8786 = Sr8786_Corr * StdValue_Sr87_86 / StdSpline_Sr87_86
-
-    # Now generate age-corrected values (using the observed Rb/Sr ratio)
-    # NOTE: The line below used Sr8786_Corr. Changed to use
-    # Std Corrected data (BP, 2021-02-01)
-    Sr8786_AgeCorr = StdCorr_Sr8786 - (Rb87Sr86_Corr * (0.000013972 ** Age) - 1)
+    output_channels = {}
+    if '82' in pathways:
+        StdCorr_Sr8786 = results['Sr8786_Corr'] * StdValue_Sr87_86 / splines['82']
 
-    try:
-        StdSpline_Sr8786_b = data.spline(rmName, "Sr8786_Corr_b").data()
-    except:
-        IoLog.error("The Combined Sr DRS requires Ref Material selections to proceed.")
-        drs.message("DRS did not finish. Please check Messages")
-        drs.progress(100)
-        drs.finished()
-        return
+        # Now generate age-corrected values (using the observed Rb/Sr ratio)
+        # NOTE: The line below used Sr8786_Corr. Changed to use
+        # Std Corrected data (BP, 2021-02-01)
+        output_channels['StdCorr_Sr8786'] = StdCorr_Sr8786
+        output_channels['Sr8786_AgeCorr'] = StdCorr_Sr8786 - (results['Rb87Sr86_Corr'] * (0.000013972 ** Age) - 1)
 
-    StdCorr_Sr8786_b = Sr8786_Corr_b * StdValue_Sr87_86 / StdSpline_Sr8786_b
-    # Now generate age-corrected values (using the observed Rb/Sr ratio)
-    Sr8786_AgeCorr_b = Sr8786_Corr_b - (Rb87Sr86_Corr_b * (0.000013972 ** Age) - 1)
+    if '83' in pathways:
+        output_channels['StdCorr_Sr8786_b'] = results['Sr8786_Corr_b'] * StdValue_Sr87_86 / splines['83']
+        # Now generate age-corrected values (using the observed Rb/Sr ratio)
+        output_channels['Sr8786_AgeCorr_b'] = results['Sr8786_Corr_b'] - (results['Rb87Sr86_Corr_b'] * (0.000013972 ** Age) - 1)
 
-    output_channels_names = ['StdCorr_Sr8786', 'Sr8786_AgeCorr', 'StdCorr_Sr8786_b', 'Sr8786_AgeCorr_b']
-    output_channels = [StdCorr_Sr8786, Sr8786_AgeCorr, StdCorr_Sr8786_b, Sr8786_AgeCorr_b]
-    for name, channel in zip(output_channels_names, output_channels):
+    for name, channel in output_channels.items():
         data.createTimeSeries(name, data.Output, indexChannel.time(), channel)
 
     if propErrors:
@@ -317,7 +630,8 @@ def runDRS():
         drs.progress(90)
 
         groups = [s for s in data.selectionGroupList() if s.type != data.Baseline]
-        data.propagateErrors(groups, [data.timeSeries("StdCorr_Sr87_86_b")], data.timeSeries("Sr8786_Corr_b"), rmName)
+        for m in pathways:
+            data.propagateErrors(groups, [data.timeSeries("StdCorr_Sr8786" + suffixes[m])], data.timeSeries("Sr8786_Corr" + suffixes[m]), rmName)
 
 
     drs.message("Finished!")
@@ -353,6 +667,9 @@ def settingsWidget():
     drs.setSetting("MaskChannel", defaultChannelName)
     drs.setSetting("MaskCutoff", 0.05)
     drs.setSetting("MaskTrim", 0.0)
+    drs.setSetting("CompactMask", True)
+    drs.setSetting("CaArMass", "Both")
+    drs.setSetting("DiagnosticChannels", [])
     drs.setSetting("Age", 0.)
     drs.setSetting("Dy_Er", 1.8)
     drs.setSetting("Lu_Yb", 7.0)
@@ -401,6 +718,11 @@ def settingsWidget():
     maskTrimLineEdit.textChanged.connect(lambda t: drs.setSetting("MaskTrim", float(t)))
     formLayout.addRow("Mask trim", maskTrimLineEdit)
 
+    compactCheckBox = QtGui.QCheckBox(widget)
+    compactCheckBox.setChecked(settings["CompactMask"])
+    compactCheckBox.toggled.connect(lambda t: drs.setSetting("CompactMask", bool(t)))
+    formLayout.addRow("Only calculate masked data", compactCheckBox)
+
     verticalSpacer2 = QtGui.QSpacerItem(20, 40, QtGui.QSizePolicy.Minimum, QtGui.QSizePolicy.Minimum)
     formLayout.addItem(verticalSpacer2)
 
@@ -439,6 +761,26 @@ def settingsWidget():
     rb87_85_refLineEdit.textChanged.connect(lambda t: drs.setSetting("Rb87_85_reference", float(t)))
     formLayout.addRow("Reference Rb87/Rb85 value", rb87_85_refLineEdit)
 
+    caArMassComboBox = QtGui.QComboBox(widget)
+    caArMassComboBox.addItems(["82", "83", "Both"])
+    caArMassComboBox.setCurrentText(settings["CaArMass"])
+    caArMassComboBox.currentTextChanged.connect(lambda t: drs.setSetting("CaArMass", t))
+    formLayout.addRow("Correct CaAr using mass", caArMassComboBox)
+
+    diagnosticNames = []
+    for m in ['82', '83']:
+        diagnosticNames += [name for name in diagnosticChannels[m] if name not in diagnosticNames]
+
+    diagnosticsList = QtGui.QListWidget(widget)
+    diagnosticsList.addItems(diagnosticNames)
+    diagnosticsList.setSelectionMode(QtGui.QAbstractItemView.ExtendedSelection)
+    for name in settings["DiagnosticChannels"]:
+        matches = diagnosticsList.findItems(name, Qt.MatchFixedString)
+        if matches:
+            matches[0].setSelected(True)
+    diagnosticsList.itemSelectionChanged.connect(lambda: drs.setSetting("DiagnosticChannels", [wi.text() for wi in diagnosticsList.selectedItems()]))
+    formLayout.addRow("Diagnostic channels", diagnosticsList)
+
     propCheckBox = QtGui.QCheckBox(widget)
     propCheckBox.setChecked(settings["PropagateError"])
     propCheckBox.toggled.connect(lambda t: drs.setSetting("PropagateError", bool(t)))
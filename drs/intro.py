@@ -27,7 +27,6 @@ drs		an interface to the PythonDRS C++ class in iolite from
 """
 
 from iolite import QtGui
-from time import sleep
 import numpy as np
 
 
@@ -82,12 +81,8 @@ def runDRS():
 
 	allInputChannels = data.timeSeriesList(data.Input)
 
-	for counter, channel in enumerate(allInputChannels):
-		drs.message("Baseline subtracting %s" % channel.name)
-		drs.progress(25 + 75*counter/len(allInputChannels))
-		sleep(0.5) # Sleeping only so that the progress can be observed
-
-		drs.baselineSubtract(data.selectionGroup("Baseline"), [allInputChannels[counter]], mask, 25, 100)
+	drs.message("Baseline subtracting %i channels..." % len(allInputChannels))
+	drs.baselineSubtract(data.selectionGroup("Baseline"), allInputChannels, mask, 25, 100)
 
 	drs.message("Finished!")
 	drs.progress(100)
@@ -130,12 +130,13 @@ def runDRS():
 	
 	commonProps = {'DRS': drs.name()}
 
-	# Baseline subtract and calculate SQ concentrations for each channel
-	for counter, channel in enumerate(allInputChannels):
-		drs.message("Baseline subtracting %s" % channel.name)
-		drs.progress(25 + 25*counter/len(allInputChannels))
+	# Baseline subtract all channels, then calculate SQ concentrations for each
+	drs.message("Baseline subtracting %i channels..." % len(allInputChannels))
+	drs.baselineSubtract(data.selectionGroup("Baseline"), allInputChannels, None, 25, 50)
 
-		drs.baselineSubtract(data.selectionGroup("Baseline"), [allInputChannels[counter]], None, 25, 50)
+	for counter, channel in enumerate(allInputChannels):
+		drs.message("Calculating SQ concentrations for %s" % channel.name)
+		drs.progress(50 + 25*counter/len(allInputChannels))
 
 		try:
 			rm = data.referenceMaterialData(settings["External"])
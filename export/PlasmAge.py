@@ -42,6 +42,100 @@ sel_grp_list = data.selectionGroupList(data.ReferenceMaterial) + data.selectionG
 
 sels = [s for sg in sel_grp_list for s in sg.selections()]
 
+class ChannelCatalog(object):
+    """
+    Finds channels by name, type and property values (e.g. Mass, Element or
+    DRSType) from hash indexes, rather than scanning every channel and its
+    properties on each lookup the way data.timeSeriesList() does. The indexes
+    for a type of channel are built the first time it is looked up and dropped
+    when the data changes. The catalog only listens for data changes while it
+    has indexes, so it doesn't stay connected once it is no longer used.
+    """
+
+    # Width of the buckets that channels are indexed in by mass
+    massBucket = 1.0
+
+    def __init__(self):
+        self.indexes = {}
+        self.connected = False
+
+    @staticmethod
+    def key(value):
+        """
+        Property values as they are indexed and looked up. Numbers, and strings
+        of them, are compared as numbers, so a Mass of 88.0 is found with 88 or
+        '88'. Anything else is compared as a string.
+        """
+        if isinstance(value, bool):
+            return str(value)
+        try:
+            number = float(value)
+        except (TypeError, ValueError):
+            return str(value)
+
+        return str(value) if np.isnan(number) else number
+
+    def invalidate(self, *args):
+        self.indexes = {}
+        if self.connected:
+            data.dataChanged.disconnect(self.invalidate)
+            self.connected = False
+
+    def index(self, type):
+        if type not in self.indexes:
+            if not self.connected:
+                data.dataChanged.connect(self.invalidate)
+                self.connected = True
+            index = {'channels': data.timeSeriesList(type), 'name': {}, 'property': {}, 'mass': {}}
+            for c in index['channels']:
+                index['name'][c.name] = c
+                for name, value in c.properties().items():
+                    index['property'].setdefault((name, self.key(value)), []).append(c)
+                try:
+                    mass = float(c.property('Mass'))
+                except (TypeError, ValueError):
+                    continue
+                index['mass'].setdefault(int(mass // self.massBucket), []).append((mass, c))
+            self.indexes[type] = index
+
+        return self.indexes[type]
+
+    def timeSeries(self, name, type):
+        return self.index(type)['name'][name]
+
+    def timeSeriesList(self, type, properties=None):
+        """
+        The channels of type with all of the property values in properties, in
+        the same order as data.timeSeriesList().
+        """
+        index = self.index(type)
+        if not properties:
+            return list(index['channels'])
+
+        matches = [index['property'].get((name, self.key(value)), []) for name, value in properties.items()]
+        fewest = min(matches, key=len)
+        others = [set(map(id, m)) for m in matches if m is not fewest]
+        return [c for c in fewest if all(id(c) in o for o in others)]
+
+    def timeSeriesNames(self, type, properties=None):
+        return [c.name for c in self.timeSeriesList(type, properties)]
+
+    def timeSeriesByMass(self, type, mass, tolerance):
+        """
+        The channel of type with the Mass property closest to mass, within
+        tolerance. Raises IndexError if there isn't one.
+        """
+        buckets = self.index(type)['mass']
+        first, last = int((mass - tolerance) // self.massBucket), int((mass + tolerance) // self.massBucket)
+        near = [(abs(m - mass), c) for b in range(first, last + 1) for m, c in buckets.get(b, []) if abs(m - mass) < tolerance]
+        if not near:
+            raise IndexError('No channel with mass %g' % mass)
+
+        return min(near, key=lambda n: n[0])[1]
+
+catalog = ChannelCatalog()
+
+
 class ChannelNames:
     Pb206_cps = data.timeSeriesNames(data.Intermediate, {'Mass': 206, 'DRSType': 'BaselineSubtracted'})[0]
     Uppm = 'Approx_U_PPM'
@@ -95,8 +189,8 @@ def th_u_ratio(selection):
 
 def pb206_204(selection):
     try:
-        Pb206 = data.timeSeriesList(data.Intermediate, {'Mass': 206, 'DRSType': 'BaselineSubtracted'})[0].dataForSelection(selection)
-        Pb204 = data.timeSeriesList(data.Intermediate, {'Mass': 204, 'DRSType': 'BaselineSubtracted'})[0].dataForSelection(selection)
+        Pb206 = catalog.timeSeriesList(data.Intermediate, {'Mass': 206, 'DRSType': 'BaselineSubtracted'})[0].dataForSelection(selection)
+        Pb204 = catalog.timeSeriesList(data.Intermediate, {'Mass': 204, 'DRSType': 'BaselineSubtracted'})[0].dataForSelection(selection)
         ratio = Pb206/Pb204
         mean_ratio = np.nanmean(ratio)
         pct1se = 100*(np.nanstd(ratio)/np.sqrt(len(ratio)))/mean_ratio
@@ -107,8 +201,8 @@ def pb206_204(selection):
         
 def pb208_206(selection):
     try:
-        Pb208 = data.timeSeriesList(data.Intermediate, {'Mass': 208, 'DRSType': 'BaselineSubtracted'})[0].dataForSelection(selection)
-        Pb206 = data.timeSeriesList(data.Intermediate, {'Mass': 206, 'DRSType': 'BaselineSubtracted'})[0].dataForSelection(selection)        
+        Pb208 = catalog.timeSeriesList(data.Intermediate, {'Mass': 208, 'DRSType': 'BaselineSubtracted'})[0].dataForSelection(selection)
+        Pb206 = catalog.timeSeriesList(data.Intermediate, {'Mass': 206, 'DRSType': 'BaselineSubtracted'})[0].dataForSelection(selection)        
         ratio = Pb208/Pb206
         mean_ratio = np.nanmean(ratio)
         pct1se = 100*(np.nanstd(ratio)/np.sqrt(len(ratio)))/mean_ratio
@@ -129,8 +223,8 @@ def f206c(selection):
         c64 = lambda a: 0.023*(a/1e3)**3 - 0.359*(a/1e3)**2 - 1.008*(a/1e3) + 19.04
 
         age76 = data.timeSeries('Final Pb207/Pb206 age').dataForSelection(selection)
-        Pb206 = data.timeSeriesList(data.Intermediate, {'Mass': 206, 'DRSType': 'BaselineSubtracted'})[0].dataForSelection(selection)
-        Pb204 = data.timeSeriesList(data.Intermediate, {'Mass': 204, 'DRSType': 'BaselineSubtracted'})[0].dataForSelection(selection)
+        Pb206 = catalog.timeSeriesList(data.Intermediate, {'Mass': 206, 'DRSType': 'BaselineSubtracted'})[0].dataForSelection(selection)
+        Pb204 = catalog.timeSeriesList(data.Intermediate, {'Mass': 204, 'DRSType': 'BaselineSubtracted'})[0].dataForSelection(selection)
         r64 = Pb206/Pb204
         
         f206c = 100*c64(age76)/r64
@@ -250,28 +344,33 @@ def set_number_formats():
     for col in [11,17]:
         set_fmt('0.00000', col)
 
-write_header()
-write_column(1, data_func = partial(selection_data, 'Name'))
-write_column(2, data_func = partial(selection_data, 'Comment'))
-write_column(3, data_func = f206c)
-write_column(4, data_func = partial(channel_data, ChannelNames.Pb206_cps))
-write_column(5, data_func = partial(channel_data, ChannelNames.Uppm))
-write_column(6, data_func = th_u_ratio)
-write_column(7, data_func = pb206_204, uncert_types=[1])
-write_column(9, data_func = partial(channel_data, ChannelNames.U238_Pb206), uncert_types=[1])
-write_column(11, data_func = partial(channel_data, ChannelNames.Pb207_Pb206), uncert_types=[1])
-write_column(13, data_func = pb208_206, uncert_types=[1])
-write_column(15, data_func = partial(channel_data, ChannelNames.Pb207_U235), uncert_types=[1])
-write_column(17, data_func = partial(channel_data, ChannelNames.Pb206_U238), uncert_types=[1])
-write_column(19, data_func = partial(associated_data, ChannelNames.Wetherill_rho))
-write_column(20, data_func = partial(channel_data, ChannelNames.Pb208_Th232), uncert_types=[1])
-write_column(22, data_func = partial(channel_data, ChannelNames.Pb207_Pb206_age), uncert_types=[2,3])
-write_column(25, data_func = partial(channel_data, ChannelNames.Pb206_U238_age), uncert_types=[2,3])
-write_column(28, data_func = partial(channel_data, ChannelNames.Pb207_U235_age), uncert_types=[2,3])
-write_column(31, data_func = partial(channel_data, ChannelNames.Pb208_Th232_age), uncert_types=[2,3])
-write_column(34, data_func = conc_pct)
-add_borders()
-set_number_formats()
-write_footer()
+# Drop the catalog's indexes, and its connection to data changes, even if
+# writing fails
+try:
+    write_header()
+    write_column(1, data_func = partial(selection_data, 'Name'))
+    write_column(2, data_func = partial(selection_data, 'Comment'))
+    write_column(3, data_func = f206c)
+    write_column(4, data_func = partial(channel_data, ChannelNames.Pb206_cps))
+    write_column(5, data_func = partial(channel_data, ChannelNames.Uppm))
+    write_column(6, data_func = th_u_ratio)
+    write_column(7, data_func = pb206_204, uncert_types=[1])
+    write_column(9, data_func = partial(channel_data, ChannelNames.U238_Pb206), uncert_types=[1])
+    write_column(11, data_func = partial(channel_data, ChannelNames.Pb207_Pb206), uncert_types=[1])
+    write_column(13, data_func = pb208_206, uncert_types=[1])
+    write_column(15, data_func = partial(channel_data, ChannelNames.Pb207_U235), uncert_types=[1])
+    write_column(17, data_func = partial(channel_data, ChannelNames.Pb206_U238), uncert_types=[1])
+    write_column(19, data_func = partial(associated_data, ChannelNames.Wetherill_rho))
+    write_column(20, data_func = partial(channel_data, ChannelNames.Pb208_Th232), uncert_types=[1])
+    write_column(22, data_func = partial(channel_data, ChannelNames.Pb207_Pb206_age), uncert_types=[2,3])
+    write_column(25, data_func = partial(channel_data, ChannelNames.Pb206_U238_age), uncert_types=[2,3])
+    write_column(28, data_func = partial(channel_data, ChannelNames.Pb207_U235_age), uncert_types=[2,3])
+    write_column(31, data_func = partial(channel_data, ChannelNames.Pb208_Th232_age), uncert_types=[2,3])
+    write_column(34, data_func = conc_pct)
+    add_borders()
+    set_number_formats()
+    write_footer()
+finally:
+    catalog.invalidate()
 
 wb.save(export_filepath)
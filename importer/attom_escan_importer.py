@@ -11,6 +11,15 @@ import time
 import numpy as np
 import pandas as pd
 import re
+import os
+import io
+import sys
+import types
+import glob
+import gzip
+import lzma
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
 
 
@@ -50,13 +59,106 @@ importer    an interface to the corresponding C++ class in iolite
             from which some properties can be accessed, e.g. fileName
 """
 
+# see nu_plasma_run_importer.py for how compressed files are handled
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+compression_extensions = ['.gz', '.xz'] + (['.zst'] if zstandard else [])
+
+def uncompressed_name(fileName):
+    """
+    Returns fileName without its compression extension, if it has one.
+    """
+    for ext in compression_extensions:
+        if fileName.endswith(ext):
+            return fileName[:-len(ext)]
+
+    return fileName
+
+def open_file(fileName, binary=False, errors=None):
+    """
+    Opens fileName for reading, like open(), decompressing it on the fly
+    if it is compressed.
+    """
+    if fileName.endswith('.gz'):
+        f = gzip.open(fileName, 'rb')
+    elif fileName.endswith('.xz'):
+        f = lzma.open(fileName, 'rb')
+    elif zstandard and fileName.endswith('.zst'):
+        f = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(fileName, 'rb'), closefd=True))
+    else:
+        return open(fileName, 'rb' if binary else 'r', errors=errors)
+
+    return f if binary else io.TextIOWrapper(f, errors=errors)
+
+# see nu_plasma_run_importer.py for why only the file header is read, and
+# how the importers share one cache of headers
+HEADER_SNIFF_CHARS = 64*1024
+HEADER_CACHE_SIZE = 32
+header_cache_module = 'iolite_importer_headers'
+
+def read_header(fileName):
+    """
+    Returns the first HEADER_SNIFF_CHARS characters of fileName (decompressed
+    if it is compressed), from the importers' shared cache when it is there.
+    """
+    cache = sys.modules.get(header_cache_module)
+    if cache is None:
+        cache = sys.modules.setdefault(header_cache_module, types.ModuleType(header_cache_module))
+        cache.headers = {}
+
+    st = os.stat(fileName)
+    key = (os.path.abspath(fileName), st.st_size, st.st_mtime_ns, HEADER_SNIFF_CHARS)
+    header = cache.headers.get(key)
+    if header is None:
+        with open_file(fileName, errors='replace') as f:
+            header = f.read(HEADER_SNIFF_CHARS)
+        cache.headers[key] = header
+        while len(cache.headers) > HEADER_CACHE_SIZE:
+            cache.headers.pop(next(iter(cache.headers)))
+
+    return header
+
+#find the date and time using a regular expression:
+date_regex = r"Date: \"(?P<hours>\d{2}):(?P<minutes>\d{2}):(?P<seconds>\d{2})\s+(?P<day>\d{2})\/(?P<month>\d{2})\/(?P<year>\d{4})\""
+
+#find the sample name with a regex too:
+name_regex = r'Run:\s+"([\w._-]+)"$'
+
+#create mass list to identify columns:
+mass_list = [77,78,82,83,84,85,86,87,88,89]
+
+# Set to True to hand the channel values to iolite as float32 (see
+# nu_plasma_run_importer.py). Times stay float64.
+single_precision = False
+
+# Number of processes used to parse the files of a file list (see
+# import_files). With 1 they are parsed one after another in iolite's own
+# process. A worker is only started for every min_files_per_worker files, as
+# starting one takes about as long as parsing that many small files.
+max_workers = os.cpu_count() or 1
+min_files_per_worker = 50
+
+# The workers are started with this Python interpreter. When iolite's own
+# executable isn't a Python interpreter (as with an embedded Python), point
+# this at one with numpy and pandas, or the files are parsed in iolite's
+# process instead.
+worker_python = sys.executable
+
+# A list of files to import together is a text file with this extension,
+# with one .csv file name or glob pattern (e.g. *.csv) on each line,
+# relative to the list's folder
+file_list_extension = '.escanlist'
+
 m_fileName = ""
 
 def setFileName(fileName):
     m_fileName = fileName
 
 def accepted_files():
-    return ".csv"
+    return ";".join(['.csv' + c for c in [''] + compression_extensions] + [file_list_extension])
 
 
 def correct_format():
@@ -81,130 +183,258 @@ def correct_format():
     """
     IoLog.debug("correct_format for Attom Peak EScan .csv file importer called on file = %s"%(importer.fileName))
 
-    if importer.fileName.endswith('csv'):
-        nrf_regex = r"Analysis Type: \"PeakEScan\""
-        with open(importer.fileName) as f:
-            match = re.search(nrf_regex, f.read(), re.MULTILINE)
-            if match:
-                return True
+    if importer.fileName.endswith(file_list_extension):
+        # the files are all from the same instrument, so the first will do
+        file_names = [f for f in files_in_list(importer.fileName) if os.path.isfile(f)]
+        return len(file_names) > 0 and is_escan_file(file_names[0])
 
-    return False
+    if uncompressed_name(importer.fileName).endswith('csv'):
+        return is_escan_file(importer.fileName)
 
-def import_data():
-    """
-    This method uses the provided file name (stored in plugin.fileName),
-    parses its contents, and registers time series data with iolite
+    return False
 
-    Importer progress can be updated via the 'message' and 'progress'
-    signals. These will be displayed in the iolite interface.
+def is_escan_file(fileName):
+    nrf_regex = r"Analysis Type: \"PeakEScan\""
+    match = re.search(nrf_regex, read_header(fileName), re.MULTILINE)
+    return match is not None
 
-    When finished, the 'finished' signal should be emitted.
+def files_in_list(listName):
     """
-    IoLog.debug("import_data called on file = %s"%(importer.fileName))
-
-    #find the date and time using a regular expression:
-    date_regex = r"Date: \"(?P<hours>\d{2}):(?P<minutes>\d{2}):(?P<seconds>\d{2})\s+(?P<day>\d{2})\/(?P<month>\d{2})\/(?P<year>\d{4})\""
+    Returns the files named in a file list, in the order they are listed,
+    with glob patterns expanded (and sorted by name) and names relative to
+    the list's folder.
+    """
+    folder = os.path.dirname(os.path.abspath(listName))
+    file_names = []
+    with open(listName, errors='replace') as f:
+        for line in f:
+            pattern = line.strip()
+            if not pattern or pattern.startswith('#'):
+                continue
+            # a name that matches nothing is kept, so that it is reported
+            # when it can't be read
+            pattern = os.path.join(folder, pattern)
+            file_names += sorted(glob.glob(pattern)) or [pattern]
+
+    return list(dict.fromkeys(file_names))
+
+def parse_file(fileName):
+    """
+    Parses a single PeakEScan .csv file without touching iolite's data (or
+    IoLog), so that it can be run in a worker process and several files can
+    be merged before any channels are created.
+
+    Returns a dictionary with the sample name, start time, the Step 3 times
+    and channel values, the time of the blank row that should follow this
+    file's data and any warnings. Raises ValueError if the file can't be
+    parsed.
+    """
+    with open_file(fileName) as f:
+        file_contents = f.read()
 
-    #find the sample name with a regex too:
-    name_regex = r'Run:\s+"([\w._-]+)"$'
+    #the first line of data in these files is 4 lines below a line with
+    # "========" written in it, and the channel names are 2 lines below it.
+    header_end = file_contents.find("========")
+    if header_end < 0:
+        raise ValueError("Couldn't find the start of the data")
 
-    with open(importer.fileName) as f:
-        file_contents = f.read()
-        match_date = re.search(date_regex, file_contents, re.MULTILINE)
-        match_name = re.search(name_regex, file_contents, re.MULTILINE)
+    header = file_contents[:header_end]
+    match_date = re.search(date_regex, header, re.MULTILINE)
+    match_name = re.search(name_regex, header, re.MULTILINE)
 
     if not match_date:
-        IoLog.error("Couldn't find a match for the date time stamp")
-        importer.message('Error during import')
-        importer.progress(100)
-        importer.finished()
+        raise ValueError("Couldn't find a match for the date time stamp")
 
     timestring = ",".join(match_date.groups())
     start_time = datetime.strptime(timestring, '%H,%M,%S,%d,%m,%Y')
     start_time_in_s = start_time.timestamp()
-    IoLog.debug(f'Start time is: {start_time}')
 
-    sample_name = ""
+    warnings = []
     if not match_name:
-        IoLog.warning("Couldn't find a match for the sample name for file " + importer.fileName)
+        warnings.append("Couldn't find a match for the sample name for file " + fileName)
         sample_name = "Not found"
     else:
         sample_name = match_name.group(1).lstrip()
-        IoLog.debug("Sample name: " + sample_name)
-
-    #look through file to find the first line of data, which in these files
-    # is preceded by a line with "========" written in it.
-    first_line_of_data = 0
-    names_list = []
-    with open(importer.fileName, 'r') as file:
-        for line in file:
-            if "========" in line:
-                next(file)                   #skip blank line
-                names_list = next(file).split(",")
-                break
-            
-            first_line_of_data += 1
 
-    first_line_of_data += 4             #the first line of data is actually 4 lines below the ==== line
+    lines = file_contents[header_end:].split('\n', 4)
+    if len(lines) < 5:
+        raise ValueError("Couldn't find any data")
 
-    IoLog.debug(f"Found first line of data on line: {first_line_of_data}")
-    IoLog.debug(f"Found these headers: {names_list}")
+    names_list = [name.strip() for name in lines[2].split(',')]
+    df = pd.read_csv(io.StringIO(lines[4]), header=None, names=names_list)
 
-    #Read csv file into pandas DataFrame 
-    df = pd.read_csv(importer.fileName, skiprows=first_line_of_data, header=None, names=names_list)
+    #add start time in seconds to the timestamps, and take only Step 3:
+    times = df['Timestamp'].values + start_time_in_s
+    step3 = df['Step'].values == 3
 
-    #add start time in seconds to time column:
-    df['time'] = df['Timestamp'].add(start_time_in_s)
-    # Add blank row at end of dataframe here to create a blank between each file
-    df = df.append(pd.Series(), ignore_index=True)
-    # And add 1 millisecond to last time for the timing of this blank value
-    df['time'].iloc[-1] = df['time'].iloc[-2] + 0.001
-
-    #Set the Step at this last blank row to 3 so that it will be included when we subset the table to just Step == 3 below
-    df['Step'].iloc[-1] = 3
-
-    #Drop "Mode.." and "Mass Step..." columns
-    modecols_to_drop = [col for col in df.columns if "Mode" in col]
-    masscols_to_drop = [col for col in df.columns if "Mass Step" in col]
-    cols_to_drop =  modecols_to_drop + masscols_to_drop
-    df = df.drop(cols_to_drop, axis=1)
-
-    #Now, take only Step 3:
-    df = df[df.Step == 3]
-
-    #df.to_excel("___xx__FindMe.xlsx")
-
-    #can now drop the Step and Timestamp columns:
-    df = df.drop(['Step','Timestamp'],axis=1)
-
-    #create mass list to identify columns:
-    mass_list = [77,78,82,83,84,85,86,87,88,89]
-
-    #And clean up names (convention is to label channels [Symbol][Mass]:
-    names_list = df.columns.tolist()
-    rename_dict = {}
-    for channel in names_list:
-        rename_dict[channel] = channel.replace('(','').replace(')','')
-
-    df.rename(columns=rename_dict, inplace=True)
+    #skip the Step, Timestamp, "Mode.." and "Mass Step..." columns, and clean
+    # up names (convention is to label channels [Symbol][Mass]):
+    columns = {}
+    for name in names_list:
+        if name in ['Step', 'Timestamp'] or "Mode" in name or "Mass Step" in name:
+            continue
+        columns[name.replace('(','').replace(')','')] = df[name].values[step3]
+
+    return {
+        'fileName': fileName,
+        'sample_name': sample_name,
+        'start_time': start_time,
+        'time': times[step3],
+        # add 1 millisecond to the last time for the timing of a blank
+        # value between each file
+        'blank_time': times[-1] + 0.001,
+        'columns': columns,
+        'warnings': warnings
+    }
+
+def try_parse_file(fileName):
+    """
+    Returns parse_file(fileName) and None, or None and the reason the file
+    couldn't be read or parsed.
+    """
+    try:
+        return parse_file(fileName), None
+    except (KeyError, OSError, ValueError) as e:
+        return None, str(e)
+
+# Run in each worker process to load this file as a module of its own, so
+# that try_parse_file can be sent to the workers by name. The module iolite
+# loads can't be imported by name in another process.
+load_worker_module = '''
+import sys, importlib.util
+spec = importlib.util.spec_from_file_location(name, path)
+sys.modules[name] = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(sys.modules[name])
+'''
+
+worker_module_name = 'attom_escan_importer_worker'
+
+def parse_files(file_names):
+    """
+    Yields try_parse_file() for each of file_names, in order, parsing them in
+    up to max_workers processes. Falls back to parsing them here when one
+    worker would do, or the workers can't be started.
+    """
+    workers = min(max_workers, len(file_names)//min_files_per_worker)
+    path = globals().get('__file__')
+    python = os.path.basename(worker_python or '').lower()
+    if workers > 1 and not (path and python.startswith('python')):
+        IoLog.warning("Parsing the files in iolite's process, as worker_python isn't set to a Python interpreter")
+        workers = 1
+
+    if workers <= 1:
+        for fileName in file_names:
+            yield try_parse_file(fileName)
+        return
+
+    # The workers are started afresh (rather than forked from iolite) and
+    # load this file themselves. It is loaded here under the same name too,
+    # so that the function sent to them can be pickled.
+    args = {'name': worker_module_name, 'path': path}
+    if worker_module_name not in sys.modules:
+        exec(load_worker_module, dict(args))
+    parse = sys.modules[worker_module_name].try_parse_file
+
+    context = multiprocessing.get_context('spawn')
+    context.set_executable(worker_python)
+    done = 0
+    try:
+        with ProcessPoolExecutor(workers, context, initializer=exec, initargs=(load_worker_module, args)) as pool:
+            for result in pool.map(parse, file_names, chunksize=max(1, len(file_names)//(4*workers))):
+                done += 1
+                yield result
+    except Exception as e:
+        IoLog.warning("Parsing the files in iolite's process, as the worker processes failed: %s" % e)
+        for fileName in file_names[done:]:
+            yield try_parse_file(fileName)
+
+def import_files(file_names):
+    """
+    Imports several PeakEScan .csv files in one go. Files are parsed in
+    worker processes (see parse_files), then merged in time order into one
+    set of channels, with a blank row between the files, so that each channel
+    is registered with iolite only once.
+    """
+    files = []
+    for i, (f, error) in enumerate(parse_files(file_names)):
+        if f is None:
+            IoLog.error("Could not import %s: %s"%(file_names[i], error))
+        else:
+            for warning in f['warnings']:
+                IoLog.warning(warning)
+            files.append(f)
+
+        importer.message('Parsed %i of %i files'%(i + 1, len(file_names)))
+        importer.progress(int(80*(i + 1)/len(file_names)))
+
+    if not files:
+        importer.message('Error during import')
+        importer.progress(100)
+        importer.finished()
+        return
+
+    files.sort(key=lambda f: f['start_time'])
+
+    # Channels are matched to masses by their order in the file
+    channel_names = []
+    for f in files:
+        channel_names += [c for c in f['columns'] if c not in channel_names]
+    channel_masses = list(zip(channel_names, mass_list))
+
+    # Work out where each file goes in the merged arrays, leaving room for a
+    # blank row after each one, then fill them in place
+    n_points = sum(len(f['time']) + 1 for f in files)
+    times = np.empty(n_points)
+    value_dtype = np.float32 if single_precision else np.float64
+    values = {c: np.full(n_points, np.nan, value_dtype) for c, mass in channel_masses}
+
+    start = 0
+    for f in files:
+        end = start + len(f['time'])
+        times[start:end] = f['time']
+        times[end] = f['blank_time']
+        for c, mass in channel_masses:
+            if c in f['columns']:
+                values[c][start:end] = f['columns'][c]
+        start = end + 1
+
+    importer.message('Adding channels...')
+    importer.progress(90)
 
     metadata = {'machineName': 'Nu Plasma AttoM - PeakEScan Mode'}
 
-    for column_name, mass in zip(df.columns.tolist(), mass_list):
-        if column_name == 'time':
-            continue
-
-        data.addDataToInput(column_name, df['time'].values, df[column_name].values, metadata)
+    for c, mass in channel_masses:
+        data.addDataToInput(c, times, values[c], metadata)
         # and set the mass for this channel:
-        data.timeSeries(column_name).setProperty("Mass", mass)
+        data.timeSeries(c).setProperty("Mass", mass)
 
     # Now calculate Total Beam:
     data.calculateTotalBeam()
-    
+
     #create File and Sample objects for Files and Samples Browsers
-    data.createFileSampleMetadata(sample_name, start_time, datetime.fromtimestamp(df['time'].iloc[-1]), importer.fileName)
-    data.createImportedFileMetadata(start_time, datetime.fromtimestamp(df['time'].iloc[-1]), importer.fileName, datetime.now(), len(df.index), df.columns.tolist()[0:-1])
+    for f in files:
+        IoLog.debug(f"Start time for {f['fileName']} is: {f['start_time']}")
+        end_time = datetime.fromtimestamp(f['blank_time'])
+        data.createFileSampleMetadata(f['sample_name'], f['start_time'], end_time, f['fileName'])
+        data.createImportedFileMetadata(f['start_time'], end_time, f['fileName'], datetime.now(), len(f['time']) + 1, list(f['columns']))
 
     importer.message('Finished')
     importer.progress(100)
     importer.finished()
+
+def import_data():
+    """
+    This method uses the provided file name (stored in plugin.fileName),
+    parses its contents, and registers time series data with iolite
+
+    Importer progress can be updated via the 'message' and 'progress'
+    signals. These will be displayed in the iolite interface.
+
+    When finished, the 'finished' signal should be emitted.
+    """
+    IoLog.debug("import_data called on file = %s"%(importer.fileName))
+
+    if importer.fileName.endswith(file_list_extension):
+        import_files(files_in_list(importer.fileName))
+    else:
+        import_files([importer.fileName])
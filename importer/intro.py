@@ -50,6 +50,9 @@ def correct_format():
     """
     IoLog.debug("correct_format called on file = %s"%(importer.fileName))
 
+    # This example only uses the .ioe extension to have something to match.
+    # It never reads the file (import_data() below makes up random data), so
+    # it can't be used to get channels out of saved .ioe files.
     if importer.fileName.endswith('ioe'):
         return True
 
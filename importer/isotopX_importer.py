@@ -15,7 +15,76 @@ import time
 import numpy as np
 import pandas as pd
 import re
+import os
+import io
+import gzip
+import lzma
 from datetime import datetime
+from iolite.QtCore import QTimer
+
+# When chunked_import is True the cycle data are parsed chunk_rows rows at a
+# time straight into preallocated column buffers, updating the import
+# progress as they go, so peak memory stays close to the final array size.
+chunked_import = True
+chunk_rows = 100000
+
+# When single_precision is True the cycle data are handed to iolite as
+# float32 (see nu_plasma_run_importer.py). Times stay float64.
+single_precision = False
+
+def column_dtypes(columns):
+    value_dtype = np.float32 if single_precision else np.float64
+    return {c: np.float64 if c == 'Time' else value_dtype for c in columns}
+
+# When live_import is True, import_data() keeps watching the folder of the
+# imported file while the instrument is still acquiring (see
+# nu_plasma_run_importer.py, including for when it stops). Cycles appended to
+# the file, or to new TIMSDP files in the same folder, are appended to the
+# existing channels, and a file is finished off once its #BLOCKS footer has
+# been written.
+live_import = False
+min_poll_interval = 0.5
+max_poll_interval = 10.0
+live_timeout = 30*60
+
+# State of the live import: the folder being watched and, for each file,
+# what we know about it and the byte offset of the first row not yet read
+# (None for files in the folder we should ignore)
+live = {}
+
+# see nu_plasma_run_importer.py for how compressed files are handled
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+compression_extensions = ['.gz', '.xz'] + (['.zst'] if zstandard else [])
+
+def uncompressed_name(fileName):
+    """
+    Returns fileName without its compression extension, if it has one.
+    """
+    for ext in compression_extensions:
+        if fileName.endswith(ext):
+            return fileName[:-len(ext)]
+
+    return fileName
+
+def open_file(fileName, binary=False, errors=None):
+    """
+    Opens fileName for reading, like open(), decompressing it on the fly
+    if it is compressed.
+    """
+    if fileName.endswith('.gz'):
+        f = gzip.open(fileName, 'rb')
+    elif fileName.endswith('.xz'):
+        f = lzma.open(fileName, 'rb')
+    elif zstandard and fileName.endswith('.zst'):
+        f = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(fileName, 'rb'), closefd=True))
+    else:
+        return open(fileName, 'rb' if binary else 'r', errors=errors)
+
+    return f if binary else io.TextIOWrapper(f, errors=errors)
 
 m_fileName = ""
 
@@ -23,47 +92,57 @@ def setFileName(fileName):
     m_fileName = fileName
 
 def accepted_files():
-    return ".TIMSDP"
+    return ";".join('.TIMSDP' + c for c in [''] + compression_extensions)
 
 def correct_format():
 
-    if importer.fileName.endswith('TIMSDP'):
+    if os.path.isdir(importer.fileName):
+        return len(timsdp_files_in(importer.fileName)) > 0
+
+    if is_timsdp_file(importer.fileName):
         return True
 
     return False
 
-def import_data():
+def read_cycles(f, names_list, n_rows, buffers, offset, n_total):
     """
-    see intro.py for explanation of functions
+    Parses n_rows rows of cycle data from the open file f, copying each
+    column that has a buffer into it from row offset on. With chunked_import
+    the rows are parsed chunk_rows at a time, so only one chunk is held in
+    memory on top of the buffers, and the importer progress is updated as
+    they go (as a fraction of the n_total rows being imported).
     """
-    print("\n\n")
-
-    IoLog.debug("import_data in IsotopX TIMSDP importer called on file = %s"%(importer.fileName))
-
-    #find the date and time using a regular expression:
-    time_regex = r"AnalysisStart,(\d{1,2}\/\d{1,2}\/\d{4}\s+\d{2}:\d{2}:\d{2})"
-    name_regex = "SampleID, (.*)"
-    with open(importer.fileName) as f:
-        file_contents = f.read()
-        match_time = re.search(time_regex, file_contents, re.MULTILINE)
-        match_name = re.search(name_regex, file_contents, re.MULTILINE)
+    columns = [c for c in names_list if c in buffers]
+    if not chunked_import:
+        df = pd.read_csv(f, nrows=n_rows, header=None, names=names_list, usecols=columns, dtype=column_dtypes(columns), engine='c')
+        for c in columns:
+            buffers[c][offset:offset + len(df.index)] = df[c].values
+        return
 
-    file_contents = file_contents.split('\n')
+    n = offset
+    reader = pd.read_csv(f, header=None, names=names_list, usecols=columns, nrows=n_rows, dtype=column_dtypes(columns), chunksize=chunk_rows)
+    for chunk in reader:
+        m = len(chunk.index)
+        for c in columns:
+            buffers[c][n:n + m] = chunk[c].values
+        n += m
 
-    if not match_time:
-        IoLog.error("Couldn't find a match for the date time stamp")
-        importer.message('Error during import')
-        importer.progress(100)
-        return
+        importer.message('Read %i of %i cycles'%(n, n_total))
+        importer.progress(min(99, int(100*n/max(n_total, 1))))
 
-    timestring = match_time.group(1)
-    sample_name = match_name.group(1)
-    if len(sample_name) < 1:
-        sample_name = "[blank]"
+#find the date and time using a regular expression:
+time_regex = r"AnalysisStart,(\d{1,2}\/\d{1,2}\/\d{4}\s+\d{2}:\d{2}:\d{2})"
+name_regex = "SampleID, (.*)"
 
-    start_time = datetime.strptime(timestring, '%d/%m/%Y %H:%M:%S')
-    start_time_in_s = start_time.timestamp()
-    IoLog.debug("Start time is: " + start_time.strftime('%Y-%m-%d %H:%M:%S'))
+def scan_lines(lines, stop_at_data=False):
+    """
+    Scans the lines of a TIMSDP file for the start time, sample name,
+    metadata and column names, and works out which lines hold the cycle
+    data. Everything from the #BLOCKS line on is footer, so the scan stops
+    there, or straight after the column names if stop_at_data is True.
+    """
+    match_time = None
+    match_name = None
 
     # Get all metadata as dictionary:
     metadata = {}
@@ -71,69 +150,405 @@ def import_data():
     cycles_line = 0
     line_counter = 0
     blocks_line = 0
+    names_list = []
     read_metadata = True        # will be set to false once we get to the #USERTABLES line
 
-    for line in file_contents:
+    # Cycle data rows are counted up to the first line that isn't a number,
+    # skipping blank lines as the C parser does, so that it is never asked to
+    # read past the data
+    data_rows = 0
+    in_data = False
+
+    for line in lines:
+        line = line.rstrip('\n')
+
+        if match_time is None:
+            match_time = re.search(time_regex, line)
+        if match_name is None:
+            match_name = re.search(name_regex, line)
+
         #TODO: add collector metadata
-        
+
         if re.match(r"#CYCLES", line):
             cycles_line = line_counter
-        
+
+        if cycles_line > 0 and line_counter == cycles_line + 1:
+            names_list = line.split(',')
+            in_data = True
+            if stop_at_data:
+                line_counter += 1
+                break
+
         if re.match(r"#BLOCKS", line):
             blocks_line = line_counter
-            break       
-        
+            break
+
+        if in_data and line_counter > cycles_line + 1:
+            first = line.lstrip()[:1]
+            if first:
+                in_data = first in '+-.0123456789'
+                data_rows += in_data
+
         if re.match(r"#USERTABLES", line):
             read_metadata = False
-        
+
         # This will read metadata until we get to the USERTABLES line:
         if len(line.split(',')) > 1 and read_metadata:
             metadata[line.split(',')[0]] = line.split(',')[1]
-        
+
         line_counter += 1
 
-    names_list = file_contents[cycles_line + 1].split(',')
-    footer_lines = len(file_contents) - blocks_line
-    
-    df = pd.read_csv(importer.fileName, skiprows=cycles_line + 2, skipfooter=footer_lines, header=None, names=names_list, engine='python')
+    return {
+        'match_time': match_time,
+        'match_name': match_name,
+        'metadata': metadata,
+        'names_list': names_list,
+        'cycles_line': cycles_line,
+        'blocks_line': blocks_line,
+        'line_counter': line_counter,
+        'data_rows': data_rows
+    }
+
+def channel_name(name):
+    # add 'm' to start of channel with just mass in thier name:
+    if re.match(r'^\d+$', name):
+        return 'm'+name
+
+    return name
+
+def is_timsdp_file(fileName):
+    return uncompressed_name(fileName).endswith('TIMSDP')
+
+def timsdp_files_in(directory):
+    return sorted(os.path.join(directory, f) for f in os.listdir(directory) if is_timsdp_file(f))
+
+def scan_file(fileName):
+    """
+    Scans a complete TIMSDP file for its header information and the number
+    of cycles it holds, without parsing the cycle data.
+
+    Returns the dictionary from scan_lines() with the file name, start time,
+    sample name and number of cycle rows (n_rows) added. Raises ValueError if
+    the file has no start time.
+    """
+    # Scan the file a line at a time rather than holding it all in memory,
+    # stopping at the #BLOCKS footer
+    with open_file(fileName) as f:
+        scan = scan_lines(f)
+
+    if not scan['match_time']:
+        raise ValueError("Couldn't find a match for the date time stamp")
+
+    sample_name = scan['match_name'].group(1) if scan['match_name'] else ''
+
+    # The cycle data run from the column names line to the #BLOCKS line, or
+    # to the end of the file if there isn't one, as they do for live imports
+    scan.update({
+        'fileName': fileName,
+        'start_time': datetime.strptime(scan['match_time'].group(1), '%d/%m/%Y %H:%M:%S'),
+        'sample_name': sample_name if len(sample_name) > 0 else "[blank]",
+        'n_rows': scan['data_rows']
+    })
+    return scan
+
+def read_timsdp_header(fileName):
+    """
+    Reads the header of a (possibly still growing) TIMSDP file, up to and
+    including the column names of the cycle data.
+
+    Returns None if that hasn't been completely written yet, otherwise a
+    dictionary with the start time, sample name, metadata, column names and
+    the byte offset of the first line of cycle data.
+    """
+    line_lengths = []
+
+    def complete_lines(f):
+        for line in iter(f.readline, b''):
+            if not line.endswith(b'\n'):
+                return
+            line_lengths.append(len(line))
+            yield line.decode(errors='replace').rstrip('\r\n')
+
+    with open(fileName, 'rb') as f:
+        scan = scan_lines(complete_lines(f), stop_at_data=True)
+
+    if not scan['names_list']:
+        return None
+
+    if not scan['match_time']:
+        return {'valid': False}
+
+    offset = sum(line_lengths[:scan['line_counter']])
+    start_time = datetime.strptime(scan['match_time'].group(1), '%d/%m/%Y %H:%M:%S')
+    sample_name = scan['match_name'].group(1) if scan['match_name'] else ''
+
+    return {
+        'valid': True,
+        'start_time': start_time,
+        'sample_name': sample_name if len(sample_name) > 0 else "[blank]",
+        'metadata': scan['metadata'],
+        'names_list': scan['names_list'],
+        'offset': offset,
+        'n_rows': 0,
+        'last_time': None,
+        'finished': False
+    }
+
+def read_new_rows(fileName):
+    """
+    Parses any complete cycles appended to fileName since it was last read
+    and appends them to the channels, never re-reading earlier bytes. Once
+    the #BLOCKS footer appears, the blank row between files is added and the
+    file and sample metadata are created. Returns the number of new rows.
+    """
+    state = live['files'][fileName]
+    size = os.path.getsize(fileName)
+    if state['finished'] or size <= state['offset']:
+        return 0
+
+    with open(fileName, 'rb') as f:
+        f.seek(state['offset'])
+        new_bytes = f.read(size - state['offset'])
+
+    # Leave any partly written last line for next time
+    end = new_bytes.rfind(b'\n') + 1
+    footer = re.search(rb'^#BLOCKS', new_bytes[:end], re.MULTILINE)
+    if footer:
+        end = footer.start()
+        state['finished'] = True
+
+    new_rows = 0
+    names_list = state['names_list']
+    if end > 0:
+        df = pd.read_csv(io.BytesIO(new_bytes[:end]), header=None, names=names_list, dtype=column_dtypes(names_list))
+        state['offset'] += end
+        new_rows = len(df.index)
 
-    #add start time in seconds to time column:
-    df['Time'] = df['Time'].add(start_time_in_s)
+    if new_rows > 0:
+        times = df['Time'].values + state['start_time'].timestamp()
+        for name in names_list[2:]:
+            metadata = {"machineName": "IsotopX TIMS", "mass": name} if re.match(r'^\d+$', name) else {"machineName": "IsotopX TIMS"}
+            data.addDataToInput(channel_name(name), times, df[name].values, metadata)
+            live['channels'].add(channel_name(name))
 
-    # Add blank row at end of dataframe here to create a blank between each file
-    df = df.append(pd.Series(), ignore_index=True)
+        state['n_rows'] += new_rows
+        state['last_time'] = times[-1]
 
-    # And add 1 millisecond to last time for the timing of this blank value
-    df['Time'].iloc[-1] = df['Time'].iloc[-2] + 0.001
+    if state['finished'] and state['last_time'] is not None:
+        # Add a blank row, 1 millisecond after the last cycle, between each file
+        blank_time = np.array([state['last_time'] + 0.001])
+        for name in names_list[2:]:
+            data.addDataToInput(channel_name(name), blank_time, np.array([np.nan]), {"machineName": "IsotopX TIMS"})
+
+        end_time = datetime.fromtimestamp(blank_time[0])
+        channels_list = [channel_name(name) for name in names_list if name not in ['Cycle', 'Time']]
+        data.createFileSampleMetadata(state['sample_name'], state['start_time'], end_time, fileName)
+        f = data.createImportedFileMetadata(state['start_time'], end_time, fileName, datetime.now(), state['n_rows'] + 1, channels_list)
+        f.setProperty("metadata", state['metadata'])
+        IoLog.debug("Finished live import of " + fileName)
+
+    return new_rows
+
+def start_live_import(fileName):
+    global live
+
+    if uncompressed_name(fileName) != fileName:
+        IoLog.error("Compressed files can't be imported live: " + fileName)
+        return
+
+    header = read_timsdp_header(fileName)
+    if not header or not header['valid']:
+        IoLog.error("Couldn't read the header of %s, so it can't be imported live"%(fileName))
+        return
+
+    folder = os.path.dirname(os.path.abspath(fileName))
+    live = {
+        'folder': folder,
+        'interval': min_poll_interval,
+        'idle': 0.0,
+        'channels': set(),
+        # Only files that appear after we start watching are picked up
+        'files': {os.path.join(folder, f): None for f in os.listdir(folder)},
+        'timer': QTimer()
+    }
+    live['files'][os.path.join(folder, os.path.basename(fileName))] = header
+
+    live['timer'].setSingleShot(True)
+    live['timer'].timeout.connect(poll_live_files)
+
+    IoLog.debug("Watching %s for new data"%(folder))
+    poll_live_files()
+
+def stop_live_import():
+    if live:
+        live['timer'].stop()
+        IoLog.debug("Stopped watching %s"%(live['folder']))
+        live.clear()
+
+def poll_live_files():
+    """
+    Checks the watched folder for new TIMSDP files and new cycles, then
+    schedules the next check, polling less often while nothing changes.
+    """
+    # Stop once the channels being appended to are gone, e.g. because the
+    # session they were imported into has been closed
+    if live['channels'] and live['channels'].isdisjoint(data.timeSeriesNames(data.Input)):
+        IoLog.debug("The live import's channels are no longer in the session")
+        stop_live_import()
+        return
+
+    # Errors reading the folder or a file (e.g. a row the instrument is still
+    # writing) are logged and the read is tried again on the next check
+    try:
+        names = os.listdir(live['folder'])
+    except OSError as e:
+        IoLog.warning("Couldn't list %s: %s"%(live['folder'], e))
+        names = []
+
+    for name in names:
+        path = os.path.join(live['folder'], name)
+        if path in live['files'] or not name.endswith('TIMSDP'):
+            continue
+
+        try:
+            header = read_timsdp_header(path)
+        except OSError as e:
+            IoLog.warning("Couldn't read the header of %s: %s"%(path, e))
+            continue
+
+        if header is None:
+            # Not completely written yet, so check again next time
+            continue
+
+        live['files'][path] = header if header['valid'] else None
+        if header['valid']:
+            IoLog.debug("Found new TIMSDP file: " + path)
+
+    new_rows = 0
+    for path, state in live['files'].items():
+        if state is None:
+            continue
+
+        try:
+            new_rows += read_new_rows(path)
+        except (OSError, ValueError) as e:
+            IoLog.warning("Couldn't read new data from %s, will try again: %s"%(path, e))
+
+    if new_rows > 0:
+        IoLog.debug("Added %i new cycles"%(new_rows))
+        data.calculateTotalBeam()
+        live['interval'] = min_poll_interval
+        live['idle'] = 0.0
+    else:
+        live['idle'] += live['interval']
+        live['interval'] = min(2*live['interval'], max_poll_interval)
+
+    if live['idle'] >= live_timeout:
+        IoLog.debug("No new data for %i s"%(live_timeout))
+        stop_live_import()
+        return
+
+    live['timer'].start(int(1000*live['interval']))
+
+def import_data():
+    """
+    see intro.py for explanation of functions
+    """
+    print("\n\n")
+
+    IoLog.debug("import_data in IsotopX TIMSDP importer called on file = %s"%(importer.fileName))
+
+    # A new import ends any live import still running
+    stop_live_import()
+
+    if live_import:
+        start_live_import(importer.fileName)
+        importer.message('Watching for new data')
+        importer.progress(100)
+        return
+
+    import_files([importer.fileName])
+
+def import_files(file_names):
+    """
+    Imports several TIMSDP files from one sequence (or directories of them)
+    in one go. Every file is scanned first to count its cycles, so that the
+    final channels can be allocated up front. Each file's cycles are then
+    parsed straight into their place in the channels, with a blank row after
+    each file, and each channel is registered with iolite only once.
+    """
+    expanded = []
+    for fileName in file_names:
+        if os.path.isdir(fileName):
+            expanded += timsdp_files_in(fileName)
+        else:
+            expanded.append(fileName)
+
+    scans = []
+    for fileName in expanded:
+        try:
+            scans.append(scan_file(fileName))
+        except ValueError as e:
+            IoLog.error("Could not import %s: %s"%(fileName, e))
+
+    if not scans:
+        importer.message('Error during import')
+        importer.progress(100)
+        return
+
+    scans.sort(key=lambda scan: scan['start_time'])
+
+    names_list = []
+    for scan in scans:
+        names_list += [name for name in scan['names_list'] if name not in names_list]
+
+    # Work out where each file goes in the channels, leaving room for a blank
+    # row after each one, then fill them in place
+    n_points = sum(scan['n_rows'] + 1 for scan in scans)
+    dtypes = column_dtypes(names_list)
+    buffers = {name: np.full(n_points, np.nan, dtypes[name]) for name in names_list if name != 'Cycle'}
+    times = buffers['Time']
+
+    start = 0
+    for scan in scans:
+        IoLog.debug("Start time for %s is: %s"%(scan['fileName'], scan['start_time'].strftime('%Y-%m-%d %H:%M:%S')))
+        with open_file(scan['fileName']) as f:
+            for i in range(scan['cycles_line'] + 2):
+                f.readline()
+
+            read_cycles(f, scan['names_list'], scan['n_rows'], buffers, start, n_points)
+
+        #add start time in seconds to time column:
+        end = start + scan['n_rows']
+        times[start:end] += scan['start_time'].timestamp()
+
+        # And add 1 millisecond to last time for the timing of this blank value
+        times[end] = (times[end - 1] if end > start else scan['start_time'].timestamp()) + 0.001
+        scan['end_time'] = datetime.fromtimestamp(times[end])
+        start = end + 1
 
     # Would drop unnecessary columns here (e.g. those that are all zeros etc)
-    #e.g. df = df.drop(['Cycle'], axis=1)
+    #e.g. del buffers['Cycle']
 
-    # clean up channel list to give proper names etc:
-    channels_list = []
+    # now add data as channels:
     for name in names_list:
         if name in ['Cycle', 'Time']:
             continue
-        
-        # add 'm' to start of channel with just mass in thier name:
-        if re.match(r'^\d+$', name):
-            channels_list.append('m'+name)
-        else:
-            channels_list.append(name)
 
-    # now add data as channels:
-    for channel in names_list[2:]:
-        if re.match(r'^\d+$', channel):
-            data.addDataToInput('m'+channel, df['Time'], df[channel], {"machineName": "IsotopX TIMS", "mass": channel})
+        if re.match(r'^\d+$', name):
+            data.addDataToInput(channel_name(name), times, buffers[name], {"machineName": "IsotopX TIMS", "mass": name})
         else:
-            data.addDataToInput(channel, df['Time'], df[channel], {"machineName": "IsotopX TIMS"})
+            data.addDataToInput(name, times, buffers[name], {"machineName": "IsotopX TIMS"})
 
     # Now calculate Total Beam:
     data.calculateTotalBeam()
 
-    data.createFileSampleMetadata(sample_name, start_time, datetime.fromtimestamp(df['Time'].iloc[-1]), importer.fileName)
-    f = data.createImportedFileMetadata(start_time, datetime.fromtimestamp(df['Time'].iloc[-1]), importer.fileName, datetime.now(), len(df.index), channels_list)
-    f.setProperty("metadata", metadata)
+    for scan in scans:
+        # clean up channel list to give proper names etc:
+        channels_list = [channel_name(name) for name in scan['names_list'] if name not in ['Cycle', 'Time']]
+        data.createFileSampleMetadata(scan['sample_name'], scan['start_time'], scan['end_time'], scan['fileName'])
+        f = data.createImportedFileMetadata(scan['start_time'], scan['end_time'], scan['fileName'], datetime.now(), scan['n_rows'] + 1, channels_list)
+        f.setProperty("metadata", scan['metadata'])
 
     importer.message('Finished')
     importer.progress(100)
@@ -15,8 +15,89 @@ import time
 import numpy as np
 import pandas as pd
 import re
+import os
+import sys
+import io
+import types
+import gzip
+import lzma
 from datetime import datetime
 
+# see nu_plasma_run_importer.py for how compressed files are handled
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+compression_extensions = [".gz", ".xz"] + ([".zst"] if zstandard else [])
+
+def uncompressed_name(fileName):
+    """
+    Returns fileName without its compression extension, if it has one.
+    """
+    for ext in compression_extensions:
+        if fileName.endswith(ext):
+            return fileName[:-len(ext)]
+
+    return fileName
+
+def open_file(fileName, binary=False, errors=None):
+    """
+    Opens fileName for reading, like open(), decompressing it on the fly
+    if it is compressed.
+    """
+    if fileName.endswith(".gz"):
+        f = gzip.open(fileName, "rb")
+    elif fileName.endswith(".xz"):
+        f = lzma.open(fileName, "rb")
+    elif zstandard and fileName.endswith(".zst"):
+        f = io.BufferedReader(
+            zstandard.ZstdDecompressor().stream_reader(open(fileName, "rb"), closefd=True)
+        )
+    else:
+        return open(fileName, "rb" if binary else "r", errors=errors)
+
+    return f if binary else io.TextIOWrapper(f, errors=errors)
+
+# see nu_plasma_run_importer.py for why only the file header is read, and
+# how the importers share one cache of headers
+HEADER_SNIFF_CHARS = 64 * 1024
+HEADER_CACHE_SIZE = 32
+header_cache_module = "iolite_importer_headers"
+
+def read_header(fileName):
+    """
+    Returns the first HEADER_SNIFF_CHARS characters of fileName (decompressed
+    if it is compressed), from the importers' shared cache when it is there.
+    """
+    cache = sys.modules.get(header_cache_module)
+    if cache is None:
+        cache = sys.modules.setdefault(
+            header_cache_module, types.ModuleType(header_cache_module)
+        )
+        cache.headers = {}
+
+    st = os.stat(fileName)
+    key = (os.path.abspath(fileName), st.st_size, st.st_mtime_ns, HEADER_SNIFF_CHARS)
+    header = cache.headers.get(key)
+    if header is None:
+        with open_file(fileName, errors="replace") as f:
+            header = f.read(HEADER_SNIFF_CHARS)
+        cache.headers[key] = header
+        while len(cache.headers) > HEADER_CACHE_SIZE:
+            cache.headers.pop(next(iter(cache.headers)))
+
+    return header
+
+# see nu_plasma_run_importer.py for what single_precision trades off
+single_precision = False
+
+
+def column_dtypes(columns):
+    value_dtype = np.float32 if single_precision else np.float64
+    return {c: np.float64 if c == "time" else value_dtype for c in columns}
+
+
 m_fileName = ""
 
 
@@ -25,7 +106,7 @@ def setFileName(fileName):
 
 
 def accepted_files():
-    return ".run"
+    return ";".join(".run" + c for c in [""] + compression_extensions)
 
 
 def correct_format():
@@ -35,15 +116,14 @@ def correct_format():
         % (importer.fileName)
     )
 
-    if importer.fileName.endswith("run"):
+    if uncompressed_name(importer.fileName).endswith("run"):
         IoLog.debug("Checking within .run file...")
         nrf_regex = r"Sr laser\.nrf"
-        with open(importer.fileName) as f:
-            match = re.search(nrf_regex, f.read(), re.MULTILINE)
-            if match:
-                return True
-            else:
-                IoLog.debug(".run file did not match the Sr nrf regex.")
+        match = re.search(nrf_regex, read_header(importer.fileName), re.MULTILINE)
+        if match:
+            return True
+        else:
+            IoLog.debug(".run file did not match the Sr nrf regex.")
 
     return False
 
@@ -54,12 +134,20 @@ def import_data():
     """
     IoLog.debug("import_data in Sr importer called on file = %s" % (importer.fileName))
 
+    """
+        Nu Plasma data .run files contain no channel header information, so the columns that appear depends on the nrf file used to collect the data.
+        You need to know what collector each column represents and give it a name below.
+    """
+
+    names_list = ['Sr89','Sr88','Sr87','Sr86.5','Sr86','Sr85.5','Sr85','Sr84.5','Sr84','Sr83','Sr82','Sr81','Point_number','time','Zeroes_Column']
+    mass_list = ['89','88','87','86.5','86','85.5','85','84.5','84','83','82','81']
+
     # find the date and time using a regular expression:
     time_regex = (
         r"\"(\d{2})\/(\d{2})\/(\d{4})\",\"(\d{2}):(\d{2}):(\d{2})\s([aApP][mM])\"[\n\r]"
     )
     name_regex = r"Laser_Sr\.nrf\"\n\"(.*)\"\n"
-    with open(importer.fileName) as f:
+    with open_file(importer.fileName) as f:
         file_contents = f.read()
         match_time = re.search(time_regex, file_contents, re.MULTILINE)
         match_name = re.search(name_regex, file_contents, re.MULTILINE)
@@ -89,48 +177,55 @@ def import_data():
 
     # Now find where the Spare Text line is so that we know where the data start
     # We'll also workout how many footer lines too
+    # The data rows are the numeric lines from there up to the first line of
+    # text, so the C parser can be told exactly how many rows to read (it
+    # skips blank lines, so they aren't counted).
     stext_line = 0
     footer_lines = 0
+    data_rows = 0
+    in_footer = False
     line_counter = 0
     for line in lines:
         line_counter += 1
         if line.startswith('"Spare text"'):
             stext_line = line_counter
             continue
-        if stext_line > 0 and not re.match(r"^-?\.?\d", line):
+        if stext_line == 0:
+            continue
+        if not re.match(r"^-?\.?\d", line):
             footer_lines += 1
+            in_footer = in_footer or bool(line.strip())
+        elif not in_footer:
+            data_rows += 1
 
     IoLog.debug(f"Spare text line is on Line No {stext_line}")
     IoLog.debug(f"Number of footer lines: {footer_lines}")
+    IoLog.debug(f"Number of data rows: {data_rows}")
 
-    """
-        Nu Plasma data .run files contain no channel header information, so the columns that appear depends on the nrf file used to collect the data.
-        You need to know what collector each column represents and give it a name below.
-    """
-
-    names_list = ['Sr89','Sr88','Sr87','Sr86.5','Sr86','Sr85.5','Sr85','Sr84.5','Sr84','Sr83','Sr82','Sr81','Point_number','time','Zeroes_Column']
-    mass_list = ['89','88','87','86.5','86','85.5','85','84.5','84','83','82','81']
-
-    # For the time being, assume data always starts on line 58 (zero-index).
+    # Parse the text already read, rather than reading (and decompressing)
+    # the file again
+    channel_columns = names_list[: len(mass_list)] + ["time"]
     df = pd.read_csv(
-        importer.fileName,
+        io.StringIO(file_contents),
         skiprows=stext_line,
-        skipfooter=footer_lines - 1,
+        nrows=data_rows,
         header=None,
         names=names_list,
-        engine="python",
+        usecols=channel_columns,
+        dtype=column_dtypes(channel_columns),
+        engine="c",
     )
 
-    df = df.drop(["Point_number", "Zeroes_Column"], axis=1)
-
     # add start time in seconds to time column:
     df["time"] = df["time"].add(start_time_in_s)
 
+    columns = {c: df[c].values for c in channel_columns}
+
     for column, mass in zip(names_list, mass_list):
         if column is "time":
             continue
         channel = data.createTimeSeries(
-            column, data.Input, df["time"].values, df[column].values
+            column, data.Input, columns["time"], columns[column]
         )
         channel.setProperty("Mass", mass)
         channel.setProperty("Units", "volts")
@@ -141,15 +236,15 @@ def import_data():
     data.createFileSampleMetadata(
         sample_name,
         start_time,
-        datetime.fromtimestamp(df["time"].iloc[-1]),
+        datetime.fromtimestamp(columns["time"][-1]),
         importer.fileName,
     )
     data.createImportedFileMetadata(
         start_time,
-        datetime.fromtimestamp(df["time"].iloc[-1]),
+        datetime.fromtimestamp(columns["time"][-1]),
         importer.fileName,
         datetime.now(),
-        len(df.index),
+        len(columns["time"]),
         names_list[0:-3],
     )
 
@@ -15,6 +15,12 @@ import time
 import numpy as np
 import pandas as pd
 import re
+import os
+import sys
+import io
+import types
+import gzip
+import lzma
 from datetime import datetime
 
 constants = {
@@ -49,43 +55,316 @@ offsets = {
     'cycle 2':  30
 }
 
+# see nu_plasma_run_importer.py for how compressed files are handled
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+compression_extensions = ['.gz', '.xz'] + (['.zst'] if zstandard else [])
+
+def uncompressed_name(fileName):
+    """
+    Returns fileName without its compression extension, if it has one.
+    """
+    for ext in compression_extensions:
+        if fileName.endswith(ext):
+            return fileName[:-len(ext)]
+
+    return fileName
+
+def open_file(fileName, binary=False, errors=None):
+    """
+    Opens fileName for reading, like open(), decompressing it on the fly
+    if it is compressed.
+    """
+    if fileName.endswith('.gz'):
+        f = gzip.open(fileName, 'rb')
+    elif fileName.endswith('.xz'):
+        f = lzma.open(fileName, 'rb')
+    elif zstandard and fileName.endswith('.zst'):
+        f = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(fileName, 'rb'), closefd=True))
+    else:
+        return open(fileName, 'rb' if binary else 'r', errors=errors)
+
+    return f if binary else io.TextIOWrapper(f, errors=errors)
+
+# see nu_plasma_run_importer.py for why only the file header is read, and
+# how the importers share one cache of headers
+HEADER_SNIFF_CHARS = 64*1024
+HEADER_CACHE_SIZE = 32
+header_cache_module = 'iolite_importer_headers'
+
+def read_header(fileName):
+    """
+    Returns the first HEADER_SNIFF_CHARS characters of fileName (decompressed
+    if it is compressed), from the importers' shared cache when it is there.
+    """
+    cache = sys.modules.get(header_cache_module)
+    if cache is None:
+        cache = sys.modules.setdefault(header_cache_module, types.ModuleType(header_cache_module))
+        cache.headers = {}
+
+    st = os.stat(fileName)
+    key = (os.path.abspath(fileName), st.st_size, st.st_mtime_ns, HEADER_SNIFF_CHARS)
+    header = cache.headers.get(key)
+    if header is None:
+        with open_file(fileName, errors='replace') as f:
+            header = f.read(HEADER_SNIFF_CHARS)
+        cache.headers[key] = header
+        while len(cache.headers) > HEADER_CACHE_SIZE:
+            cache.headers.pop(next(iter(cache.headers)))
+
+    return header
+
 m_fileName = ""
 
 def setFileName(fileName):
     m_fileName = fileName
 
 def accepted_files():
-    return ".txt"
+    return ";".join('.txt' + c for c in [''] + compression_extensions)
 
 def correct_format():
 
     IoLog.debug("correct_format for U-Th importer called on file = %s"%(importer.fileName))
 
-    if importer.fileName.endswith('txt'):
+    if uncompressed_name(importer.fileName).endswith('txt'):
         IoLog.debug("Checking within .run file...")
         nrf_regex = r"UThAge_II\.nrf"
-        with open(importer.fileName) as f:
-            match = re.search(nrf_regex, f.read(), re.MULTILINE)
-            if match:
-                return True
-            else:
-                IoLog.debug(".run file did not match the U-Th nrf regex.")
+        match = re.search(nrf_regex, read_header(importer.fileName), re.MULTILINE)
+        if match:
+            return True
+        else:
+            IoLog.debug(".run file did not match the U-Th nrf regex.")
 
     return False
 
+# The header is read in a single pass by scan_metadata(). These describe
+# where each piece of metadata is found:
+#   header_line_fields: (label, start of the line holding the value)
+#   header_section_fields: (label, section title, number of non-blank lines
+#                           after the title holding the value)
+#   header_inline_fields: (label, text the value starts with)
+header_line_fields = [
+    ('nrf file', '"Run File = '),
+    ('gains', '"Gains : ",'),
+    ('bucket efficiencies', '"Bucket efficiencys : ",'),
+    ('ion counter deadtimes', '"Ion counting deadtimes : ",')
+]
+
+header_section_fields = [
+    ('high voltage settings', '"High Voltage Settings"', 1),
+    ('deflector settings', '"Deflector Settings"', 1),
+    ('plasma settings', '"Plasma Settings"', 1),
+    ('IC settings', '"Ion Counting Settings"', 4)
+]
+
+header_inline_fields = [
+    ('motor settings', '"X motor pos'),
+    ('vacuum settings', '"Pir 1')
+]
+
+# These values end in a trailing comma that isn't part of the value
+comma_terminated_fields = ['gains', 'bucket efficiencies', 'ion counter deadtimes', 'high voltage settings', 'deflector settings']
+
+# Stop looking for metadata after this many lines
+max_header_lines = 200
+
+# Set to True to only read the metadata, without parsing any measurement data
+metadata_only = False
+
+# Set to True to correct the data for ion counter dead time and Faraday gain
+# and bucket efficiency as they are imported, using the values in the file
+# header. The factors used are recorded as channel properties so that a DRS
+# can tell the correction has already been done. It is off by default, so
+# that files import as they always have unless the corrections are wanted
+# (and aren't already made later, e.g. in a DRS).
+correct_at_import = False
+
+# Set to True to hand the channel values to iolite as float32 (see
+# nu_plasma_run_importer.py). The corrections and baseline subtraction are
+# still done in float64.
+single_precision = False
+
+#find the date and time using a regular expression:
+time_regex = r"\"Started analysis at (?P<hour>\d+):(?P<minutes>\d+) [\w ]+, (?P<month>\w+) (?P<day>\d+), (?P<year>\d+)\""
+name_regex = r"\"Sample Name is (.*)\""
+
+def parse_values(value):
+    """
+    Splits a comma separated header value into a list, converting
+    the entries to numbers where possible.
+    """
+    values = []
+    for v in value.split(','):
+        v = v.strip().strip('"').strip()
+        try:
+            values.append(float(v))
+        except ValueError:
+            values.append(v)
+
+    return values
+
+def scan_metadata(fileName):
+    """
+    Reads the start time, sample name and instrument settings from the
+    header of a U-Th .txt file in a single pass, without touching the
+    measurement data or iolite's data, so it can also be used to audit
+    archived files.
+
+    Returns (match_time, match_name, metadata) where metadata holds the
+    raw header strings, keyed by the labels above.
+    """
+    match_time = None
+    match_name = None
+    metadata = {}
+    n_fields = len(header_line_fields) + len(header_section_fields) + len(header_inline_fields)
+
+    # The section currently being read: [label, lines still to read, lines read so far]
+    section = None
+
+    with open_file(fileName) as f:
+        for line_number, line in enumerate(f):
+            if line_number >= max_header_lines:
+                break
+
+            line = line.rstrip('\r\n')
+            if not line:
+                continue
+
+            if section:
+                section[2].append(line)
+                section[1] -= 1
+                if section[1] == 0:
+                    metadata[section[0]] = section[2] if len(section[2]) > 1 else section[2][0]
+                    section = None
+                continue
+
+            if match_time is None:
+                match_time = re.search(time_regex, line)
+
+            if match_name is None:
+                match_name = re.search(name_regex, line)
+
+            for label, prefix in header_line_fields:
+                if line.startswith(prefix):
+                    metadata[label] = line[len(prefix):]
+
+            for label, title, n_lines in header_section_fields:
+                if line.startswith(title):
+                    section = [label, n_lines, []]
+
+            for label, start in header_inline_fields:
+                if start in line:
+                    metadata[label] = line[line.index(start):]
+
+            if match_time and match_name and len(metadata) == n_fields:
+                break
+
+    if 'nrf file' in metadata:
+        metadata['nrf file'] = metadata['nrf file'].rstrip('"')
+
+    for label in comma_terminated_fields:
+        if label in metadata:
+            metadata[label] = metadata[label].rpartition(',')[0]
+
+    return match_time, match_name, metadata
+
+# Measurement rows only hold numbers, so the footer starts at the first line
+# that begins with anything else (blank lines aside, which the C parser skips)
+footer_regex = re.compile(r'^[ \t]*[^\s+\-.0-9]', re.MULTILINE)
+
+class DataRows:
+    """
+    A file of the measurement rows of the open file f, from its current
+    position up to the footer (see footer_regex). pandas parses the rows
+    from it as f is read, so the file is read (and decompressed) once,
+    without counting the rows first.
+    """
+    def __init__(self, f):
+        self.f = f
+        self.ended = False
+
+    def read(self, size=-1):
+        if self.ended:
+            return ''
+
+        # Always stop at the end of a line, so the start of a line is never
+        # just the end of a number
+        text = self.f.read(size) + self.f.readline() if size > 0 else self.f.read()
+        footer = footer_regex.search(text)
+        if footer or not text:
+            self.ended = True
+            text = text[:footer.start()] if footer else text
+
+        return text
+
+    def __iter__(self):
+        return iter(lambda: self.read(io.DEFAULT_BUFFER_SIZE), '')
+
+def structured_metadata(metadata):
+    """
+    Converts the raw header strings into lists of values (numbers where
+    possible) suitable for storing as properties of the imported file.
+    """
+    structured = {}
+    for label, value in metadata.items():
+        if label == 'nrf file':
+            structured[label] = value
+        elif isinstance(value, list):
+            structured[label] = [parse_values(v) for v in value]
+        else:
+            structured[label] = parse_values(value)
+
+    return structured
+
+def import_corrections(file_properties, collectors):
+    """
+    Works out the correction for each collector from the parsed header.
+
+    Returns (factors, dead_times, applied). factors and dead_times have one
+    entry per collector: Faradays are multiplied by their gain and divided
+    by their bucket efficiency; ion counters have a factor of 1 and their
+    dead time (ns), while Faradays have a dead time of 0. applied lists the
+    corrections that could be found in the header.
+    """
+    ion_counters = np.array([c.startswith('IC') for c in collectors])
+    factors = np.ones(len(collectors))
+    dead_times = np.zeros(len(collectors))
+    applied = []
+
+    def values_for(label, n):
+        values = file_properties.get(label, [])
+        if len(values) != n or not all(isinstance(v, float) for v in values):
+            IoLog.warning("Expected %i numeric %s but found: %s. These won't be corrected for."%(n, label, values))
+            return None
+        return np.array(values)
+
+    gains = values_for('gains', np.count_nonzero(~ion_counters))
+    if gains is not None:
+        factors[~ion_counters] *= gains
+        applied.append('gain')
+
+    efficiencies = values_for('bucket efficiencies', np.count_nonzero(~ion_counters))
+    if efficiencies is not None:
+        factors[~ion_counters] /= efficiencies
+        applied.append('bucket efficiency')
+
+    ic_dead_times = values_for('ion counter deadtimes', np.count_nonzero(ion_counters))
+    if ic_dead_times is not None:
+        dead_times[ion_counters] = ic_dead_times
+        applied.append('dead time')
+
+    return factors, dead_times, applied
+
 def import_data():
     """
     see intro.py for explanation of functions
     """
     IoLog.debug("import_data in U-Th importer called on file = %s"%(importer.fileName))
 
-    #find the date and time using a regular expression:
-    time_regex = r"\"Started analysis at (?P<hour>\d+):(?P<minutes>\d+) [\w ]+, (?P<month>\w+) (?P<day>\d+), (?P<year>\d+)\""
-    name_regex = r"\"Sample Name is (.*)\""
-    with open(importer.fileName) as f:
-        file_contents = f.read()
-        match_time = re.search(time_regex, file_contents, re.MULTILINE)
-        match_name = re.search(name_regex, file_contents, re.MULTILINE)
+    match_time, match_name, metadata = scan_metadata(importer.fileName)
 
     if not match_time:
         IoLog.error("Couldn't find a match for the date time stamp")
@@ -107,89 +386,132 @@ def import_data():
         sample_name = match_name.group(1).lstrip()
         IoLog.debug("Sample name: " + sample_name)
 
-    # Get all metadata as dictionary:
-    metadata = {}
-
-    def getMetadataFromRegex(label, regex, file_contents_str):
-        metadata[label] = re.search(regex, file_contents_str, re.MULTILINE).group(1)
-
-    regex_list = [
-        r"^\"Run File = (.*)\"$",
-        r"^\"Gains : \",(.*),$",
-        r"^\"Bucket efficiencys : \",(.*),$",
-        r"^\"Ion counting deadtimes : \",(.*),$",
-        r"\"High Voltage Settings\".*[\n\r]{2}(.*),",
-        r"\"Deflector Settings\".*[\n\r]{2}(.*),",
-        r"\"Plasma Settings\".*[\n\r]{2}(.*)",
-        r"(\"X motor pos.*)",
-        r"(\"Pir 1.*)"
-    ]
-
-    meta_label_list = [
-        'nrf file',
-        'gains',
-        'bucket efficiencies',
-        'ion counter deadtimes',
-        'high voltage settings',
-        'deflector settings',
-        'plasma settings',
-        'motor settings',
-        'vacuum settings'
-    ]
-
-    # Note: have to handle IC settings separately as they are spread over several lines...
-
-    for label, regex in zip(meta_label_list, regex_list):
-        getMetadataFromRegex(label, regex, file_contents)
-
-    IC_settings_regex = r"\"Ion Counting Settings\"[\r\n]{2}([\w\" ,-\.]+)[\n\r]{2}([\w\" ,-\.]+)[\n\r]{2}([\w\" ,-\.]+)[\n\r]{2}([\w\" ,-\.]+)"
-    metadata["IC settings"] = list(re.search(IC_settings_regex, file_contents, re.MULTILINE).groups())
+    for label in [l[0] for l in header_line_fields + header_section_fields + header_inline_fields]:
+        if label not in metadata:
+            IoLog.warning("Couldn't find the %s in file %s"%(label, importer.fileName))
 
     IoLog.debug(str(metadata))
+    file_properties = structured_metadata(metadata)
+
+    if metadata_only:
+        f = data.createImportedFileMetadata(start_time, start_time, importer.fileName, datetime.now(), 0, [])
+        for label, value in file_properties.items():
+            f.setProperty(label, value)
+
+        importer.message('Finished')
+        importer.progress(100)
+        importer.finished()
+        return
 
 
     '''
         Nu Plasma data .txt files contain no channel header information, so the columns that appear depends on the nrf file used to collect the data.
         You need to know what collector each column represents and give it a name below.
+        Each row is one measurement, with a block of columns (one per collector) for each of the groups below, followed by the measurement number.
     '''
 
-    names_list = ['H5 base 1','H4 base 1','H3 base 1','H2 base 1','H1 base 1','Ax base 1','L1 base 1','L2 base 1','L3 base 1','IC0 base 1','L4 base 1','L5 base 1','L6 base 1',
-                    'IC1 base 1','L7 base 1','H5 base 2','H4 base 2','H3 base 2','H2 base 2','H1 base 2','Ax base 2','L1 base 2','L2 base 2','L3 base 2','IC0 base 2','L4 base 2',
-                    'L5 base 2','L6 base 2','IC1 base 2','L7 base 2','H5 Cycle 1','H4 Cycle 1','H3 Cycle 1','H2 Cycle 1','H1 Cycle 1','Ax Cycle 1','L1 Cycle 1','L2 Cycle 1',
-                    'L3 Cycle 1','IC0 Cycle 1','L4 Cycle 1','L5 Cycle 1','L6 Cycle 1','IC1 Cycle 1','L7 Cycle 1','H5 Cycle 2','H4 Cycle 2','H3 Cycle 2','H2 Cycle 2','H1 Cycle 2',
-                    'Ax Cycle 2','L1 Cycle 2','L2 Cycle 2','L3 Cycle 2','IC0 Cycle 2','L4 Cycle 2','L5 Cycle 2','L6 Cycle 2','IC1 Cycle 2','L7 Cycle 2', 'measurement']
+    collectors = ['H5','H4','H3','H2','H1','Ax','L1','L2','L3','IC0','L4','L5','L6','IC1','L7']
+    groups = ['base 1', 'base 2', 'Cycle 1', 'Cycle 2']
+    group_offsets = [offsets['zero 1'], offsets['zero 2'], offsets['cycle 1'], offsets['cycle 2']]
+    names_list = ['%s %s'%(collector, group) for group in groups for collector in collectors] + ['measurement']
 
     #For the time being, assume data always starts on line 21 (zero-index). NOTE: had to use skiprows=40... not sure why, perhaps new line characters in file? Anyway, this seems to work for test file...
-    df = pd.read_csv(importer.fileName, skiprows=41, skipfooter=3, header=None, names=names_list)
+    # The header lines end in a doubled carriage return, which reads as an
+    # extra blank line, hence the 41.
+    with open_file(importer.fileName) as f:
+        for i in range(41):
+            f.readline()
+        df = pd.read_csv(DataRows(f), header=None, names=names_list, dtype=np.float64, engine='c')
 
     #Testing accessing constants:
     #IoLog.debug("Here's the constants: " + str(constants['234U']['Decay constant']) + "\n" + str(constants['NP080 IC0 DT']))
 
-    #df.to_excel('/Users/bence/iolite4_xyz/iolite4/tests/UTh/test_import.xlsx')
-
-    return
-
-    #add start time in seconds to time column:
-    df['time'] = df['time'].add(start_time_in_s)
-
-    for column, mass in zip(names_list, mass_list):
-        if column in ['measurement','time','type_col']:
-            continue
-        channel = data.createTimeSeries(column, data.Input, df['time'].values, df[column].values)
-        channel.setProperty("Mass", mass)
-        channel.setProperty("Units", "volts")
-
+    importer.message('Separating cycles and baselines...')
+    importer.progress(50)
+
+    # De-interleave the block into (measurement, group, collector) so that
+    # each group can be handled for all collectors at once
+    n_measurements = len(df.index)
+    block = df[names_list[:-1]].to_numpy(dtype=np.float64).reshape(n_measurements, len(groups), len(collectors))
+
+    # The ion counters are recorded as volts equivalent, like the Faradays, and
+    # stay that way whether or not they are corrected below
+    collector_properties = [{"Collector": collector, "Units": "volts"} for collector in collectors]
+
+    if correct_at_import:
+        factors, dead_times, applied = import_corrections(file_properties, collectors)
+
+        # Gain and bucket efficiency, for every group and collector at once
+        block *= factors
+
+        # Non-paralyzable dead time correction of the ion counters. Their
+        # signals are reported as volts equivalent, so are converted to count
+        # rates to apply the dead time.
+        # Count rates at or above 1/dead time can't be corrected, so those
+        # values are set to NaN.
+        ic = dead_times > 0
+        count_rates = block[:, :, ic]*constants['CPS/Volts']
+        denominator = 1.0 - count_rates*dead_times[ic]*1e-9
+        saturated = denominator <= 0
+        if saturated.any():
+            IoLog.warning("%i ion counter values in %s are too high to correct for dead time and were set to NaN"%(np.count_nonzero(saturated), importer.fileName))
+            denominator[saturated] = np.nan
+        block[:, :, ic] /= denominator
+
+        for c, properties in enumerate(collector_properties):
+            if ic[c]:
+                properties["Dead time (ns)"] = float(dead_times[c])
+                properties["Import corrections"] = "dead time"
+            elif 'gain' in applied or 'bucket efficiency' in applied:
+                properties["Gain and efficiency factor"] = float(factors[c])
+                properties["Import corrections"] = ", ".join(a for a in applied if a != 'dead time')
+
+    # Each cycle has its own baseline (base 1 for Cycle 1, base 2 for Cycle 2)
+    baselines = block[:, :2, :]
+    on_peak = block[:, 2:, :]
+    corrected = on_peak - baselines
+
+    if single_precision:
+        block = block.astype(np.float32)
+        corrected = corrected.astype(np.float32)
+
+    # Times for each group of each measurement, from the start of the run
+    measurement = df['measurement'].to_numpy(dtype=np.float64)
+    measurement_start = start_time_in_s + (measurement - measurement[0])*total_time_per_measurement
+    times = measurement_start[:, np.newaxis] + np.array(group_offsets)[np.newaxis, :]
+
+    importer.message('Adding channels...')
+    importer.progress(75)
+
+    # Put each channel's values next to each other in memory, so that iolite
+    # isn't handed strided views
+    times = np.ascontiguousarray(times.T)
+    block = np.ascontiguousarray(block.transpose(1, 2, 0))
+    corrected = np.ascontiguousarray(corrected.transpose(1, 2, 0))
+
+    channels_list = []
+    for g, group in enumerate(groups):
+        for c, collector in enumerate(collectors):
+            channels_list.append('%s %s'%(collector, group))
+            channel = data.createTimeSeries(channels_list[-1], data.Input, times[g], block[g, c])
+            for name, value in collector_properties[c].items():
+                channel.setProperty(name, value)
+
+    for cycle in range(2):
+        for c, collector in enumerate(collectors):
+            channels_list.append('%s Cycle %i BLS'%(collector, cycle + 1))
+            channel = data.createTimeSeries(channels_list[-1], data.Input, times[cycle + 2], corrected[cycle, c])
+            for name, value in collector_properties[c].items():
+                channel.setProperty(name, value)
 
     # Now calculate Total Beam:
     data.calculateTotalBeam()
 
-    # IoLog.debug("Start Time: " + start_time.strftime("%d,%m,%Y,%I,%M,%S,%p"))
-    # IoLog.debug("End Time: " + datetime.fromtimestamp(df['time'].iloc[-1]).strftime("%d,%m,%Y,%I,%M,%S,%p"))
-    # IoLog.debug("Import Time: " + datetime.now().strftime("%d,%m,%Y,%I,%M,%S,%p"))
-    # IoLog.debug("No Of Points: {}".format(len(df.index)))
-    # IoLog.debug("Mass list: " + ', '.join(names_list))
-    #
-    # importer.addImportedMassSpecFile(start_time, datetime.fromtimestamp(df['time'].iloc[-1]), importer.fileName, datetime.now(), len(df.index), ', '.join(names_list), "Nu Plasma")
+    end_time = datetime.fromtimestamp(times[-1, -1])
+    data.createFileSampleMetadata(sample_name, start_time, end_time, importer.fileName)
+    f = data.createImportedFileMetadata(start_time, end_time, importer.fileName, datetime.now(), n_measurements, channels_list)
+    for label, value in file_properties.items():
+        f.setProperty(label, value)
 
     importer.message('Finished')
     importer.progress(100)
@@ -11,7 +11,17 @@ import time
 import numpy as np
 import pandas as pd
 import re
+import os
+import sys
+import io
+import types
+import gzip
+import lzma
+import json
+import shutil
+import hashlib
 from datetime import datetime
+from iolite.QtCore import QTimer
 
 
 """
@@ -50,13 +60,149 @@ importer    an interface to the corresponding C++ class in iolite
             from which some properties can be accessed, e.g. fileName
 """
 
+# Compressed files (.gz, .xz and, if the zstandard package is installed,
+# .zst) are decompressed as they are read, so they never have to be
+# unpacked to disk first. Header sniffing only decompresses the start of
+# the file.
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+compression_extensions = ['.gz', '.xz'] + (['.zst'] if zstandard else [])
+
+def uncompressed_name(fileName):
+    """
+    Returns fileName without its compression extension, if it has one.
+    """
+    for ext in compression_extensions:
+        if fileName.endswith(ext):
+            return fileName[:-len(ext)]
+
+    return fileName
+
+def open_file(fileName, binary=False, errors=None):
+    """
+    Opens fileName for reading, like open(), decompressing it on the fly
+    if it is compressed.
+    """
+    if fileName.endswith('.gz'):
+        f = gzip.open(fileName, 'rb')
+    elif fileName.endswith('.xz'):
+        f = lzma.open(fileName, 'rb')
+    elif zstandard and fileName.endswith('.zst'):
+        f = io.BufferedReader(zstandard.ZstdDecompressor().stream_reader(open(fileName, 'rb'), closefd=True))
+    else:
+        return open(fileName, 'rb' if binary else 'r', errors=errors)
+
+    return f if binary else io.TextIOWrapper(f, errors=errors)
+
+# Only the start of a file is needed to recognise its format, so
+# correct_format() looks at a bounded prefix rather than reading the whole
+# (potentially very large) file. iolite asks every importer about each file
+# it is given, and loads each importer as a separate module, so the prefixes
+# are kept in one cache for all of them: a module registered in sys.modules
+# as header_cache_module, shared by every importer with this read_header().
+# It holds the last HEADER_CACHE_SIZE prefixes by path, size and
+# modification time, so a file is read once however many importers check
+# it, and again only after it changes.
+HEADER_SNIFF_CHARS = 64*1024
+HEADER_CACHE_SIZE = 32
+header_cache_module = 'iolite_importer_headers'
+
+def read_header(fileName):
+    """
+    Returns the first HEADER_SNIFF_CHARS characters of fileName (decompressed
+    if it is compressed), from the importers' shared cache when it is there.
+    """
+    cache = sys.modules.get(header_cache_module)
+    if cache is None:
+        cache = sys.modules.setdefault(header_cache_module, types.ModuleType(header_cache_module))
+        cache.headers = {}
+
+    st = os.stat(fileName)
+    key = (os.path.abspath(fileName), st.st_size, st.st_mtime_ns, HEADER_SNIFF_CHARS)
+    header = cache.headers.get(key)
+    if header is None:
+        with open_file(fileName, errors='replace') as f:
+            header = f.read(HEADER_SNIFF_CHARS)
+        cache.headers[key] = header
+        while len(cache.headers) > HEADER_CACHE_SIZE:
+            cache.headers.pop(next(iter(cache.headers)))
+
+    return header
+
+# When chunked_import is True the numeric block is parsed chunk_rows rows at
+# a time into preallocated column buffers, with the import progress updated
+# after every block. This keeps peak memory close to the size of the final
+# arrays for very long runs. Set it to False to parse the block in one go.
+chunked_import = True
+chunk_rows = 100000
+
+# When single_precision is True, channel values are parsed into and handed to
+# iolite as float32 rather than float64 arrays, halving the memory they take.
+# Collector volts and counts are far less precise than float32's ~7
+# significant digits; benchmarks/float32_accuracy.py reports how much
+# downstream results move. Times always stay float64, since float32 can only
+# resolve about 2 minutes in a timestamp.
+single_precision = False
+
+def column_dtypes(columns):
+    value_dtype = np.float32 if single_precision else np.float64
+    return {c: np.float64 if c == 'time' else value_dtype for c in columns}
+
+# When use_cache is True, parsed data are cached in cache_dir as .npy files,
+# keyed by the file's path, size and modification time plus this importer's
+# name, version and precision (see single_precision), so importing the same
+# file again just loads the arrays back. A hash of the start and end of the
+# file is stored with each entry and checked on a hit, so a file rewritten
+# without changing its size or modification time is parsed again. The least
+# recently used entries are removed once the cache grows past
+# cache_max_bytes.
+#
+# The cache is off by default, as it can take up to cache_max_bytes of disk
+# in the user's home folder. Only the time and channel columns are stored:
+# the start time is already added to the times, and the masses and channel
+# names come from names_list and mass_list below.
+#
+# The other importers don't cache their output. They make sample and file
+# metadata (sample name, start and end times) from each file as well as its
+# channels, and the U-Th importer can correct the data with the dead times in
+# its header as it imports (see correct_at_import there), so an entry would
+# need all of that stored, and the settings in its key.
+use_cache = False
+cache_dir = os.path.join(os.path.expanduser('~'), '.cache', 'iolite', 'importers')
+cache_max_bytes = 4*1024**3
+cache_check_bytes = 1 << 20
+importer_name = 'NuPlasma .run importer'
+importer_version = '1.0'
+
+# When live_import is True, import_data() keeps watching the folder of the
+# imported file while the instrument is still acquiring. Rows appended to
+# that file, or to new Laser_Sr .run files that appear next to it, are
+# parsed from where the previous read stopped and appended to the existing
+# channels. The folder is polled every min_poll_interval seconds, backing off
+# to max_poll_interval while nothing changes, and watching stops after
+# live_timeout seconds without any new data, once the channels it appends to
+# are no longer in the session, when another import starts or when
+# stop_live_import() is called.
+live_import = False
+min_poll_interval = 0.5
+max_poll_interval = 10.0
+live_timeout = 30*60
+
+# State of the live import: the folder being watched, the settings it was
+# started with and, for each file, its start time and the byte offset of
+# the first row not yet read (None for files in the folder we should ignore)
+live = {}
+
 m_fileName = ""
 
 def setFileName(fileName):
     m_fileName = fileName
 
 def accepted_files():
-    return ".run"
+    return ";".join('.run' + c for c in [''] + compression_extensions)
 
 
 def correct_format():
@@ -81,19 +227,335 @@ def correct_format():
     """
     IoLog.debug("correct_format for Nu Plasma Sr run file importer called on file = %s"%(importer.fileName))
 
-    if importer.fileName.endswith('run'):
+    if uncompressed_name(importer.fileName).endswith('run'):
         IoLog.debug("Found a .run file: " + importer.fileName)
 
         nrf_regex = r"Laser_Sr\.nrf"
-        with open(importer.fileName) as f:
-            match = re.search(nrf_regex, f.read(), re.MULTILINE)
-            if match:
-                return True
-            else:
-                IoLog.debug(".run file did not match the Sr nrf regex.")
+        match = re.search(nrf_regex, read_header(importer.fileName), re.MULTILINE)
+        if match:
+            return True
+        else:
+            IoLog.debug(".run file did not match the Sr nrf regex.")
 
     return False
 
+def estimate_rows(f, sample_lines=100):
+    """
+    Estimates how many lines are left in the open file f from the length
+    of the next few lines, leaving the file position unchanged.
+
+    Returns 0 for compressed files, whose uncompressed size isn't known,
+    in which case the column buffers just grow as they are filled.
+    """
+    if uncompressed_name(importer.fileName) != importer.fileName:
+        return 0
+
+    start = f.tell()
+    remaining = os.fstat(f.fileno()).st_size - start
+    sample_bytes = 0
+    n = 0
+    for n in range(1, sample_lines + 1):
+        line = f.readline()
+        if not line:
+            break
+        sample_bytes += len(line.encode())
+    f.seek(start)
+
+    if sample_bytes == 0:
+        return 0
+
+    return int(np.ceil(remaining*n/sample_bytes))
+
+def read_columns_chunked(f, names_list, columns, expected_rows):
+    """
+    Parses the numeric block from the open file f in blocks of chunk_rows
+    rows, copying each block into preallocated buffers (one per name in
+    columns, see column_dtypes) and updating the importer progress as it
+    goes.
+
+    Returns a dictionary of column name to numpy array.
+    """
+    dtypes = column_dtypes(columns)
+    capacity = max(int(expected_rows*1.05), chunk_rows)
+    buffers = {c: np.empty(capacity, dtypes[c]) for c in columns}
+    n = 0
+
+    reader = pd.read_csv(f, header=None, names=names_list, usecols=columns, dtype=dtypes, chunksize=chunk_rows)
+    for chunk in reader:
+        m = len(chunk.index)
+        if n + m > capacity:
+            # Our estimate was too low, so grow the buffers
+            capacity = max(n + m, int(capacity*1.5))
+            for c in columns:
+                grown = np.empty(capacity, dtypes[c])
+                grown[:n] = buffers[c][:n]
+                buffers[c] = grown
+
+        for c in columns:
+            buffers[c][n:n + m] = chunk[c].values
+        n += m
+
+        importer.message('Read %i rows'%n)
+        importer.progress(min(99, int(100*n/capacity)))
+
+    return {c: buffers[c][:n] for c in columns}
+
+def cache_key(fileName):
+    st = os.stat(fileName)
+    h = hashlib.blake2b(digest_size=20)
+    h.update(('%s %s %s\n'%(importer_name, importer_version, 'float32' if single_precision else 'float64')).encode())
+    h.update(('%s %i %i'%(os.path.abspath(fileName), st.st_size, st.st_mtime_ns)).encode())
+    return h.hexdigest()
+
+def content_check(fileName):
+    """
+    A hash of the first and last cache_check_bytes of fileName, to confirm
+    that a cache entry found by cache_key() is for the same contents.
+    """
+    h = hashlib.blake2b(digest_size=20)
+    with open(fileName, 'rb') as f:
+        h.update(f.read(cache_check_bytes))
+        f.seek(max(0, os.fstat(f.fileno()).st_size - cache_check_bytes))
+        h.update(f.read())
+
+    return h.hexdigest()
+
+def load_from_cache(key, fileName):
+    """
+    Returns the cached columns for key, or None if it isn't in the cache or
+    fileName has changed since it was cached.
+    """
+    path = os.path.join(cache_dir, key)
+    try:
+        with open(os.path.join(path, 'metadata.json')) as f:
+            metadata = json.load(f)
+        if metadata.get('content') != content_check(fileName):
+            return None
+        # Read the arrays into memory rather than memory mapping them, as the
+        # maps would be read only and the entry could be evicted under them
+        columns = {c: np.load(os.path.join(path, '%i.npy'%i)) for i, c in enumerate(metadata['columns'])}
+        # Mark this entry as recently used
+        os.utime(path)
+    except (OSError, ValueError, KeyError):
+        return None
+
+    return columns
+
+def store_in_cache(key, fileName, columns):
+    path = os.path.join(cache_dir, key)
+    tmp_path = '%s.tmp%i'%(path, os.getpid())
+
+    try:
+        metadata = {'columns': list(columns), 'content': content_check(fileName)}
+        os.makedirs(tmp_path, exist_ok=True)
+        for i, c in enumerate(columns):
+            np.save(os.path.join(tmp_path, '%i.npy'%i), columns[c])
+        with open(os.path.join(tmp_path, 'metadata.json'), 'w') as f:
+            json.dump(metadata, f)
+        # Replace an entry for an earlier version of the file
+        shutil.rmtree(path, ignore_errors=True)
+        os.replace(tmp_path, path)
+    except OSError as e:
+        IoLog.warning("Couldn't write to the import cache: " + str(e))
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        return
+
+    evict_from_cache()
+
+def evict_from_cache():
+    """
+    Removes the least recently used entries until the cache is no larger
+    than cache_max_bytes.
+    """
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if '.tmp' in name or not os.path.isdir(path):
+            continue
+        size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+        entries.append((os.path.getmtime(path), size, path))
+
+    total = sum(size for mtime, size, path in entries)
+    for mtime, size, path in sorted(entries):
+        if total <= cache_max_bytes:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+
+def read_run_header(fileName, date_regex):
+    """
+    Reads the header of a (possibly still growing) .run file.
+
+    Returns None if the header hasn't been completely written yet,
+    otherwise a dictionary with whether the file uses Laser_Sr.nrf, its
+    start time (in s) and the byte offset of the first line of data.
+    """
+    nrf_found = False
+    match = None
+    with open(fileName, 'rb') as f:
+        for line in iter(f.readline, b''):
+            if not line.endswith(b'\n'):
+                return None
+
+            line = line.decode(errors='replace')
+            nrf_found = nrf_found or re.search(r"Laser_Sr\.nrf", line) is not None
+            if match is None:
+                match = re.match(date_regex, line.rstrip('\r\n'))
+            if "Spare text" in line:
+                break
+        else:
+            return None
+
+        if not match:
+            return {'Laser_Sr': False}
+
+        timestring = ",".join(match.groups())
+        start_time = datetime.strptime(timestring, '%d,%m,%Y,%I,%M,%S,%p')
+        return {'Laser_Sr': nrf_found, 'start_time': start_time.timestamp(), 'offset': f.tell()}
+
+def read_new_rows(fileName):
+    """
+    Parses any complete rows appended to fileName since it was last read
+    and appends them to the channels. Bytes before the stored offset are
+    never read again. Returns the number of new rows.
+    """
+    state = live['files'][fileName]
+    size = os.path.getsize(fileName)
+    if size <= state['offset']:
+        return 0
+
+    with open(fileName, 'rb') as f:
+        f.seek(state['offset'])
+        new_bytes = f.read(size - state['offset'])
+
+    # Leave any partly written last line for next time
+    end = new_bytes.rfind(b'\n') + 1
+    if end == 0:
+        return 0
+
+    names_list = live['names_list']
+    mass_list = live['mass_list']
+    channel_columns = names_list[:len(mass_list)] + ['time']
+    df = pd.read_csv(io.BytesIO(new_bytes[:end]), header=None, names=names_list, usecols=channel_columns, dtype=column_dtypes(channel_columns))
+    state['offset'] += end
+
+    if len(df.index) == 0:
+        return 0
+
+    times = df['time'].values + state['start_time']
+    for column, mass in zip(names_list, mass_list):
+        data.addDataToInput(column, times, df[column].values, {'machineName': 'Nu Plasma'})
+        live['channels'].add(column)
+        channel = data.timeSeries(column)
+        channel.setProperty("Mass", mass)
+        channel.setProperty("Units", "volts")
+
+    return len(df.index)
+
+def start_live_import(fileName, date_regex, names_list, mass_list):
+    global live
+
+    if uncompressed_name(fileName) != fileName:
+        IoLog.error("Compressed files can't be imported live: " + fileName)
+        return
+
+    header = read_run_header(fileName, date_regex)
+    if not header or not header['Laser_Sr']:
+        IoLog.error("Couldn't read the header of %s, so it can't be imported live"%(fileName))
+        return
+
+    folder = os.path.dirname(os.path.abspath(fileName))
+    live = {
+        'folder': folder,
+        'date_regex': date_regex,
+        'names_list': names_list,
+        'mass_list': mass_list,
+        'interval': min_poll_interval,
+        'idle': 0.0,
+        'channels': set(),
+        # Only files that appear after we start watching are picked up
+        'files': {os.path.join(folder, f): None for f in os.listdir(folder)},
+        'timer': QTimer()
+    }
+    live['files'][os.path.join(folder, os.path.basename(fileName))] = header
+
+    live['timer'].setSingleShot(True)
+    live['timer'].timeout.connect(poll_live_files)
+
+    IoLog.debug("Watching %s for new data"%(folder))
+    poll_live_files()
+
+def stop_live_import():
+    if live:
+        live['timer'].stop()
+        IoLog.debug("Stopped watching %s"%(live['folder']))
+        live.clear()
+
+def poll_live_files():
+    """
+    Checks the watched folder for new .run files and new rows, then
+    schedules the next check, polling less often while nothing changes.
+    """
+    # Stop once the channels being appended to are gone, e.g. because the
+    # session they were imported into has been closed
+    if live['channels'] and live['channels'].isdisjoint(data.timeSeriesNames(data.Input)):
+        IoLog.debug("The live import's channels are no longer in the session")
+        stop_live_import()
+        return
+
+    # Errors reading the folder or a file (e.g. a row the instrument is still
+    # writing) are logged and the read is tried again on the next check
+    try:
+        names = os.listdir(live['folder'])
+    except OSError as e:
+        IoLog.warning("Couldn't list %s: %s"%(live['folder'], e))
+        names = []
+
+    for name in names:
+        path = os.path.join(live['folder'], name)
+        if path in live['files'] or not name.endswith('run'):
+            continue
+
+        try:
+            header = read_run_header(path, live['date_regex'])
+        except OSError as e:
+            IoLog.warning("Couldn't read the header of %s: %s"%(path, e))
+            continue
+
+        if header is None:
+            # Not completely written yet, so check again next time
+            continue
+
+        live['files'][path] = header if header['Laser_Sr'] else None
+        if header['Laser_Sr']:
+            IoLog.debug("Found new .run file: " + path)
+
+    new_rows = 0
+    for path, state in live['files'].items():
+        if state is None:
+            continue
+
+        try:
+            new_rows += read_new_rows(path)
+        except (OSError, ValueError) as e:
+            IoLog.warning("Couldn't read new data from %s, will try again: %s"%(path, e))
+
+    if new_rows > 0:
+        IoLog.debug("Added %i new rows"%(new_rows))
+        data.calculateTotalBeam()
+        live['interval'] = min_poll_interval
+        live['idle'] = 0.0
+    else:
+        live['idle'] += live['interval']
+        live['interval'] = min(2*live['interval'], max_poll_interval)
+
+    if live['idle'] >= live_timeout:
+        IoLog.debug("No new data for %i s"%(live_timeout))
+        stop_live_import()
+        return
+
+    live['timer'].start(int(1000*live['interval']))
+
 def import_data():
     """
     This method uses the provided file name (stored in plugin.fileName),
@@ -110,37 +572,12 @@ def import_data():
     """
     IoLog.debug("import_data called on file = %s"%(importer.fileName))
 
+    # A new import ends any live import still running
+    stop_live_import()
+
     #find the date and time using a regular expression:
     regex = r"^\"(?P<day>\d{2})\/(?P<month>\d{2})\/(?P<year>\d{4})\",\"(?P<hour>\d{2}):(?P<minute>\d{2}):(?P<seconds>\d{2}) (?P<ampm>[AaPpMm]{2})\"$"
 
-    datafile = ""
-    with open(importer.fileName) as f:
-        match = re.search(regex, f.read(), re.MULTILINE)
-
-    if not match:
-        IoLog.error("Couldn't find a match for the date time stamp")
-        importer.message('Error during import')
-        importer.progress(100)
-        importer.finished()
-
-    timestring = ",".join(match.groups())
-    start_time = datetime.strptime(timestring, '%d,%m,%Y,%I,%M,%S,%p')
-    start_time_in_s = start_time.timestamp()
-    IoLog.debug("Start time is: " + timestring)
-
-    #look through file to find the first line of data, which in .run files
-    # is preceded by a line with "Spare Text" written in it.
-    first_line_of_data = 0
-    with open(importer.fileName, 'r') as file:
-        for line in file:
-            if "Spare text" in line:
-                break
-            first_line_of_data += 1
-
-    first_line_of_data += 1
-    IoLog.debug("Found spare text on line: {}".format(first_line_of_data))
-
-
     '''
         Nu Plasma .run files contain no channel header data, so the columns that appear depends on the nrf file used to collect the data.
         You need to know what collector each column represents and give it a name below.
@@ -151,15 +588,68 @@ def import_data():
     names_list = ['m89','m88','m87','m86.5','m86','m85.5','m85','m84.5','m84','m83','m82','m81','measurement','time','type_col']
     mass_list = [89.0, 88.0, 87.0, 86.5, 86.0, 85.5, 85.0, 84.5, 84.0, 83.0, 82.0, 81.0]
 
-    df = pd.read_csv(importer.fileName, skiprows=first_line_of_data, header=None, names=names_list)
+    if live_import:
+        start_live_import(importer.fileName, regex, names_list, mass_list)
+        importer.message('Watching for new data')
+        importer.progress(100)
+        importer.finished()
+        return
+
+    # Use the previously parsed data if this file has been imported before
+    key = cache_key(importer.fileName) if use_cache else None
+    columns = load_from_cache(key, importer.fileName) if key else None
+
+    if columns:
+        IoLog.debug("Loading parsed data from the cache: " + key)
+    else:
+        # Read the file in a single pass: the header lines are scanned one at a
+        # time for the date stamp until we reach the line with "Spare text" in it,
+        # which precedes the first line of data in .run files. The open file,
+        # now positioned at the start of the data, is then handed straight to
+        # pandas so the numeric block is never read more than once.
+        match = None
+        first_line_of_data = 0
+        with open_file(importer.fileName) as f:
+            line = f.readline()
+            while line:
+                first_line_of_data += 1
+                if match is None:
+                    match = re.match(regex, line.rstrip('\r\n'))
+                if "Spare text" in line:
+                    break
+                line = f.readline()
+
+            IoLog.debug("Found spare text on line: {}".format(first_line_of_data))
+
+            if not match:
+                IoLog.error("Couldn't find a match for the date time stamp")
+                importer.message('Error during import')
+                importer.progress(100)
+                importer.finished()
+                return
+
+            channel_columns = names_list[:len(mass_list)] + ['time']
+            if chunked_import:
+                columns = read_columns_chunked(f, names_list, channel_columns, estimate_rows(f))
+            else:
+                df = pd.read_csv(f, header=None, names=names_list, dtype=column_dtypes(channel_columns), engine='c')
+                columns = {c: df[c].values for c in channel_columns}
+
+        timestring = ",".join(match.groups())
+        start_time = datetime.strptime(timestring, '%d,%m,%Y,%I,%M,%S,%p')
+        start_time_in_s = start_time.timestamp()
+        IoLog.debug("Start time is: " + timestring)
+
+        #add start time in seconds to time column:
+        columns['time'] = columns['time'] + start_time_in_s
 
-    #add start time in seconds to time column:
-    df['time'] = df['time'].add(start_time_in_s)
+        if key:
+            store_in_cache(key, importer.fileName, columns)
 
     for column, mass in zip(names_list, mass_list):
         if column in ['measurement','time','type_col']:
             continue
-        channel = data.createTimeSeries(column, data.Input, df['time'].values, df[column].values)
+        channel = data.createTimeSeries(column, data.Input, columns['time'], columns[column])
         channel.setProperty("Mass", mass)
         channel.setProperty("Units", "volts")
 
@@ -0,0 +1,7 @@
+# The importers and DRSs are iolite plugins, so the tests load them with the
+# stand-in 'data', 'IoLog', 'importer' and 'drs' objects from the benchmarks.
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'benchmarks'))
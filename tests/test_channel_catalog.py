@@ -0,0 +1,96 @@
+# The DRSs and the PlasmAge export that look channels up from a catalog each
+# have a copy of the ChannelCatalog class, as iolite loads them on their own.
+# These tests keep the copies the same and check the catalog against the
+# stand-in 'data'.
+
+import ast
+import os
+import inspect
+
+import numpy as np
+import pytest
+
+from sr_mask_benchmark import StandInData, make_session
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+scripts = [os.path.join('drs', '3d_trace_elements.py'), os.path.join('export', 'PlasmAge.py')] + [
+    os.path.join('drs', name) for name in ['RbSr_isotopes.py', 'Sr_isotopes.py', 'Sr_isotopes_m83.py', 'Sr_isotopes_CaAr_REE.py']]
+
+# A couple of ablations is enough to look channels up in
+points = 2000
+
+
+def class_node(script):
+    with open(os.path.join(root, script), encoding='utf-8') as f:
+        tree = ast.parse(f.read())
+    for node in tree.body:
+        if isinstance(node, ast.ClassDef) and node.name == 'ChannelCatalog':
+            return node
+
+
+def load_catalog(data):
+    namespace = {'np': np, 'data': data}
+    module = ast.Module(body=[class_node(scripts[0])], type_ignores=[])
+    exec(compile(module, scripts[0], 'exec'), namespace)
+    return namespace['ChannelCatalog']()
+
+
+def test_catalog_is_the_same_in_every_script():
+    sources = [class_node(script) for script in scripts]
+    assert None not in sources
+    # Some of the DRSs are indented with tabs, which shows in the docstrings
+    for node in ast.walk(ast.Module(body=sources, type_ignores=[])):
+        if isinstance(node, ast.Constant) and isinstance(node.value, str):
+            node.value = inspect.cleandoc(node.value)
+    assert len({ast.dump(s) for s in sources}) == 1
+
+
+@pytest.mark.parametrize('float_masses', [False, True])
+@pytest.mark.parametrize('mass', [88, 88.0, '88'])
+def test_lookups_match_data(float_masses, mass):
+    channels, mask = make_session(points, 0.5, float_masses=float_masses)
+    data = StandInData(channels)
+    catalog = load_catalog(data)
+
+    expected = data.timeSeriesNames(data.Input, {'Mass': mass})
+    assert expected == ['m88']
+    assert catalog.timeSeriesNames(data.Input, {'Mass': mass}) == expected
+    assert catalog.timeSeriesByMass(data.Input, float(mass), 0.1).name == 'm88'
+    assert catalog.timeSeriesByMass(data.Input, 87.4, 0.2).name == 'm87.5'
+    with pytest.raises(IndexError):
+        catalog.timeSeriesByMass(data.Input, 89, 0.1)
+
+
+def test_strings_are_compared_as_strings():
+    channels, mask = make_session(points, 0.5)
+    channels[1].setProperty('Element', 'Sr')
+    channels[1].setProperty('Flag', True)
+    data = StandInData(channels)
+    catalog = load_catalog(data)
+
+    assert catalog.timeSeriesNames(data.Input, {'Element': 'Sr'}) == [channels[1].name]
+    assert catalog.timeSeriesNames(data.Input, {'Element': 'Sr', 'Mass': 88}) == ['m88']
+    assert catalog.timeSeriesNames(data.Input, {'Flag': True}) == [channels[1].name]
+    assert catalog.timeSeriesNames(data.Input, {'Flag': 1}) == []
+    assert catalog.timeSeriesNames(data.Input, {'Element': 'Rb'}) == []
+
+
+def test_catalog_only_listens_while_it_has_indexes():
+    channels, mask = make_session(points, 0.5)
+    data = StandInData(channels)
+    catalog = load_catalog(data)
+    assert data.dataChanged.slots == []
+
+    catalog.timeSeriesList(data.Input)
+    catalog.timeSeriesList(data.Intermediate)
+    assert data.dataChanged.slots == [catalog.invalidate]
+
+    data.createTimeSeries('m89', data.Input, None, np.zeros(1), {'Mass': 89.0})
+    assert catalog.indexes == {}
+    assert data.dataChanged.slots == []
+    assert catalog.timeSeriesByMass(data.Input, 89, 0.1).name == 'm89'
+    assert data.dataChanged.slots == [catalog.invalidate]
+
+    catalog.invalidate()
+    assert data.dataChanged.slots == []
+    catalog.invalidate()
@@ -0,0 +1,53 @@
+# workspace/guess_dwell_times.py sets each input channel's 'Dwell Time (ms)'
+# from the steps between its readings. These tests run it on synthetic
+# counts, with and without a little noise on every reading.
+
+import os
+import runpy
+
+import numpy as np
+import pytest
+
+from sr_mask_benchmark import StandInData, StandInTimeSeries
+
+root = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+script = os.path.join(root, 'workspace', 'guess_dwell_times.py')
+
+points = 100000
+
+
+def channel(name, dwell, mean_counts, noise=0.0, seed=0):
+    """
+    A channel of Poisson counts in CPS for a dwell time in ms, with Gaussian
+    noise of noise quanta on every reading.
+    """
+    rng = np.random.default_rng(seed)
+    quantum = 1000/dwell
+    values = rng.poisson(mean_counts, points)*quantum + rng.normal(0, noise*quantum, points)
+    return StandInTimeSeries(name, StandInData.Input, np.arange(points)*0.1, values)
+
+
+def guess(channels):
+    data = StandInData(channels)
+    runpy.run_path(script, init_globals={'data': data})
+    return {c.name: c.property('Dwell Time (ms)') for c in channels}
+
+
+@pytest.mark.parametrize('noise', [0, 0.01])
+def test_dwell_times_are_found(noise):
+    channels = [
+        channel('Sr88', 2, 5000, noise, seed=1),
+        channel('Rb85', 2, 0.3, noise, seed=2),
+        channel('Sr86', 10, 40, noise, seed=3),
+        channel('Ca44', 50, 2, noise, seed=4),
+    ]
+    expected = {'Sr88': 2, 'Rb85': 2, 'Sr86': 10, 'Ca44': 50}
+    guesses = guess(channels)
+    for name, dwell in expected.items():
+        assert guesses[name] == pytest.approx(dwell, rel=0.01), name
+
+
+def test_noise_alone_gets_the_default():
+    rng = np.random.default_rng(5)
+    noise = StandInTimeSeries('Kr83', StandInData.Input, np.arange(points)*0.1, rng.normal(0, 5, points))
+    assert guess([noise])['Kr83'] == 10
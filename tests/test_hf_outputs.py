@@ -0,0 +1,68 @@
+# The Hf isotopes DRS only offers its real outputs in the Outputs setting.
+# The steps along the way can be added as intermediate channels by choosing
+# them as DiagnosticChannels.
+
+import numpy as np
+
+from sr_mask_benchmark import StandInData, StandInTimeSeries, StandInValue, load_drs
+
+script = 'Hf_isotopes.py'
+
+points = 1000
+
+
+class HfData(StandInData):
+    def selectionGroup(self, name):
+        return name
+
+    def referenceMaterialData(self, rmName):
+        return {'176Hf/177Hf': StandInValue(0.282482)}
+
+
+def run_hf(**settings):
+    rng = np.random.default_rng(0)
+    time = np.arange(points)*0.1
+    abundances = {'Hf176_CPS': 0.05, 'Hf177_CPS': 0.19, 'Hf178_CPS': 0.27, 'Hf179_CPS': 0.14,
+                  'Yb171_CPS': 0.001, 'Yb173_CPS': 0.001, 'Lu175_CPS': 0.001}
+    channels = [StandInTimeSeries(name, StandInData.Input, time, 1e6*abundance*(1 + rng.normal(0, 1e-3, points)))
+                for name, abundance in abundances.items()]
+    channels.append(StandInTimeSeries('TotalBeam', StandInData.Input, time, np.full(points, 1e6)))
+
+    s = {
+        'IndexChannel': 'TotalBeam', 'ReferenceMaterial': 'Z_Plesovice', 'MaskChannel': 'TotalBeam',
+        'MaskCutoff': 0.1, 'MaskTrim': 0.0, 'HfTrue': 0.7325, 'Yb31': 1.132685, 'Yb63': 0.796218,
+        'Age': 0, 'PropagateError': False,
+    }
+    s.update(settings)
+    module = load_drs(script, channels, s, np.ones(points), HfData)
+    module.runDRS()
+    return module
+
+
+def made(module, type):
+    return sorted(name for name, c in module.data.channels.items() if c.type == type)
+
+
+def test_outputs_and_diagnostics_are_separate():
+    module = run_hf()
+    assert set(module.outputChannels) | set(module.diagnosticChannels) == set(module.definitions)
+    assert not set(module.outputChannels) & set(module.diagnosticChannels)
+    for name in ['HfFract', 'YbFract', 'MeanFract', 'HfBias176', 'Yb176', 'Lu176', 'Hf176c']:
+        assert name in module.diagnosticChannels
+
+
+def test_defaults_make_the_default_outputs_only():
+    module = run_hf()
+    assert made(module, StandInData.Output) == sorted(module.defaultOutputs + ['StdCorr_Hf176_177'])
+    assert made(module, StandInData.Intermediate) == []
+
+
+def test_diagnostics_are_intermediate_channels():
+    module = run_hf(Outputs=['Hf178_177', 'HfFract'], DiagnosticChannels=['Yb176', 'HfFract', 'Hf178_177'])
+    # an intermediate saved in Outputs by an older version isn't an output
+    assert made(module, StandInData.Output) == ['Hf176_177_Corr', 'Hf178_177', 'StdCorr_Hf176_177']
+    assert made(module, StandInData.Intermediate) == ['HfFract', 'Yb176']
+
+    hf = module.data.channels
+    expected = (np.log(0.7325/(hf['Hf179_CPS'].data()/hf['Hf177_CPS'].data())))/np.log(178.946/176.943)
+    np.testing.assert_allclose(hf['HfFract'].data(), expected)
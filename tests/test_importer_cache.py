@@ -0,0 +1,54 @@
+import os
+import json
+
+import numpy as np
+
+from importer_benchmark import write_nu_run, load_importer
+
+
+def import_run(fileName, cache_dir):
+    module = load_importer('nu_plasma_run_importer.py', fileName)
+    module.use_cache = True
+    module.cache_dir = str(cache_dir)
+    module.import_data()
+    return module
+
+
+def test_cache_hit_matches_parse(tmp_path):
+    fileName = str(tmp_path / 'a.run')
+    write_nu_run(fileName, 1000)
+    parsed = import_run(fileName, tmp_path / 'cache')
+    entries = os.listdir(tmp_path / 'cache')
+    assert len(entries) == 1
+    with open(tmp_path / 'cache' / entries[0] / 'metadata.json') as f:
+        assert json.load(f)['columns'] == ['m89', 'm88', 'm87', 'm86.5', 'm86', 'm85.5', 'm85', 'm84.5', 'm84', 'm83', 'm82', 'm81', 'time']
+
+    # Break parsing, so that a second import can only come from the cache
+    cached = load_importer('nu_plasma_run_importer.py', fileName)
+    cached.use_cache = True
+    cached.cache_dir = str(tmp_path / 'cache')
+    cached.read_columns_chunked = None
+    cached.import_data()
+
+    assert parsed.data.channels.keys() == cached.data.channels.keys()
+    for name, channel in parsed.data.channels.items():
+        values = cached.data.channels[name].values
+        np.testing.assert_array_equal(channel.values, values)
+        np.testing.assert_array_equal(channel.time, cached.data.channels[name].time)
+        assert values.flags.writeable and not isinstance(values, np.memmap)
+
+
+def test_cache_misses_changed_contents(tmp_path):
+    fileName = str(tmp_path / 'a.run')
+    write_nu_run(fileName, 1000, seed=0)
+    first = import_run(fileName, tmp_path / 'cache')
+
+    # Same size and modification time, different values
+    st = os.stat(fileName)
+    write_nu_run(fileName, 1000, seed=1)
+    assert os.path.getsize(fileName) == st.st_size
+    os.utime(fileName, ns=(st.st_atime_ns, st.st_mtime_ns))
+
+    second = import_run(fileName, tmp_path / 'cache')
+    assert not np.array_equal(first.data.channels['m88'].values, second.data.channels['m88'].values)
+    assert len(os.listdir(tmp_path / 'cache')) == 1
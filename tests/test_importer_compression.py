@@ -0,0 +1,113 @@
+# iolite loads each importer on its own, so the helpers for reading
+# compressed files are repeated in each of them. These tests keep the copies
+# the same and check that compressed files import like uncompressed ones,
+# decompressing them only once.
+
+import ast
+import io
+import os
+import gzip
+
+import numpy as np
+import pytest
+
+from importer_benchmark import formats, importer_dir, load_importer, compress_file, zstandard
+
+scripts = sorted({script for script, extension, generator in formats.values()})
+
+# The statements that make up the compression helpers, in the order they
+# appear in every importer
+compression_helpers = ['zstandard', 'compression_extensions', 'uncompressed_name', 'open_file']
+
+
+def top_level_names(node):
+    """
+    The names a top level statement defines.
+    """
+    if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+        return [node.name]
+    if isinstance(node, ast.Assign):
+        return [t.id for t in node.targets if isinstance(t, ast.Name)]
+    if isinstance(node, ast.Try):
+        return [n for child in node.body for n in top_level_names(child)]
+    if isinstance(node, ast.Import):
+        return [a.asname or a.name for a in node.names]
+    return []
+
+
+def top_level_nodes(script, names):
+    """
+    The top level statements of script that define names, in file order,
+    with their positions in the file's statements.
+    """
+    with open(os.path.join(importer_dir, script)) as f:
+        tree = ast.parse(f.read())
+    return [(i, node) for i, node in enumerate(tree.body) if set(top_level_names(node)) & set(names)]
+
+
+def function_source(script, name):
+    nodes = top_level_nodes(script, [name])
+    return ast.dump(nodes[0][1]) if len(nodes) == 1 else None
+
+
+def test_compression_helpers_are_one_block_the_same_in_every_importer():
+    blocks = {}
+    for script in scripts:
+        positions, nodes = zip(*top_level_nodes(script, compression_helpers))
+        # one definition of each, one after another
+        assert [top_level_names(node) for node in nodes] == [[name] for name in compression_helpers], script
+        assert list(positions) == list(range(positions[0], positions[0] + len(compression_helpers))), script
+        blocks[script] = '\n'.join(ast.dump(node) for node in nodes)
+
+    assert len(set(blocks.values())) == 1
+
+
+class CountingGzip:
+    """
+    A stand-in for the gzip module that counts the compressed bytes read.
+    """
+    def __init__(self):
+        self.bytes_read = 0
+
+    def open(self, fileName, mode='rb'):
+        counter = self
+        class Raw(io.FileIO):
+            def readinto(self, b):
+                n = super().readinto(b)
+                counter.bytes_read += n or 0
+                return n
+        return gzip.GzipFile(fileobj=io.BufferedReader(Raw(fileName, 'r')), mode=mode)
+
+
+@pytest.mark.parametrize('format_name', ['nu_sr_run', 'nu_uth_txt'])
+def test_compressed_files_are_read_once(format_name, tmp_path):
+    script, extension, generator = formats[format_name]
+    fileName = str(tmp_path / (format_name + extension))
+    generator(fileName, 20000)
+    fileName = compress_file(fileName, 'gz')
+
+    module = load_importer(script, fileName)
+    module.gzip = CountingGzip()
+    module.import_data()
+    assert not module.IoLog.errors
+    # Only the header is read a second time, for the metadata
+    assert module.gzip.bytes_read <= os.path.getsize(fileName) + 256*1024
+
+
+@pytest.mark.parametrize('compression', ['gz', 'xz', pytest.param('zst', marks=pytest.mark.skipif(zstandard is None, reason='zstandard is not installed'))])
+@pytest.mark.parametrize('format_name', sorted(formats))
+def test_compressed_files_import_the_same(format_name, compression, tmp_path):
+    script, extension, generator = formats[format_name]
+    fileName = str(tmp_path / (format_name + extension))
+    generator(fileName, 2000)
+    plain = load_importer(script, fileName)
+    plain.import_data()
+
+    compressed = load_importer(script, compress_file(fileName, compression))
+    assert compressed.correct_format()
+    compressed.import_data()
+
+    assert plain.data.channels.keys() == compressed.data.channels.keys()
+    for name, channel in plain.data.channels.items():
+        np.testing.assert_array_equal(channel.values, compressed.data.channels[name].values)
+        np.testing.assert_array_equal(channel.time, compressed.data.channels[name].time)
@@ -0,0 +1,62 @@
+# The AttoM PeakEScan importer imports the files named in a .escanlist file
+# list together, parsing them in worker processes. These tests check that
+# the workers give the same channels as parsing the files one after another.
+
+from datetime import datetime, timedelta
+
+import numpy as np
+
+from importer_benchmark import load_importer, write_escan_csv
+
+script = 'attom_escan_importer.py'
+
+
+def write_list(tmp_path, files=6, lines=('escan_*.csv',)):
+    for i in range(files):
+        write_escan_csv(str(tmp_path / ('escan_%02i.csv' % i)), 40, seed=i,
+                        start=datetime(2021, 3, 12, 10, 15, 30) + timedelta(minutes=i))
+    listName = tmp_path / 'escans.escanlist'
+    listName.write_text('\n'.join(lines) + '\n')
+    return str(listName)
+
+def import_list(listName, workers, **settings):
+    module = load_importer(script, listName)
+    module.max_workers = workers
+    module.min_files_per_worker = 1
+    for name, value in settings.items():
+        setattr(module, name, value)
+    assert module.correct_format()
+    module.import_data()
+    return module
+
+def assert_same_channels(a, b):
+    assert a.data.channels.keys() == b.data.channels.keys()
+    for name, channel in a.data.channels.items():
+        np.testing.assert_array_equal(channel.time, b.data.channels[name].time)
+        np.testing.assert_array_equal(channel.values, b.data.channels[name].values)
+
+
+def test_file_list_names_files_and_patterns(tmp_path):
+    listName = write_list(tmp_path, lines=['# the first two, then the rest', 'escan_00.csv', 'escan_01.csv', 'escan_0*.csv'])
+    module = load_importer(script, listName)
+    assert [f[-12:] for f in module.files_in_list(listName)] == ['escan_%02i.csv' % i for i in range(6)]
+
+def test_workers_give_the_same_channels(tmp_path):
+    listName = write_list(tmp_path)
+    serial = import_list(listName, 1)
+    parallel = import_list(listName, 2)
+    assert not serial.IoLog.errors and not parallel.IoLog.errors
+    assert len(serial.data.channels['Sr77'].values) == 6*(10 + 1)
+    assert_same_channels(serial, parallel)
+
+def test_unreadable_files_are_reported(tmp_path):
+    listName = write_list(tmp_path, lines=['escan_*.csv', 'missing.csv'])
+    module = import_list(listName, 2)
+    assert len(module.IoLog.errors) == 1 and 'missing.csv' in module.IoLog.errors[0]
+    assert len(module.data.channels['Sr77'].values) == 6*(10 + 1)
+
+def test_files_are_parsed_here_without_a_python_for_the_workers(tmp_path):
+    listName = write_list(tmp_path)
+    serial = import_list(listName, 1)
+    for python in ['', '/nonexistent/python3']:
+        assert_same_channels(serial, import_list(listName, 2, worker_python=python))
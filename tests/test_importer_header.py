@@ -0,0 +1,97 @@
+# correct_format() only reads the start of a file, and the importers share
+# one cache of those headers, so a file is read once however many of them
+# check it. These tests count the bytes read from the file to make sure.
+
+import io
+import os
+import sys
+from collections import Counter
+
+import pytest
+
+from importer_benchmark import formats, load_importer
+from test_importer_compression import function_source, scripts
+
+
+class CountingFileIO(io.FileIO):
+    """
+    A raw file that counts the bytes read from it, by file name.
+    """
+    counts = Counter()
+
+    def readinto(self, b):
+        n = super().readinto(b)
+        self.counts[self.name] += n or 0
+        return n
+
+
+def counting_open(file, mode='r', errors=None, **kwargs):
+    f = io.BufferedReader(CountingFileIO(file, 'r'))
+    return f if 'b' in mode else io.TextIOWrapper(f, errors=errors)
+
+
+# isotopX_importer.py only looks at the file name in correct_format()
+sniffing_formats = [name for name in sorted(formats) if name != 'isotopx_timsdp']
+sniffing_scripts = sorted({formats[name][0] for name in sniffing_formats})
+
+
+def load_importers(fileName):
+    """
+    Loads every importer for fileName, counting what they read, with an
+    empty header cache as when iolite starts.
+    """
+    modules = [load_importer(script, fileName) for script in scripts]
+    for module in modules:
+        module.open = counting_open
+    sys.modules.pop(modules[0].header_cache_module, None)
+    CountingFileIO.counts.clear()
+    return modules
+
+
+def test_header_reader_is_the_same_in_every_importer():
+    sources = {script: function_source(script, 'read_header') for script in sniffing_scripts}
+    assert None not in sources.values()
+    assert len(set(sources.values())) == 1
+
+
+@pytest.mark.parametrize('format_name', sniffing_formats)
+def test_correct_format_reads_a_bounded_prefix(format_name, tmp_path):
+    script, extension, generator = formats[format_name]
+    fileName = str(tmp_path / (format_name + extension))
+    generator(fileName, 100000, generator.__defaults__[0])
+    assert os.path.getsize(fileName) > 1024**2
+
+    module = load_importers(fileName)[scripts.index(script)]
+
+    assert module.correct_format()
+    first = CountingFileIO.counts[fileName]
+    # The text layer may read one buffer past the prefix it decodes
+    assert 0 < first <= module.HEADER_SNIFF_CHARS + io.DEFAULT_BUFFER_SIZE
+
+    assert module.correct_format()
+    assert CountingFileIO.counts[fileName] == first
+
+
+def test_header_cache_notices_changed_files(tmp_path):
+    script, extension, generator = formats['nu_run']
+    fileName = str(tmp_path / ('nu_run' + extension))
+    generator(fileName, 100)
+    module = load_importer(script, fileName)
+    assert module.correct_format()
+
+    with open(fileName, 'w') as f:
+        f.write('"Not a run file"\n')
+    assert not module.correct_format()
+
+
+@pytest.mark.parametrize('format_name', sniffing_formats)
+def test_every_importer_shares_one_read(format_name, tmp_path):
+    script, extension, generator = formats[format_name]
+    fileName = str(tmp_path / (format_name + extension))
+    generator(fileName, 100000, generator.__defaults__[0])
+
+    # as iolite does, ask every importer whether it takes the file
+    modules = load_importers(fileName)
+    accepted = [name for name, module in zip(scripts, modules) if module.correct_format()]
+    assert script in accepted
+    assert 0 < CountingFileIO.counts[fileName] <= modules[0].HEADER_SNIFF_CHARS + io.DEFAULT_BUFFER_SIZE
@@ -0,0 +1,62 @@
+import numpy as np
+
+from importer_benchmark import load_importer
+
+header = '"Nu Plasma run file"\n"C:\\Nu Plasma\\Laser_Sr.nrf"\n"Sample A"\n"12/03/2021","10:15:30 AM"\n"Spare text"\n'
+
+
+def row(i):
+    return ','.join(['%.3f' % (i + j/100) for j in range(12)] + [str(i), '%.1f' % (i*0.2), '0']) + '\n'
+
+
+def start(tmp_path):
+    fileName = str(tmp_path / 'live.run')
+    with open(fileName, 'w') as f:
+        f.write(header + row(0) + row(1))
+
+    module = load_importer('nu_plasma_run_importer.py', fileName)
+    module.live_import = True
+    warnings = []
+    module.IoLog.warning = warnings.append
+    module.import_data()
+    return module, fileName, warnings
+
+
+def test_bad_rows_are_retried(tmp_path):
+    module, fileName, warnings = start(tmp_path)
+    np.testing.assert_array_equal(module.data.channels['m89'].values, [0, 1])
+
+    # A row that is still being written, with a complete line that can't be
+    # parsed as numbers ahead of it
+    with open(fileName, 'a') as f:
+        f.write(row(2).replace('2.000', '2.0x0') + row(3)[:10])
+    module.poll_live_files()
+    assert len(warnings) == 1 and fileName in warnings[0]
+    assert module.live
+    np.testing.assert_array_equal(module.data.channels['m89'].values, [0, 1])
+
+    # Once the file is put right the rows are read on the next check
+    with open(fileName, 'w') as f:
+        f.write(header + row(0) + row(1) + row(2) + row(3))
+    module.poll_live_files()
+    np.testing.assert_array_equal(module.data.channels['m89'].values, [0, 1, 2, 3])
+
+
+def test_stops_when_channels_are_gone(tmp_path):
+    module, fileName, warnings = start(tmp_path)
+    assert module.live
+
+    module.data.channels.clear()
+    module.poll_live_files()
+    assert not module.live
+
+
+def test_new_import_stops_live_import(tmp_path):
+    module, fileName, warnings = start(tmp_path)
+    timer = module.live['timer']
+    stopped = []
+    timer.stop = lambda: stopped.append(True)
+
+    module.live_import = False
+    module.import_data()
+    assert stopped and not module.live
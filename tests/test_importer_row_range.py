@@ -0,0 +1,152 @@
+# The IsotopX and Nu Sr importers used to parse their data with the python
+# engine and skipfooter. These tests check the C engine row ranges they use
+# now against the files in tests/data: the Sr importer gives the same data,
+# and the IsotopX importer no longer drops the last cycle.
+
+import io
+import os
+import re
+import shutil
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from importer_benchmark import load_importer
+
+data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data')
+
+
+def skipfooter_isotopx(fileName):
+    # As in isotopX_importer.py before the C engine was used
+    file_contents = open(fileName).read().split('\n')
+    cycles_line = 0
+    line_counter = 0
+    blocks_line = 0
+    for line in file_contents:
+        if re.match(r"#CYCLES", line):
+            cycles_line = line_counter
+        if re.match(r"#BLOCKS", line):
+            blocks_line = line_counter
+            break
+        line_counter += 1
+
+    names_list = file_contents[cycles_line + 1].split(',')
+    footer_lines = len(file_contents) - blocks_line
+    return pd.read_csv(fileName, skiprows=cycles_line + 2, skipfooter=footer_lines, header=None, names=names_list, engine='python')
+
+
+def skipfooter_sr(fileName):
+    # As in nu_plasma_Sr_importer.py before the C engine was used
+    lines = open(fileName).read().split('\n')
+    stext_line = 0
+    footer_lines = 0
+    line_counter = 0
+    for line in lines:
+        line_counter += 1
+        if line.startswith('"Spare text"'):
+            stext_line = line_counter
+            continue
+        if stext_line > 0 and not re.match(r"^-?\.?\d", line):
+            footer_lines += 1
+
+    names_list = ['Sr89','Sr88','Sr87','Sr86.5','Sr86','Sr85.5','Sr85','Sr84.5','Sr84','Sr83','Sr82','Sr81','Point_number','time','Zeroes_Column']
+    df = pd.read_csv(fileName, skiprows=stext_line, skipfooter=footer_lines - 1, header=None, names=names_list, engine='python')
+    return df.drop(['Point_number', 'Zeroes_Column'], axis=1)
+
+
+def cycles_isotopx(fileName):
+    # Every numeric line between the column names and #BLOCKS
+    lines = open(fileName).read().split('\n')
+    start = lines.index('#CYCLES') + 2
+    end = lines.index('#BLOCKS') if '#BLOCKS' in lines else len(lines)
+    rows = [line for line in lines[start:end] if line.strip()]
+    return pd.read_csv(io.StringIO('\n'.join(rows)), header=None, names=lines[start - 1].split(','))
+
+
+def import_isotopx(fileName, live=False):
+    module = load_importer('isotopX_importer.py', fileName)
+    module.live_import = live
+    module.import_data()
+    assert not module.IoLog.errors
+    return module
+
+
+@pytest.mark.parametrize('name', ['isotopx.TIMSDP', 'isotopx_blank_lines.TIMSDP', 'isotopx_no_newline.TIMSDP'])
+def test_isotopx_reads_every_cycle(name):
+    fileName = os.path.join(data_dir, name)
+    expected = cycles_isotopx(fileName)
+    start_time = datetime(2021, 3, 12, 10, 15, 30).timestamp()
+    module = import_isotopx(fileName)
+
+    # The last cycle, just before #BLOCKS, is there
+    assert expected['Cycle'].values[-1] == 20
+    for mass in ['88', '87', '86']:
+        channel = module.data.channels['m' + mass]
+        # Each file is followed by a blank row 1 ms after its last cycle
+        assert len(channel.values) == len(expected.index) + 1
+        np.testing.assert_array_equal(channel.values[:-1], expected[mass].values)
+        assert np.isnan(channel.values[-1])
+        np.testing.assert_array_equal(channel.time[:-1], expected['Time'].values + start_time)
+
+
+@pytest.mark.parametrize('name', ['isotopx.TIMSDP', 'isotopx_blank_lines.TIMSDP', 'isotopx_no_newline.TIMSDP'])
+def test_isotopx_skipfooter_dropped_the_last_cycle(name):
+    # The python engine parser was told to skip one line more than the footer
+    # holds when the cycle before #BLOCKS ended in a newline, so it dropped
+    # that cycle. Only the file without blank lines there lost it.
+    fileName = os.path.join(data_dir, name)
+    expected = cycles_isotopx(fileName)
+    old = skipfooter_isotopx(fileName)
+    dropped = 1 if name == 'isotopx.TIMSDP' else 0
+    assert len(old.index) == len(expected.index) - dropped
+    np.testing.assert_array_equal(old['88'].values, expected['88'].values[:len(old.index)])
+
+
+@pytest.mark.parametrize('name', ['isotopx.TIMSDP', 'isotopx_blank_lines.TIMSDP', 'isotopx_no_newline.TIMSDP'])
+def test_isotopx_live_import_matches(name, tmp_path):
+    # A live import reads the same cycles as importing the finished file
+    fileName = str(tmp_path / name)
+    shutil.copy(os.path.join(data_dir, name), fileName)
+    batch = import_isotopx(fileName)
+    live = import_isotopx(fileName, live=True)
+    live.stop_live_import()
+
+    assert batch.data.channels.keys() == live.data.channels.keys()
+    for name, channel in batch.data.channels.items():
+        np.testing.assert_array_equal(channel.values, live.data.channels[name].values)
+        np.testing.assert_array_equal(channel.time, live.data.channels[name].time)
+
+
+@pytest.mark.parametrize('name', ['sr.run', 'sr_blank_lines.run'])
+def test_sr_matches_skipfooter(name):
+    fileName = os.path.join(data_dir, name)
+    expected = skipfooter_sr(fileName)
+    start_time = datetime.strptime('12,03,2021,10,15,30,AM', '%d,%m,%Y,%H,%M,%S,%p').timestamp()
+
+    module = load_importer('nu_plasma_Sr_importer.py', fileName)
+    module.import_data()
+    assert not module.IoLog.errors
+
+    for name in expected.columns.drop('time'):
+        channel = module.data.channels[name]
+        np.testing.assert_array_equal(channel.values, expected[name].values)
+        np.testing.assert_array_equal(channel.time, expected['time'].values + start_time)
+
+
+def test_sr_without_final_newline():
+    # skipfooter was one line short when the file didn't end in a newline, so
+    # the first footer line was read as a row of text and NaN, which stopped
+    # the import. Only the data rows are read now.
+    fileName = os.path.join(data_dir, 'sr_no_newline.run')
+    expected = skipfooter_sr(fileName)
+    assert np.isnan(expected['time'].values[-1])
+    expected = expected.iloc[:-1].astype(np.float64)
+
+    module = load_importer('nu_plasma_Sr_importer.py', fileName)
+    module.import_data()
+    assert not module.IoLog.errors
+
+    for name in expected.columns.drop('time'):
+        np.testing.assert_array_equal(module.data.channels[name].values, expected[name].values)
@@ -0,0 +1,40 @@
+# The U-Th importer can correct the ion counters for dead time and the
+# Faradays for gain and bucket efficiency as it imports (correct_at_import).
+
+import numpy as np
+
+from importer_benchmark import load_importer, write_uth_txt
+
+script = 'nu_plasma_UTh_importer.py'
+
+
+def import_uth(fileName, correct_at_import=None):
+    module = load_importer(script, fileName)
+    if correct_at_import is not None:
+        module.correct_at_import = correct_at_import
+    module.import_data()
+    return module
+
+
+def test_corrections_are_off_by_default(tmp_path):
+    fileName = str(tmp_path / 'uth.txt')
+    write_uth_txt(fileName, 200)
+    default = import_uth(fileName)
+    assert 'Import corrections' not in default.data.channels['IC0 Cycle 1'].properties
+    assert default.data.channels.keys() == import_uth(fileName, False).data.channels.keys()
+
+
+def test_ion_counters_are_corrected_for_dead_time(tmp_path):
+    fileName = str(tmp_path / 'uth.txt')
+    write_uth_txt(fileName, 200)
+    raw = import_uth(fileName, False)
+    corrected = import_uth(fileName, True)
+    assert not corrected.IoLog.warnings
+
+    cps_per_volt = corrected.constants['CPS/Volts']
+    for name, dead_time in [('IC0 Cycle 1', 19.9), ('IC1 base 2', 20.0)]:
+        volts = raw.data.channels[name].values
+        assert 0 < volts.max()*cps_per_volt <= 5e5
+        channel = corrected.data.channels[name]
+        assert channel.properties['Dead time (ns)'] == dead_time
+        np.testing.assert_allclose(channel.values, volts/(1 - volts*cps_per_volt*dead_time*1e-9))
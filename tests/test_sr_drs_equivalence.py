@@ -0,0 +1,44 @@
+# The Sr DRSs can skip the points the mask leaves out (CompactMask), and
+# Sr_isotopes.py can recalculate only the data added since its last run
+# (Incremental). Both have to make the same channels as a full run.
+
+import gc
+
+import numpy as np
+import pytest
+
+from sr_mask_benchmark import make_session, run_case, settings
+from sr_incremental_check import load, made, run, session_step
+
+points = 40000
+
+
+def assert_same(full, other):
+    assert full.keys() == other.keys()
+    for name in full:
+        np.testing.assert_array_equal(full[name], other[name], err_msg=name)
+
+
+@pytest.mark.parametrize('limit', [None, 1.0])
+@pytest.mark.parametrize('script', sorted(settings))
+def test_compact_runs_match_full_runs(script, limit):
+    # with a limit of 1 the points are compacted whatever the duty cycle
+    result = run_case(script, points, 0.5, 1, limit)
+    assert result['same_channels']
+
+
+@pytest.mark.parametrize('duty_cycle', [0.2, 0.9])
+def test_incremental_runs_match_full_runs(duty_cycle):
+    channels, mask = make_session(points, duty_cycle)
+    sizes = [points//2, 3*points//4, points, points]
+
+    incremental = load(True)
+    for i, size in enumerate(sizes):
+        step, step_mask = session_step(channels, mask, size, i >= len(sizes) - 2)
+        run(incremental, step, step_mask)
+        full = load(False)
+        run(full, step, step_mask)
+        assert_same(made(full), made(incremental))
+        # the DRS module and the stand-in data refer to each other
+        del full
+        gc.collect()
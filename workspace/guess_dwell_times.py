@@ -1,15 +1,104 @@
 import numpy as np
 
-for c in data.timeSeriesList(data.Input):
-        if c.name == 'TotalBeam':
+# Input channels are in counts per second, so a change of one count between
+# readings is a step of 1000/dwell (ms) in the data. The dwell time of each
+# channel is estimated from the size of that step (the count quantum).
+#
+# Rather than taking the smallest difference between readings, which any bit
+# of noise throws off, a random sample of differences is taken from every
+# channel and stacked into one array, so that all channels are estimated at
+# once. Differences that are only noise on readings that didn't change are
+# dropped first (see below). The smallest of the rest give a first guess at
+# the quantum, which is then divided by 1, 2, ... max_divisor in case no
+# reading changed by just one count. The largest candidate that most
+# differences are a whole multiple of wins, and is refined from those
+# differences. Only differences of up to max_multiple quanta are fitted, as
+# any error in a candidate grows with the multiple. The fraction of those
+# that are whole multiples of the final quantum is reported as the
+# confidence.
+
+sample_size = 20000
+max_divisor = 8
+tolerance = 0.05        # how close to a whole multiple a difference must be
+min_confidence = 0.5    # below this the default dwell time is used instead
+default_dwell = 10
+min_gap = 3             # ratio between the largest noise and smallest count differences
+max_multiple = 10       # largest multiple of a candidate quantum that is fitted
+
+rng = np.random.default_rng(0)
+
+channels = [c for c in data.timeSeriesList(data.Input) if c.name != 'TotalBeam']
+
+diffs = np.full((len(channels), sample_size), np.nan)
+for i, c in enumerate(channels):
+        d = c.data()
+        if len(d) < 2:
                 continue
 
-        di = np.diff(c.data())
-        di = np.abs(di[~np.isnan(di)])
-        di = di[np.nonzero(di)]
-        guess = 1000/np.min(di)
-        if guess != guess:
-                guess = 10
+        idx = rng.integers(0, len(d) - 1, min(sample_size, len(d) - 1))
+        diffs[i, :len(idx)] = np.abs(d[idx + 1] - d[idx])
+
+# Differences of zero (or of rounding noise) carry no information
+scale = np.max(np.nan_to_num(diffs), axis=1)
+with np.errstate(invalid='ignore'):
+        diffs[~(diffs > 1e-9*scale[:, np.newaxis])] = np.nan
+
+# Nor do differences that are only noise on readings that didn't change. In
+# each channel's sorted differences they end at a gap: the next smallest are
+# a whole count (the quantum), several times larger. The first gap of at
+# least min_gap is taken as the top of the noise, leaving out the smallest
+# and largest 1% of the differences, which are too sparse to tell.
+sorted_diffs = np.sort(diffs, axis=1)
+n_diffs = np.sum(~np.isnan(diffs), axis=1)
+with np.errstate(invalid='ignore', divide='ignore'):
+        gaps = sorted_diffs[:, 1:]/sorted_diffs[:, :-1] >= min_gap
+position = np.arange(sample_size - 1)
+gaps &= position >= (n_diffs//100)[:, np.newaxis]
+gaps &= position < (n_diffs - n_diffs//100 - 1)[:, np.newaxis]
+noise = np.where(gaps.any(axis=1), sorted_diffs[np.arange(len(channels)), np.argmax(gaps, axis=1)], 0)
+with np.errstate(invalid='ignore'):
+        diffs[~(diffs > noise[:, np.newaxis])] = np.nan
+
+n_diffs = np.sum(~np.isnan(diffs), axis=1)
+# The 1st percentile of each channel's differences (NaNs sort to the end).
+# With noise any one difference is a little off, so this is moved to the
+# median of the differences within tolerance of it, a few times over as that
+# window starts off to one side of them.
+first_guess = np.sort(diffs, axis=1)[np.arange(len(channels)), n_diffs//100]
+for i in range(3):
+        with np.errstate(invalid='ignore'):
+                near = np.abs(diffs/first_guess[:, np.newaxis] - 1) < tolerance
+        found = np.any(near, axis=1)
+        first_guess[found] = np.nanmedian(np.where(near, diffs, np.nan)[found], axis=1)
+
+def fit(quantum):
+        """
+        The fraction of each channel's differences of up to max_multiple
+        quanta within tolerance of a whole (non-zero) multiple of quantum, and
+        which differences those are.
+        """
+        with np.errstate(invalid='ignore'):
+                r = diffs/quantum[:, np.newaxis]
+                fitted = r < max_multiple + 0.5
+                good = fitted & (np.abs(r - np.round(r)) < tolerance) & (r > 0.5)
+
+        return np.sum(good, axis=1)/np.maximum(np.sum(fitted, axis=1), 1), good
+
+fits = np.array([fit(first_guess/k)[0] for k in range(1, max_divisor + 1)])
+divisor = 1 + np.argmax(fits >= 0.9*fits.max(axis=0), axis=0)
+quantum = first_guess/divisor
+
+# Refine the quantum from all of the differences that fit it
+confidence, good = fit(quantum)
+with np.errstate(invalid='ignore', divide='ignore'):
+        quanta = np.where(good, diffs/np.round(diffs/quantum[:, np.newaxis]), np.nan)
+refined = np.any(good, axis=1)
+quantum[refined] = np.nanmedian(quanta[refined], axis=1)
+
+for c, q, conf in zip(channels, quantum, confidence):
+        guess = 1000/q
+        if not conf >= min_confidence or guess != guess:
+                guess = default_dwell
 
-        print('%s = %i'%(c.name, guess))
-        c.setProperty('Dwell Time (ms)', guess)
\ No newline at end of file
+        print('%s = %i (confidence %.2f)'%(c.name, guess, conf))
+        c.setProperty('Dwell Time (ms)', guess)